@@ -0,0 +1,22 @@
+"""Shared helpers for the benchmark scripts."""
+
+import timeit
+from typing import Callable
+
+
+def print_header(title: str):
+    print(title)
+    print("=" * len(title))
+
+
+def print_result(label: str, seconds: float, count: int, unit: str = "op"):
+    """Print the throughput and per-item cost of a timed run."""
+    print(
+        f"{label:<40} {count / seconds:>14,.0f} {unit}/s"
+        f" {seconds / count * 1e6:>10.2f} us/{unit}"
+    )
+
+
+def best_of(func: Callable[[], object], repeat: int = 5) -> float:
+    """Time a function a few times, and return the fastest run in seconds."""
+    return min(timeit.repeat(func, number=1, repeat=repeat))
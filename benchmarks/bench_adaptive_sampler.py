@@ -0,0 +1,104 @@
+"""Benchmark the adaptive sampler's overhead, and how it reacts to a spike.
+
+The first table is the cost of a sampling decision with the SDK's
+`LocalSampler`, on its own and wrapped in an `AdaptiveSampler`.
+
+The second table simulates a spike in traffic. Each step is one adjustment
+interval, in which some requests are sampled with a rate of 1 (so the
+wrapped sampler samples everything), and their segments are added to a fake
+emitter queue that can only send a fixed number of segments per step. With
+the plain sampler the queue grows until the emitter starts dropping
+segments, while the adaptive sampler backs off and then recovers.
+"""
+
+import time
+
+from _common import best_of
+from _common import print_header
+from _common import print_result
+from aws_xray_sdk.core.sampling.local.sampler import LocalSampler
+
+from xraysink.sampling.adaptive import AdaptiveSampler
+
+#: Number of decisions made by each timed run.
+DECISION_COUNT = 100_000
+
+#: Local sampling rules that sample every request.
+RULES = {"version": 2, "rules": [], "default": {"fixed_target": 0, "rate": 1.0}}
+
+#: Number of requests in each step of the simulated spike.
+SPIKE = [200] * 3 + [2_000] * 5 + [200] * 8
+
+#: Number of segments that the fake emitter sends in each step.
+SEND_CAPACITY = 500
+
+#: Maximum number of segments in the fake emitter's queue.
+MAX_QUEUE_SIZE = 1_000
+
+#: Number of seconds in each step of the simulation.
+STEP_SECONDS = 0.05
+
+
+class _FakeEmitter:
+    queue_depth = 0
+    dropped = 0
+
+    def send(self, count: int):
+        accepted = min(count, MAX_QUEUE_SIZE - self.queue_depth)
+        self.dropped += count - accepted
+        self.queue_depth = max(0, self.queue_depth + accepted - SEND_CAPACITY)
+
+
+def _run_decisions(sampler) -> float:
+    def _decisions():
+        should_trace = sampler.should_trace
+        request = {"host": "example.com", "method": "GET", "path": "/api"}
+        for _ in range(DECISION_COUNT):
+            should_trace(request)
+
+    return best_of(_decisions)
+
+
+def _simulate(label: str, make_sampler):
+    emitter = _FakeEmitter()
+    sampler = make_sampler(emitter)
+    print(f"{label}:")
+    print("  requests    traced   queue  dropped  fraction")
+    for requests in SPIKE:
+        step_end = time.monotonic() + STEP_SECONDS
+        traced = sum(1 for _ in range(requests) if sampler.should_trace())
+        emitter.send(traced)
+        print(
+            f"  {requests:>8,} {traced:>9,} {emitter.queue_depth:>7,}"
+            f" {emitter.dropped:>8,}"
+            f"  {getattr(sampler, 'fraction', 1.0):>8.2f}"
+        )
+        time.sleep(max(0.0, step_end - time.monotonic()))
+    print()
+
+
+def main():
+    print_header(f"Sampling decisions ({DECISION_COUNT:,} per run)")
+    print_result("LocalSampler", _run_decisions(LocalSampler(RULES)), DECISION_COUNT)
+    print_result(
+        "AdaptiveSampler(LocalSampler)",
+        _run_decisions(AdaptiveSampler(LocalSampler(RULES))),
+        DECISION_COUNT,
+    )
+    print()
+
+    print_header("Spike in traffic")
+    _simulate("LocalSampler", lambda emitter: LocalSampler(RULES))
+    _simulate(
+        "AdaptiveSampler(LocalSampler)",
+        lambda emitter: AdaptiveSampler(
+            LocalSampler(RULES),
+            emitter=emitter,
+            max_queue_depth=SEND_CAPACITY,
+            adjust_interval=STEP_SECONDS,
+        ),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Benchmark a request that makes thousands of identical calls.
+
+Compares the time to trace the request, the number of subsegments retained,
+and the size of the emitted segment document, with and without subsegment
+aggregation.
+"""
+
+import asyncio
+import time
+
+from _common import print_header
+from aws_xray_sdk.core import xray_recorder
+
+from xraysink.aggregation import SubsegmentAggregation
+from xraysink.context import ContextVarAsyncContext
+
+#: Number of identical calls made by the request.
+CALL_COUNT = 5000
+
+#: Number of distinct operations that the calls are spread over.
+OPERATION_COUNT = 3
+
+
+async def _handle_request():
+    async with xray_recorder.in_segment_async("request"):
+        for i in range(CALL_COUNT):
+            async with xray_recorder.in_subsegment_async(
+                f"redis-{i % OPERATION_COUNT}", namespace="remote"
+            ):
+                pass
+
+
+def _run(context):
+    emitted = []
+    xray_recorder.configure(service="benchmark", sampling=False, context=context)
+    xray_recorder.emitter.send_entity = emitted.append
+
+    start = time.perf_counter()
+    asyncio.run(_handle_request())
+    seconds = time.perf_counter() - start
+
+    (segment,) = emitted
+    return seconds, len(segment.subsegments), len(segment.serialize())
+
+
+def main():
+    # Stream subsegments only at the end, so the whole document is measured
+    xray_recorder.configure(streaming_threshold=CALL_COUNT * 2)
+
+    print_header(f"Request with {CALL_COUNT:,} calls to {OPERATION_COUNT} operations")
+    for label, context in [
+        ("no aggregation", ContextVarAsyncContext()),
+        ("aggregation", ContextVarAsyncContext(aggregation=SubsegmentAggregation())),
+    ]:
+        seconds, retained, size = _run(context)
+        print(
+            f"{label:<20} {seconds * 1000:>8.1f} ms"
+            f" {retained:>8,} subsegments {size:>12,} bytes"
+        )
+
+
+if __name__ == "__main__":
+    main()
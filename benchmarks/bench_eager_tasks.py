@@ -0,0 +1,97 @@
+"""Benchmark task latency with eager tasks and X-Ray tracing.
+
+With `asyncio.eager_task_factory` (Python 3.12+), a task that doesn't need to
+suspend runs to completion inside `create_task()`, without a round-trip
+through the event loop. This compares the latency of such tasks with the
+default and eager task factories, with and without the X-Ray context, and
+reports how many tasks completed eagerly.
+"""
+
+import asyncio
+import time
+
+from _common import print_header
+from aws_xray_sdk.core.async_recorder import AsyncAWSXRayRecorder
+
+from xraysink.context import AsyncContext
+from xraysink.context import ContextVarAsyncContext
+
+#: Number of tasks created by each run.
+TASK_COUNT = 20_000
+
+
+async def _traced_work(recorder):
+    """A short piece of work that doesn't need to suspend."""
+    if recorder is not None:
+        async with recorder.in_subsegment_async("work"):
+            return 42
+    return 42
+
+
+async def _measure(recorder) -> tuple:
+    """Measure the latency from creating each task to getting it's result."""
+    if recorder is not None:
+        recorder.begin_segment("benchmark")
+
+    eager_count = 0
+    total_latency = 0.0
+    for _ in range(TASK_COUNT):
+        start = time.perf_counter()
+        task = asyncio.create_task(_traced_work(recorder))
+        if task.done():
+            eager_count += 1
+        await task
+        total_latency += time.perf_counter() - start
+
+    if recorder is not None:
+        recorder.end_segment()
+
+    return total_latency / TASK_COUNT, eager_count
+
+
+def _run(task_factory, context_class) -> tuple:
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.set_task_factory(task_factory)
+
+        recorder = None
+        if context_class is not None:
+            recorder = AsyncAWSXRayRecorder()
+            recorder.configure(
+                service="benchmark",
+                sampling=False,
+                streaming_threshold=TASK_COUNT * 2,
+                context=context_class(loop=loop),
+            )
+            recorder.emitter.send_entity = lambda entity: None
+
+        return loop.run_until_complete(_measure(recorder))
+    finally:
+        loop.close()
+
+
+def main():
+    task_factories = [("default factory", None)]
+    if hasattr(asyncio, "eager_task_factory"):
+        task_factories.append(("eager factory", asyncio.eager_task_factory))
+    else:
+        print("Eager tasks need Python 3.12+. Only the default factory is compared.")
+
+    print_header(f"Task latency ({TASK_COUNT:,} sequential tasks per run)")
+    for factory_label, task_factory in task_factories:
+        for context_label, context_class in [
+            ("no tracing", None),
+            ("AsyncContext", AsyncContext),
+            ("ContextVarAsyncContext", ContextVarAsyncContext),
+        ]:
+            latency, eager_count = _run(task_factory, context_class)
+            print(
+                f"{factory_label + ', ' + context_label:<40}"
+                f" {latency * 1e6:>8.2f} us/task"
+                f" {eager_count / TASK_COUNT:>8.0%} eager"
+            )
+
+
+if __name__ == "__main__":
+    main()
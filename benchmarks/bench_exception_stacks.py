@@ -0,0 +1,111 @@
+"""Benchmark recording the same exception for many failed requests.
+
+A trivial ASGI application raises the same exception from a few calls deep,
+for every request. This compares the cost per request of recording the
+exception (including serialising the segment), and the size of the
+segments, when the stack trace is captured for every request and when it
+is deduplicated by a `StackDeduplicator`.
+"""
+
+import asyncio
+import time
+from contextlib import suppress
+
+from _common import print_header
+from _common import print_result
+from aws_xray_sdk.core import xray_recorder
+
+from xraysink.asgi.middleware import XRayASGIMiddleware
+from xraysink.context import ContextVarAsyncContext
+from xraysink.emitters.serialization import serialize_entity
+from xraysink.stacks import StackDeduplicator
+
+#: Number of failed requests made by each run.
+REQUEST_COUNT = 10_000
+
+#: Number of nested calls in the application before the exception is raised.
+CALL_DEPTH = 20
+
+SCOPE = {
+    "type": "http",
+    "method": "GET",
+    "scheme": "http",
+    "path": "/api/items",
+    "root_path": "",
+    "query_string": b"",
+    "headers": [(b"host", b"example.com"), (b"user-agent", b"bench/1.0")],
+    "client": ("10.0.0.1", 43567),
+    "server": ("10.0.0.12", 8080),
+}
+
+
+class _SerializingEmitter:
+    """Emitter that serialises each segment, like a real emitter would."""
+
+    def __init__(self):
+        self.bytes_sent = 0
+
+    def send_entity(self, entity):
+        self.bytes_sent += len(serialize_entity(entity))
+
+    def set_daemon_address(self, address):
+        pass
+
+
+def _call(depth: int):
+    if depth == 0:
+        raise KeyError("missing-item")
+    _call(depth - 1)
+
+
+async def _app(scope, receive, send):
+    _call(CALL_DEPTH)
+
+
+async def _receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def _send(message):
+    pass
+
+
+async def _requests(app):
+    for _ in range(REQUEST_COUNT):
+        with suppress(KeyError):
+            await app(SCOPE, _receive, _send)
+
+
+def _run(loop, label: str, stack_deduplicator=None):
+    emitter = _SerializingEmitter()
+    xray_recorder.configure(emitter=emitter)
+    app = XRayASGIMiddleware(_app, stack_deduplicator=stack_deduplicator)
+
+    start = time.perf_counter()
+    loop.run_until_complete(_requests(app))
+    elapsed = time.perf_counter() - start
+
+    print_result(label, elapsed, REQUEST_COUNT, "request")
+    print(f"{'':<40} {emitter.bytes_sent / REQUEST_COUNT:>10,.0f} bytes/segment")
+
+
+def main():
+    loop = asyncio.new_event_loop()
+    xray_recorder.configure(
+        service="bench",
+        sampling=False,
+        context=ContextVarAsyncContext(),
+        context_missing="IGNORE_ERROR",
+    )
+
+    print_header(
+        f"{REQUEST_COUNT:,} requests raising the same exception,"
+        f" {CALL_DEPTH} calls deep"
+    )
+    _run(loop, "Stack for every request")
+    _run(loop, "StackDeduplicator", StackDeduplicator())
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Benchmark the per-request overhead of the middleware for a health check.
+
+Compares calling a trivial ASGI application directly, through the tracing
+middleware, and through the tracing middleware with the health check path
+excluded from tracing.
+"""
+
+import asyncio
+
+from _common import best_of
+from _common import print_header
+from _common import print_result
+from aws_xray_sdk.core import xray_recorder
+
+from xraysink.asgi.middleware import XRayASGIMiddleware
+from xraysink.context import ContextVarAsyncContext
+
+#: Number of health check requests made by each timed run.
+REQUEST_COUNT = 20_000
+
+#: The ASGI scope for a health check request from a load balancer.
+SCOPE = {
+    "type": "http",
+    "method": "GET",
+    "scheme": "http",
+    "path": "/health",
+    "root_path": "",
+    "query_string": b"",
+    "headers": [
+        (b"host", b"10.0.0.12:8080"),
+        (b"user-agent", b"ELB-HealthChecker/2.0"),
+        (b"accept-encoding", b"gzip, compressed"),
+        (b"connection", b"close"),
+    ],
+    "client": ("10.0.0.1", 43567),
+    "server": ("10.0.0.12", 8080),
+}
+
+
+async def _health_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+async def _receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def _send(message):
+    pass
+
+
+async def _probe(app):
+    for _ in range(REQUEST_COUNT):
+        await app(SCOPE, _receive, _send)
+
+
+def _run(loop, app) -> float:
+    return best_of(lambda: loop.run_until_complete(_probe(app)))
+
+
+def main():
+    xray_recorder.configure(
+        service="benchmark", sampling=False, context=ContextVarAsyncContext()
+    )
+    xray_recorder.emitter.send_entity = lambda entity: None
+
+    loop = asyncio.new_event_loop()
+    try:
+        print_header(f"Health check overhead ({REQUEST_COUNT:,} requests per run)")
+        for label, app in [
+            ("no middleware", _health_app),
+            ("traced", XRayASGIMiddleware(_health_app)),
+            (
+                "excluded",
+                XRayASGIMiddleware(_health_app, exclude_paths=["/health", "/ready"]),
+            ),
+        ]:
+            seconds = _run(loop, app)
+            print_result(label, seconds, REQUEST_COUNT, "req")
+    finally:
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Benchmark the per-request header handling in the middleware.
+
+Compares the previous approach (build a case-insensitive header mapping,
+parse the trace header from it, then match the host against the dynamic
+naming pattern) with a single scan of the raw ASGI headers, a single-pass
+trace header parser, and the cached segment name.
+"""
+
+from _common import best_of
+from _common import print_header
+from _common import print_result
+from aws_xray_sdk.core import xray_recorder
+from aws_xray_sdk.ext.util import calculate_segment_name
+from aws_xray_sdk.ext.util import construct_xray_header
+from starlette.datastructures import Headers
+
+from xraysink.asgi.middleware import _get_segment_name
+from xraysink.asgi.middleware import _parse_trace_header
+from xraysink.asgi.middleware import _RequestHeaders
+
+#: Number of requests processed by each timed run.
+REQUEST_COUNT = 50_000
+
+#: A realistic set of request headers, as they appear in an ASGI scope.
+RAW_HEADERS = [
+    (b"host", b"api.example.com"),
+    (b"user-agent", b"Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Firefox/119.0"),
+    (b"accept", b"application/json, text/plain, */*"),
+    (b"accept-language", b"en-GB,en;q=0.5"),
+    (b"accept-encoding", b"gzip, deflate, br"),
+    (b"content-type", b"application/json"),
+    (b"content-length", b"348"),
+    (b"origin", b"https://www.example.com"),
+    (b"referer", b"https://www.example.com/"),
+    (b"authorization", b"Bearer eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.e30.abc"),
+    (b"cookie", b"session=0123456789abcdef; theme=dark"),
+    (b"x-forwarded-for", b"203.0.113.7"),
+    (b"x-forwarded-proto", b"https"),
+    (
+        b"x-amzn-trace-id",
+        b"Root=1-5759e988-bd862e3fe1be46a994272793;Parent=53995c3f42cd8ad8;Sampled=1",
+    ),
+    (b"sec-fetch-mode", b"cors"),
+]
+
+
+def _old_handling():
+    headers = Headers(raw=RAW_HEADERS)
+    xray_header = construct_xray_header(headers)
+    name = calculate_segment_name(
+        headers.get("host", "localhost").split(":", 1)[0], xray_recorder
+    )
+    return (
+        xray_header,
+        name,
+        headers.get("user-agent"),
+        headers.get("x-forwarded-for"),
+    )
+
+
+def _new_handling():
+    headers = _RequestHeaders.from_raw(RAW_HEADERS)
+    xray_header = _parse_trace_header(headers.trace_header)
+    name = _get_segment_name(headers.host)
+    return xray_header, name, headers.user_agent, headers.forwarded_for
+
+
+def _run(func) -> float:
+    def _requests():
+        for _ in range(REQUEST_COUNT):
+            func()
+
+    return best_of(_requests)
+
+
+def main():
+    xray_recorder.configure(service="benchmark", dynamic_naming="*.example.com")
+
+    print_header(f"Request header handling ({REQUEST_COUNT:,} requests per run)")
+    print_result("mapping + uncached name", _run(_old_handling), REQUEST_COUNT, "req")
+    print_result("raw scan + cached name", _run(_new_handling), REQUEST_COUNT, "req")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Benchmark emitting bursts of segments from many worker processes.
+
+Each writer process emits a burst of segments as fast as it can, either with
+the SDK's `UDPEmitter` (one socket per process, sending inline), or with a
+`SharedRingBufferEmitter` and a single collector thread in this process
+(with the default maximum send rate, and without one). A fake daemon in its
+own process counts the datagrams that it receives, so segments dropped by its
+receive buffer show up as lost.
+
+This fails if the ring buffer with its default send rate loses more segments
+than the `UDPEmitter` (give or take `LOSS_TOLERANCE`).
+"""
+
+import multiprocessing
+import os
+import socket
+import time
+from contextlib import suppress
+
+from _common import print_header
+from _common import print_result
+from aws_xray_sdk.core.emitters.udp_emitter import UDPEmitter
+from aws_xray_sdk.core.models.segment import Segment
+from aws_xray_sdk.core.models.subsegment import Subsegment
+
+from xraysink.emitters.ring_buffer import DEFAULT_MAX_SEND_RATE
+from xraysink.emitters.ring_buffer import SharedRingBufferCollector
+from xraysink.emitters.ring_buffer import SharedRingBufferEmitter
+from xraysink.shared_memory import SHARED_MEMORY_DIR
+
+#: Number of writer processes in each run.
+WRITER_COUNTS = (4, 16)
+
+#: Number of segments emitted by each writer.
+SEGMENTS_PER_WRITER = 2_000
+
+#: Number of subsegments in each segment.
+SUBSEGMENT_COUNT = 5
+
+#: Number of seconds without a datagram before the fake daemon stops.
+DAEMON_IDLE_TIMEOUT = 1.0
+
+#: Size in bytes of the ring for each writer process.
+RING_SIZE = 4 * 1024 * 1024
+
+#: Fraction of the segments that the ring buffer may lose, beyond the fraction
+#: lost by the `UDPEmitter`, to allow for noise between runs.
+LOSS_TOLERANCE = 0.005
+
+#: Name of the shared memory file used by the benchmark.
+SHARED_MEMORY_NAME = "xraysink-benchmark-ring"
+
+_context = multiprocessing.get_context("fork")
+
+
+def _make_segment(i: int) -> Segment:
+    segment = Segment(f"request-{i}")
+    for j in range(SUBSEGMENT_COUNT):
+        subsegment = Subsegment(f"call-{j}", "remote", segment)
+        segment.add_subsegment(subsegment)
+        subsegment.close()
+        segment.decrement_ref_counter()
+    segment.close()
+    return segment
+
+
+def _run_daemon(sock: socket.socket, ready, results):
+    """Fake daemon that counts datagrams until it has been idle for a while."""
+    count = 0
+    sock.settimeout(None)
+    ready.set()
+    while True:
+        sock.recv(65536)
+        count += 1
+        sock.settimeout(DAEMON_IDLE_TIMEOUT)
+        try:
+            while True:
+                sock.recv(65536)
+                count += 1
+        except socket.timeout:
+            results.put(count)
+            return
+
+
+def _run_writer(make_emitter, barrier, results):
+    emitter = make_emitter()
+    segments = [_make_segment(i) for i in range(SEGMENTS_PER_WRITER)]
+    barrier.wait()
+    start = time.perf_counter()
+    for segment in segments:
+        emitter.send_entity(segment)
+    elapsed = time.perf_counter() - start
+    dropped = getattr(emitter, "dropped", 0)
+    if hasattr(emitter, "shutdown"):
+        emitter.shutdown()
+    results.put((elapsed, dropped))
+
+
+def _run(label: str, writer_count: int, make_emitter, collector=None) -> float:
+    """Run the writers, and get the fraction of the segments that were lost."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    host, port = sock.getsockname()
+    address = f"{host}:{port}"
+
+    daemon_results = _context.Queue()
+    ready = _context.Event()
+    daemon = _context.Process(target=_run_daemon, args=(sock, ready, daemon_results))
+    daemon.start()
+    ready.wait()
+
+    if collector is not None:
+        collector = collector(address)
+        collector.start()
+
+    barrier = _context.Barrier(writer_count)
+    writer_results = _context.Queue()
+    writers = [
+        _context.Process(
+            target=_run_writer,
+            args=(lambda: make_emitter(address), barrier, writer_results),
+        )
+        for _ in range(writer_count)
+    ]
+    for writer in writers:
+        writer.start()
+    results = [writer_results.get() for _ in writers]
+    for writer in writers:
+        writer.join()
+
+    if collector is not None:
+        collector.shutdown()
+    received = daemon_results.get()
+    daemon.join()
+    sock.close()
+
+    total = writer_count * SEGMENTS_PER_WRITER
+    elapsed = max(result[0] for result in results)
+    dropped = sum(result[1] for result in results)
+    print_result(f"{label}, {writer_count} writers", elapsed, total, "segment")
+    print(
+        f"{'':<40} delivered {received:>7,} / {total:,}"
+        f"  lost {total - received:>7,} ({(total - received) / total:.1%})"
+        f"  dropped by emitter {dropped:,}"
+    )
+    return (total - received) / total
+
+
+def _remove_ring_buffer():
+    with suppress(FileNotFoundError):
+        os.unlink(os.path.join(SHARED_MEMORY_DIR, SHARED_MEMORY_NAME))
+
+
+def main():
+    print_header(
+        f"Bursts of {SEGMENTS_PER_WRITER:,} segments per writer process"
+        f" ({SUBSEGMENT_COUNT} subsegments each)"
+    )
+    for writer_count in WRITER_COUNTS:
+        udp_loss = _run("UDPEmitter", writer_count, lambda address: UDPEmitter(address))
+
+        ring_losses = {}
+        for label, max_send_rate in [
+            ("Ring buffer", DEFAULT_MAX_SEND_RATE),
+            ("Ring buffer, no rate limit", None),
+        ]:
+            _remove_ring_buffer()
+            try:
+                ring_losses[max_send_rate] = _run(
+                    label,
+                    writer_count,
+                    lambda address: SharedRingBufferEmitter(
+                        SHARED_MEMORY_NAME, ring_size=RING_SIZE
+                    ),
+                    collector=lambda address, rate=max_send_rate: (
+                        SharedRingBufferCollector(
+                            SHARED_MEMORY_NAME,
+                            address,
+                            ring_size=RING_SIZE,
+                            max_send_rate=rate,
+                        )
+                    ),
+                )
+            finally:
+                _remove_ring_buffer()
+
+        ring_loss = ring_losses[DEFAULT_MAX_SEND_RATE]
+        assert ring_loss <= udp_loss + LOSS_TOLERANCE, (
+            f"Ring buffer lost {ring_loss:.1%} of segments with {writer_count}"
+            f" writers, but UDPEmitter only lost {udp_loss:.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Benchmark sampling decisions with a large set of centralized sampling rules.
+
+Compares the SDK's `DefaultSampler`, which matches each request against every
+rule in turn, with the `IndexedSampler`. Requests either repeat a small set of
+routes (so the per-route cache is effective), or all have a distinct path.
+"""
+
+import random
+import time
+
+from _common import best_of
+from _common import print_header
+from _common import print_result
+from aws_xray_sdk.core.sampling.sampler import DefaultSampler
+from aws_xray_sdk.core.sampling.sampling_rule import SamplingRule
+
+from xraysink.sampling.rule_index import IndexedSampler
+
+#: Number of sampling decisions made by each timed run.
+REQUEST_COUNT = 2_000
+
+#: Number of timed runs for each sampler.
+REPEAT = 3
+
+#: Number of distinct routes that requests are made to.
+ROUTE_COUNT = 50
+
+#: Number of synthetic centralized sampling rules.
+RULE_COUNTS = (10, 100, 1000)
+
+
+def _make_rules(count: int):
+    """Make a synthetic set of rules, each for a different API route."""
+    rules = [
+        SamplingRule(
+            "Default", 10000, 0.05, 1, "*", "*", "*", service="*", service_type="*"
+        )
+    ]
+    for i in range(count):
+        rules.append(
+            SamplingRule(
+                f"rule-{i}",
+                priority=100 + i,
+                rate=0.1,
+                reservoir_size=1,
+                host="*",
+                method="*",
+                path=f"/api/v1/resource-{i}/*",
+                service="*",
+                service_type="*",
+            )
+        )
+    return rules
+
+
+def _make_sampler(sampler_class, rules):
+    sampler = sampler_class()
+    sampler._started = True  # Don't poll the X-Ray daemon
+    sampler._cache.load_rules(rules)
+    sampler._cache.last_updated = int(time.time())
+    return sampler
+
+
+def _make_requests(rule_count: int, distinct_paths: bool, repeat: int):
+    """Make a batch of sampling requests for each timed run."""
+    rng = random.Random(42)
+
+    # Some requests don't match any rule, so use the default rule
+    routes = [
+        f"/api/v1/resource-{rng.randrange(rule_count + 10)}" for _ in range(ROUTE_COUNT)
+    ]
+
+    batches = []
+    for run in range(repeat):
+        batch = []
+        for i in range(REQUEST_COUNT):
+            # Distinct paths are never repeated, even in a different run
+            item = f"{run}-{i}" if distinct_paths else "item"
+            batch.append(
+                {
+                    "host": "api.example.com",
+                    "method": "GET",
+                    "path": f"{rng.choice(routes)}/{item}",
+                    "service": "benchmark",
+                }
+            )
+        batches.append(batch)
+    return batches
+
+
+def _run(sampler, batches) -> float:
+    batches = iter(batches)
+
+    def _decisions():
+        for sampling_req in next(batches):
+            sampler.should_trace(sampling_req)
+
+    return best_of(_decisions, repeat=REPEAT)
+
+
+def main():
+    print_header(f"Sampling decisions ({REQUEST_COUNT:,} requests per run)")
+    for rule_count in RULE_COUNTS:
+        rules = _make_rules(rule_count)
+        for paths_label, distinct_paths in [("repeated", False), ("distinct", True)]:
+            batches = _make_requests(rule_count, distinct_paths, REPEAT)
+            for label, sampler_class in [
+                ("DefaultSampler", DefaultSampler),
+                ("IndexedSampler", IndexedSampler),
+            ]:
+                sampler = _make_sampler(sampler_class, rules)
+                print_result(
+                    f"{label}, {rule_count} rules, {paths_label}",
+                    _run(sampler, batches),
+                    REQUEST_COUNT,
+                    "req",
+                )
+
+
+if __name__ == "__main__":
+    main()
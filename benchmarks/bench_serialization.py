@@ -0,0 +1,72 @@
+"""Benchmark serialising segments with lots of subsegments.
+
+Compares the SDK's `Entity.serialize()` with `serialize_entity()`, which walks
+the entity tree more cheaply and re-uses a single C JSON encoder.
+"""
+
+from _common import best_of
+from _common import print_header
+from _common import print_result
+from aws_xray_sdk.core.models.segment import Segment
+from aws_xray_sdk.core.models.subsegment import Subsegment
+
+from xraysink.emitters.serialization import serialize_entity
+
+#: Number of subsegments in each benchmarked segment.
+SUBSEGMENT_COUNTS = (10, 100, 1000)
+
+#: Number of segments serialised by each timed run, for each subsegment count.
+SEGMENT_COUNTS = {10: 2000, 100: 200, 1000: 20}
+
+
+def _make_segment(subsegment_count: int) -> Segment:
+    """Make a typical segment for a request that calls other services."""
+    segment = Segment("benchmark")
+    segment.put_http_meta("url", "https://api.example.com/users/123")
+    segment.put_http_meta("method", "GET")
+    segment.put_http_meta("status", 200)
+    segment.put_annotation("route", "/users/{user_id}")
+
+    for i in range(subsegment_count):
+        subsegment = Subsegment(f"downstream-{i % 10}", "remote", segment)
+        segment.add_subsegment(subsegment)
+        subsegment.namespace = "remote"
+        subsegment.put_http_meta("url", f"http://downstream-{i % 10}/items/{i}")
+        subsegment.put_http_meta("method", "GET")
+        subsegment.put_http_meta("status", 200)
+        subsegment.put_annotation("index", i)
+        subsegment.close()
+
+    segment.close()
+    return segment
+
+
+def _run(serialize, segment, count: int) -> float:
+    def _serialize_all():
+        for _ in range(count):
+            serialize(segment)
+
+    return best_of(_serialize_all)
+
+
+def main():
+    print_header("Segment serialisation")
+    for subsegment_count in SUBSEGMENT_COUNTS:
+        segment = _make_segment(subsegment_count)
+        count = SEGMENT_COUNTS[subsegment_count]
+        assert serialize_entity(segment) == segment.serialize()
+
+        for label, serialize in [
+            ("Entity.serialize", Segment.serialize),
+            ("serialize_entity", serialize_entity),
+        ]:
+            print_result(
+                f"{label}, {subsegment_count} subsegments",
+                _run(serialize, segment, count),
+                count,
+                "seg",
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Benchmark the shared reservoir against the SDK's per-process reservoir.
+
+Under load, almost every decision is made once the reservoir for the current
+second has been used up, which the shared reservoir checks without taking its
+lock. Decisions that take a trace from the reservoir do take the lock.
+"""
+
+from _common import best_of
+from _common import print_header
+from _common import print_result
+from aws_xray_sdk.core.sampling.local.reservoir import Reservoir
+
+from xraysink.sampling.shared_reservoir import SharedReservoirSampler
+
+#: Number of decisions made by each timed run.
+DECISION_COUNT = 100_000
+
+#: Name of the shared memory file used by the benchmark.
+SHARED_MEMORY_NAME = "xraysink-benchmark"
+
+
+def _run(reservoir) -> float:
+    def _decisions():
+        take = reservoir.take
+        for _ in range(DECISION_COUNT):
+            take()
+
+    return best_of(_decisions)
+
+
+def main():
+    sampler = SharedReservoirSampler(SHARED_MEMORY_NAME)
+    shared = sampler._default_rule.reservoir
+    try:
+        print_header(f"Reservoir decisions ({DECISION_COUNT:,} per run)")
+        for label, traces_per_sec in [
+            ("used up", 1),
+            ("taking a trace", 1_000_000_000),
+        ]:
+            shared.traces_per_sec = traces_per_sec
+            for reservoir_label, reservoir in [
+                ("SDK Reservoir", Reservoir(traces_per_sec)),
+                ("SharedReservoir", shared),
+            ]:
+                print_result(
+                    f"{reservoir_label}, {label}",
+                    _run(reservoir),
+                    DECISION_COUNT,
+                    "decision",
+                )
+    finally:
+        sampler.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Benchmark tail sampling against head sampling, for requests with rare outliers.
+
+A trivial ASGI application is called through the tracing middleware. A small
+fraction of the requests fail with a 500 response, and another small
+fraction are slow. Head sampling samples a fixed fraction of the requests,
+while tail sampling records every request and keeps the outliers plus a
+smaller baseline fraction. The table shows the cost per request, how many
+segments were emitted, and how many of the outliers were emitted.
+"""
+
+import asyncio
+import time
+
+from _common import print_header
+from _common import print_result
+from aws_xray_sdk.core import xray_recorder
+from aws_xray_sdk.core.sampling.local.sampler import LocalSampler
+
+from xraysink.asgi.middleware import XRayASGIMiddleware
+from xraysink.context import ContextVarAsyncContext
+from xraysink.sampling.tail import TailSampler
+
+#: Number of requests made by each run.
+REQUEST_COUNT = 20_000
+
+#: Every request with an index that is a multiple of this fails.
+FAILURE_INTERVAL = 200
+
+#: Every request with an index that is a multiple of this (offset by one) is slow.
+SLOW_INTERVAL = 250
+
+#: Number of seconds that a slow request takes.
+SLOW_SECONDS = 0.003
+
+#: Duration (in seconds) above which tail sampling keeps a request.
+LATENCY_THRESHOLD = 0.002
+
+#: Fraction of requests sampled by head sampling.
+HEAD_RATE = 0.05
+
+#: Fraction of ordinary requests kept by tail sampling.
+BASELINE_RATE = 0.01
+
+SCOPE = {
+    "type": "http",
+    "method": "GET",
+    "scheme": "http",
+    "path": "/api/items",
+    "root_path": "",
+    "query_string": b"",
+    "headers": [(b"host", b"example.com"), (b"user-agent", b"bench/1.0")],
+    "client": ("10.0.0.1", 43567),
+    "server": ("10.0.0.12", 8080),
+}
+
+
+class _CountingEmitter:
+    def __init__(self):
+        self.segments = []
+
+    def send_entity(self, entity):
+        self.segments.append(entity)
+
+    def set_daemon_address(self, address):
+        pass
+
+
+async def _app(scope, receive, send):
+    index = scope["index"]
+    if index % SLOW_INTERVAL == 1:
+        time.sleep(SLOW_SECONDS)
+    status = 500 if index % FAILURE_INTERVAL == 0 else 200
+    await send({"type": "http.response.start", "status": status, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+async def _receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def _send(message):
+    pass
+
+
+async def _requests(app):
+    for index in range(REQUEST_COUNT):
+        await app(dict(SCOPE, index=index), _receive, _send)
+
+
+def _make_sampler(rate: float) -> LocalSampler:
+    return LocalSampler(
+        {"version": 2, "rules": [], "default": {"fixed_target": 0, "rate": rate}}
+    )
+
+
+def _run(loop, label: str, rate: float, make_tail_sampler=None):
+    emitter = _CountingEmitter()
+    tail_sampler = None if make_tail_sampler is None else make_tail_sampler(emitter)
+    xray_recorder.configure(
+        sampling=True,
+        sampler=_make_sampler(rate),
+        emitter=emitter if tail_sampler is None else tail_sampler,
+    )
+    app = XRayASGIMiddleware(_app, tail_sampler=tail_sampler)
+
+    start = time.perf_counter()
+    loop.run_until_complete(_requests(app))
+    elapsed = time.perf_counter() - start
+
+    failed = sum(
+        1 for segment in emitter.segments if segment.http["response"]["status"] == 500
+    )
+    slow = sum(
+        1
+        for segment in emitter.segments
+        if segment.end_time - segment.start_time >= SLOW_SECONDS
+    )
+    print_result(label, elapsed, REQUEST_COUNT, "request")
+    print(
+        f"{'':<40} emitted {len(emitter.segments):>6,}"
+        f"  failed {failed:>4,} / {REQUEST_COUNT // FAILURE_INTERVAL:,}"
+        f"  slow {slow:>4,} / {REQUEST_COUNT // SLOW_INTERVAL:,}"
+    )
+
+
+def main():
+    loop = asyncio.new_event_loop()
+    xray_recorder.configure(
+        service="bench",
+        context=ContextVarAsyncContext(),
+        context_missing="IGNORE_ERROR",
+    )
+
+    print_header(
+        f"{REQUEST_COUNT:,} requests, 1 in {FAILURE_INTERVAL} failed"
+        f" and 1 in {SLOW_INTERVAL} slow"
+    )
+    _run(loop, f"Head sampling, rate {HEAD_RATE}", HEAD_RATE)
+    _run(
+        loop,
+        f"Tail sampling, baseline {BASELINE_RATE}",
+        BASELINE_RATE,
+        lambda emitter: TailSampler(emitter, latency_threshold=LATENCY_THRESHOLD),
+    )
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
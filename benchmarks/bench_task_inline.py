@@ -0,0 +1,67 @@
+"""Benchmark awaiting a traced background task from inside a request.
+
+Compares `xray_task_async()`, which schedules each task segment in a new
+asyncio task, with `xray_task_async(inline=True)`, which runs it in the task
+that awaits it.
+"""
+
+import asyncio
+
+from _common import best_of
+from _common import print_header
+from _common import print_result
+from aws_xray_sdk.core import xray_recorder
+
+from xraysink.context import AsyncContext
+from xraysink.context import ContextVarAsyncContext
+from xraysink.tasks import xray_task_async
+
+#: Number of task calls awaited by each timed run.
+CALL_COUNT = 10_000
+
+
+@xray_task_async()
+async def _job_step():
+    pass
+
+
+@xray_task_async(inline=True)
+async def _job_step_inline():
+    pass
+
+
+async def _await_tasks(func):
+    async with xray_recorder.in_segment_async("benchmark"):
+        for _ in range(CALL_COUNT):
+            await func()
+
+
+def _run(context_class, func) -> float:
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        xray_recorder.configure(
+            service="benchmark",
+            sampling=False,
+            context=context_class(loop=loop, use_task_factory=True),
+        )
+        xray_recorder.emitter.send_entity = lambda entity: None
+
+        return best_of(lambda: loop.run_until_complete(_await_tasks(func)))
+    finally:
+        loop.close()
+
+
+def main():
+    print_header(f"Awaited task throughput ({CALL_COUNT:,} calls per run)")
+    for context_label, context_class in [
+        ("AsyncContext", AsyncContext),
+        ("ContextVarAsyncContext", ContextVarAsyncContext),
+    ]:
+        for label, func in [("task", _job_step), ("inline", _job_step_inline)]:
+            seconds = _run(context_class, func)
+            print_result(f"{context_label}, {label}", seconds, CALL_COUNT, "call")
+
+
+if __name__ == "__main__":
+    main()
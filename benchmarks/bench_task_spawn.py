@@ -0,0 +1,78 @@
+"""Benchmark the cost of spawning asyncio tasks inside a traced request.
+
+Compares task-spawn throughput for a plain event loop (no X-Ray context), the
+task-factory based `AsyncContext`, and the `contextvars` based
+`ContextVarAsyncContext`.
+"""
+
+import asyncio
+
+from _common import best_of
+from _common import print_header
+from _common import print_result
+from aws_xray_sdk.core.async_recorder import AsyncAWSXRayRecorder
+
+from xraysink.context import AsyncContext
+from xraysink.context import ContextVarAsyncContext
+
+#: Number of tasks spawned by each timed run.
+TASK_COUNT = 20_000
+
+#: Depth of nested subsegments that are open when the tasks are spawned.
+NESTING_DEPTHS = (1, 20, 200)
+
+
+async def _noop():
+    pass
+
+
+async def _spawn_tasks(recorder, depth: int):
+    """Spawn lots of tasks from inside a deeply nested subsegment."""
+    if recorder is None:
+        await asyncio.gather(*[_noop() for _ in range(TASK_COUNT)])
+        return
+
+    recorder.begin_segment("benchmark")
+    for i in range(depth - 1):
+        recorder.begin_subsegment(f"nested-{i}")
+
+    await asyncio.gather(*[_noop() for _ in range(TASK_COUNT)])
+
+    for _ in range(depth - 1):
+        recorder.end_subsegment()
+    recorder.end_segment()
+
+
+def _run(context_class, depth: int) -> float:
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        recorder = None
+        if context_class is not None:
+            recorder = AsyncAWSXRayRecorder()
+            recorder.configure(
+                service="benchmark",
+                sampling=False,
+                context=context_class(loop=loop, use_task_factory=True),
+            )
+            recorder.emitter.send_entity = lambda entity: None
+
+        return best_of(lambda: loop.run_until_complete(_spawn_tasks(recorder, depth)))
+    finally:
+        loop.close()
+
+
+def main():
+    print_header(f"Task spawn throughput ({TASK_COUNT:,} tasks per run)")
+    for depth in NESTING_DEPTHS:
+        for label, context_class in [
+            ("no context", None),
+            ("AsyncContext (task factory)", AsyncContext),
+            ("ContextVarAsyncContext", ContextVarAsyncContext),
+        ]:
+            seconds = _run(context_class, depth)
+            print_result(f"{label}, depth={depth}", seconds, TASK_COUNT, "task")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""Fold repetitive subsegments into a single summary subsegment."""
+
+import random
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from weakref import WeakKeyDictionary
+
+from aws_xray_sdk.core.models.segment import Segment
+from aws_xray_sdk.core.models.subsegment import Subsegment
+
+#: Default number of occurrences of each operation that are kept in full.
+DEFAULT_KEEP_FIRST: int = 3
+
+#: Metadata namespace for the statistics in a summary subsegment.
+AGGREGATE_METADATA_NAMESPACE: str = "xraysink"
+
+#: Metadata key for the statistics in a summary subsegment.
+AGGREGATE_METADATA_KEY: str = "aggregate"
+
+#: Number of durations sampled for estimating the latency percentiles.
+_RESERVOIR_SIZE: int = 128
+
+#: Latency percentiles included in the summary statistics.
+_PERCENTILES = (50, 90, 99)
+
+
+class SubsegmentAggregation:
+    """Fold repeated sibling subsegments into a summary subsegment.
+
+    When a request or task makes lots of nearly identical calls (eg. 5,000
+    Redis GETs), each call would normally be kept and emitted as its own
+    subsegment. With aggregation, the first `keep_first` occurrences of
+    each operation (ie. subsegments with the same parent, name and
+    namespace) are kept in full. Later occurrences are counted in a single
+    summary subsegment instead, and released as soon as they end. Any
+    occurrence that has an error, fault, throttle or exception is always
+    kept.
+
+    The summary subsegment has the same name and namespace as the calls,
+    spans from the start of the first call to the end of the last one, and
+    has metadata with the statistics for all the calls (including those that
+    were kept): `count`, `omitted` (the number folded into the summary),
+    `total`, `min` and `max` durations, and the `p50`, `p90` and `p99`
+    latency percentiles (estimated from a bounded sample). All durations
+    are in seconds.
+
+    So the memory kept for each segment, and the size of the emitted
+    document, depend on the number of distinct operations rather than the
+    number of calls.
+
+    Only leaf subsegments are aggregated, since folding a subsegment would
+    discard its children. Subsegments that end after their parent has ended
+    are left alone.
+
+    Use this by passing it to the xraysink recorder context:
+
+        context = AsyncContext(aggregation=SubsegmentAggregation())
+
+    Params:
+        keep_first: Number of occurrences of each operation that are kept
+            in full, before the rest are aggregated.
+    """
+
+    def __init__(self, *, keep_first: int = DEFAULT_KEEP_FIRST):
+        self._keep_first = keep_first
+
+        # Aggregates for each parent entity. The parent isn't given any extra
+        # attributes, since they would be serialised with it.
+        self._parents: WeakKeyDictionary = WeakKeyDictionary()
+
+    @property
+    def keep_first(self) -> int:
+        return self._keep_first
+
+    def add(self, parent, subsegment: Subsegment):
+        """Count a subsegment that has just ended, and fold it if necessary."""
+        if (
+            subsegment.subsegments
+            or not parent.sampled
+            or not parent.in_progress
+            or subsegment.parent_id != parent.id
+        ):
+            return
+
+        aggregates = self._parents.get(parent)
+        if aggregates is None:
+            aggregates = self._parents[parent] = {}
+
+        key = (subsegment.name, subsegment.namespace)
+        aggregate = aggregates.get(key)
+        if aggregate is None:
+            aggregate = aggregates[key] = _Aggregate()
+        aggregate.add(subsegment.start_time, subsegment.end_time)
+
+        if _has_problem(subsegment):
+            return
+        if aggregate.kept < self._keep_first:
+            aggregate.kept += 1
+            return
+
+        parent.remove_subsegment(subsegment)
+        aggregate.omitted += 1
+        aggregate.update_summary(parent, key)
+
+
+class _Aggregate:
+    """Statistics for all the occurrences of an operation under one parent."""
+
+    __slots__ = (
+        "count",
+        "kept",
+        "omitted",
+        "total",
+        "min",
+        "max",
+        "start_time",
+        "end_time",
+        "reservoir",
+        "summary",
+    )
+
+    def __init__(self):
+        self.count = 0
+        self.kept = 0
+        self.omitted = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.start_time = float("inf")
+        self.end_time = 0.0
+        self.reservoir: List[float] = []
+        self.summary: Optional[Subsegment] = None
+
+    def add(self, start_time: float, end_time: float):
+        """Record the timing of one occurrence."""
+        duration = end_time - start_time
+        self.count += 1
+        self.total += duration
+        self.min = min(self.min, duration)
+        self.max = max(self.max, duration)
+        self.start_time = min(self.start_time, start_time)
+        self.end_time = max(self.end_time, end_time)
+
+        # Reservoir sampling ("Algorithm R"), so the memory is bounded
+        if len(self.reservoir) < _RESERVOIR_SIZE:
+            self.reservoir.append(duration)
+        else:
+            index = random.randrange(self.count)
+            if index < _RESERVOIR_SIZE:
+                self.reservoir[index] = duration
+
+    def update_summary(self, parent, key: Tuple[str, str]):
+        """Create or update the summary subsegment for these occurrences."""
+        summary = self.summary
+        if summary is None or summary not in parent.subsegments:
+            # Either this is the first occurrence that was folded, or the
+            # previous summary has already been streamed out of the parent
+            name, namespace = key
+            segment = parent if isinstance(parent, Segment) else parent.parent_segment
+            summary = self.summary = Subsegment(name, namespace, segment)
+            parent.add_subsegment(summary)
+            summary.metadata[AGGREGATE_METADATA_NAMESPACE] = {
+                AGGREGATE_METADATA_KEY: _AggregateStatistics(self)
+            }
+            summary.close(self.end_time)
+
+        summary.start_time = self.start_time
+        summary.end_time = self.end_time
+
+    def get_statistics(self) -> Dict[str, float]:
+        """Get the summary statistics for the occurrences."""
+        result = {
+            "count": self.count,
+            "omitted": self.omitted,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+        }
+
+        samples = sorted(self.reservoir)
+        for percentile in _PERCENTILES:
+            index = min(len(samples) - 1, len(samples) * percentile // 100)
+            result[f"p{percentile}"] = samples[index]
+        return result
+
+
+class _AggregateStatistics:
+    """Metadata value that calculates the statistics when it is serialised.
+
+    The SDK converts metadata values that have an `_ast()` method by calling
+    it, so the percentiles are only calculated once, when the summary
+    subsegment is sent.
+    """
+
+    __slots__ = ("_aggregate",)
+
+    def __init__(self, aggregate: _Aggregate):
+        self._aggregate = aggregate
+
+    def _ast(self) -> Dict[str, float]:
+        return self._aggregate.get_statistics()
+
+
+def _has_problem(subsegment: Subsegment) -> bool:
+    """Whether a subsegment recorded an error, fault, throttle or exception."""
+    return bool(
+        getattr(subsegment, "error", False)
+        or getattr(subsegment, "fault", False)
+        or getattr(subsegment, "throttle", False)
+        or subsegment.cause
+    )
@@ -1,15 +1,32 @@
 """Various X-Ray middleware's for different ASGI-like server frameworks."""
 
+import logging
+import time
+from functools import lru_cache
+from typing import Iterable
+from typing import Optional
+from typing import Tuple
+
+from aws_xray_sdk import global_sdk_config
 from aws_xray_sdk.core import xray_recorder
 from aws_xray_sdk.core.models import http
 from aws_xray_sdk.core.models.segment import Segment
 from aws_xray_sdk.core.models.trace_header import TraceHeader
 from aws_xray_sdk.core.utils import stacktrace
 from aws_xray_sdk.ext.util import calculate_sampling_decision
-from aws_xray_sdk.ext.util import calculate_segment_name
-from aws_xray_sdk.ext.util import construct_xray_header
 from aws_xray_sdk.ext.util import prepare_response_header
 
+from ..entities import UnsampledSegment
+from ..sampling.tail import TailSampler
+from ..stacks import StackDeduplicator
+from ..util import has_current_trace
+from .paths import compile_path_matcher
+from .routes import RouteTemplate
+from .routes import get_handled_request_route
+from .routes import get_handled_scope_route
+from .routes import get_request_route
+from .routes import get_scope_route
+
 # See if app-framework-specific exceptions are present, and substitute with a
 # dummy implementation. These are only used for `isinstance` checking within
 # this module, so this is safe.
@@ -33,23 +50,145 @@ except ImportError:
         return func
 
 
+log = logging.getLogger(__name__)
+
+#: Maximum number of distinct hosts that we cache the segment name for.
+SEGMENT_NAME_CACHE_SIZE: int = 256
+
+#: Metadata namespace for the time taken to send the response body.
+BODY_TIMING_NAMESPACE: str = "response_body"
+
+#: Name of the annotation that records the route template of the request.
+ROUTE_ANNOTATION: str = "route"
+
+#: Lower-case name of the trace header, as it appears in an ASGI scope.
+_XRAY_HEADER_NAME = http.XRAY_HEADER.lower().encode("latin-1")
+
+#: Default port for each URL scheme that can appear in an ASGI HTTP scope.
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
 @aiohttp_middleware
 async def xray_middleware(request, handler):
     """
     Main middleware function, deals with all the X-Ray segment logic
     """
+    return await _trace_request(request, handler, _DEFAULT_OPTIONS)
+
+
+def make_xray_middleware(
+    *,
+    sample_by_route: bool = False,
+    name_by_route: bool = False,
+    annotate_route: bool = False,
+    exclude_paths: Iterable[str] = (),
+    tail_sampler: Optional[TailSampler] = None,
+    stack_deduplicator: Optional[StackDeduplicator] = None,
+):
+    """Create a middleware function like `xray_middleware`, with extra options.
+
+    Params:
+        sample_by_route: Make the sampling decision using the route template
+            (eg. `/users/{user_id}`) as the path, rather than the actual
+            request path. This keeps the number of distinct sampling keys
+            small, but sampling rules must then match the route template.
+        name_by_route: Name each segment after the HTTP method and route
+            template (eg. `GET /users/:user_id`), rather than the service.
+        annotate_route: Record the route template in the `route`
+            annotation. If the route isn't needed for sampling or naming,
+            then it is looked up from the router's own match once the
+            request has been handled.
+        exclude_paths: Request paths that are not traced at all (eg. health
+            checks). Each item is an exact path (`/health`), a prefix ending
+            in `*` (`/internal/*`), or a glob (`/api/*/status`).
+        tail_sampler: Record every request that doesn't have a sampling
+            decision from upstream, and only keep the traces that this tail
+            sampler decides to keep when the request ends. The recorder must
+            use the same tail sampler as its emitter. See `TailSampler`.
+        stack_deduplicator: Record unhandled exceptions with this, so that
+            the stack trace of a repeated exception is only captured once in
+            each time window. See `StackDeduplicator`.
+    """
+    options = _MiddlewareOptions(
+        sample_by_route,
+        name_by_route,
+        annotate_route,
+        exclude_paths,
+        tail_sampler,
+        stack_deduplicator,
+    )
+
+    @aiohttp_middleware
+    async def middleware(request, handler):
+        return await _trace_request(request, handler, options)
+
+    return middleware
+
+
+class _MiddlewareOptions:
+    """Options for the middleware, prepared once when it is created."""
+
+    __slots__ = (
+        "sample_by_route",
+        "name_by_route",
+        "annotate_route",
+        "is_excluded",
+        "tail_sampler",
+        "stack_deduplicator",
+    )
+
+    def __init__(
+        self,
+        sample_by_route: bool = False,
+        name_by_route: bool = False,
+        annotate_route: bool = False,
+        exclude_paths: Iterable[str] = (),
+        tail_sampler: Optional[TailSampler] = None,
+        stack_deduplicator: Optional[StackDeduplicator] = None,
+    ):
+        self.sample_by_route = sample_by_route
+        self.name_by_route = name_by_route
+        self.annotate_route = annotate_route
+        self.is_excluded = compile_path_matcher(exclude_paths)
+        self.tail_sampler = tail_sampler
+        self.stack_deduplicator = stack_deduplicator
+
+
+_DEFAULT_OPTIONS = _MiddlewareOptions()
+
+
+async def _trace_request(request, handler, options: _MiddlewareOptions):
+    """Trace a request to a web app that uses framework-specific request objects."""
+    if options.is_excluded is not None and options.is_excluded(
+        _get_request_path(request)
+    ):
+        return await handler(request)
+
+    headers = _RequestHeaders.from_request(request)
+
     # Create X-Ray headers
-    xray_header = construct_xray_header(request.headers)
+    xray_header = _parse_trace_header(headers.trace_header)
 
     # Get name of service or generate a dynamic one from host
-    name = calculate_segment_name(
-        request.headers.get("host", "localhost").split(":", 1)[0], xray_recorder
-    )
+    host = headers.host or "localhost"
+    name = _get_segment_name(host)
+
+    # Find the route template before the request is sampled, only if we need it
+    route = None
+    route_resolved = options.sample_by_route or options.name_by_route
+    routing_scope = None
+    if route_resolved:
+        route = get_request_route(request)
+    elif options.annotate_route and hasattr(request, "scope"):
+        # The route is found from the router's match, once it has routed
+        routing_scope = dict(request.scope)
 
     sampling_req = {
-        "host": request.headers.get("host", "localhost"),
+        "host": host,
         "method": request.method,
-        "path": _get_request_path(request),
+        "path": route.template
+        if options.sample_by_route and route
+        else _get_request_path(request),
         "service": name,
     }
 
@@ -57,50 +196,438 @@ async def xray_middleware(request, handler):
         trace_header=xray_header, recorder=xray_recorder, sampling_req=sampling_req
     )
 
-    # Start a segment
-    segment = xray_recorder.begin_segment(
-        name=name,
-        traceid=xray_header.root,
-        parent_id=xray_header.parent,
-        sampling=sampling_decision,
+    if options.name_by_route and route:
+        name = f"{request.method} {route.segment_name}"
+
+    segment, tail_sampler = _begin_request_segment(
+        name, xray_header, sampling_decision, options
     )
+    body_streamed = False
     try:
-        segment.save_origin_trace_header(xray_header)
-
-        # Store request metadata in the current segment
-        segment.put_http_meta(http.URL, str(request.url))
-        segment.put_http_meta(http.METHOD, request.method)
-
-        if "User-Agent" in request.headers:
-            segment.put_http_meta(http.USER_AGENT, request.headers["User-Agent"])
-
-        if "X-Forwarded-For" in request.headers:
-            segment.put_http_meta(http.CLIENT_IP, request.headers["X-Forwarded-For"])
-            segment.put_http_meta(http.X_FORWARDED_FOR, True)
-        elif "remote_addr" in request.headers:
-            segment.put_http_meta(http.CLIENT_IP, request.headers["remote_addr"])
-        elif "remote-addr" in request.headers:
-            # NB: hyphenated variation of remote_addr.
-            # Don't mistakenly think they are the same :)
-            segment.put_http_meta(http.CLIENT_IP, request.headers["remote-addr"])
-        elif hasattr(request, "remote"):
-            segment.put_http_meta(http.CLIENT_IP, request.remote)
-        elif hasattr(request, "client") and request.client.host is not None:
-            segment.put_http_meta(http.CLIENT_IP, request.client.host)
+        if segment.sampled:
+            _record_request(segment, request, headers)
 
         # Call next middleware or request handler
         try:
             response = await handler(request)
             _record_response(segment, xray_header, response)
         except Exception as ex:
-            _record_exception(segment, xray_header, ex)
+            _record_exception(segment, xray_header, ex, options)
             raise
+        finally:
+            if options.annotate_route and segment.sampled:
+                if not route_resolved:
+                    route = get_handled_request_route(request, routing_scope)
+                _record_route(segment, route)
+
+        if segment.sampled and hasattr(response, "body_iterator"):
+            # starlette-style response, where the body is sent after we
+            # return. So the segment is ended when the body is complete.
+            trace = _StreamedResponseTrace(segment, options, tail_sampler)
+            response = trace.attach(response)
+            body_streamed = True
     finally:
-        xray_recorder.end_segment()
+        if not body_streamed:
+            if tail_sampler is not None:
+                tail_sampler.end_trace(segment)
+            xray_recorder.end_segment()
 
     return response
 
 
+class XRayASGIMiddleware:
+    """Pure ASGI middleware that traces each HTTP request in an X-Ray segment.
+
+    This records the same segment as `xray_middleware`, but works directly
+    with the ASGI `scope`, `receive` and `send` callables rather than with
+    framework-specific request and response objects. This means it can be
+    mounted in any ASGI application without Starlette's `BaseHTTPMiddleware`
+    (which adds an extra task and memory stream for every request), and the
+    response is never buffered by the middleware.
+
+    Non-HTTP connections (eg. websockets and lifespan events), and requests
+    for excluded paths, are passed straight through to the wrapped
+    application.
+
+    Params:
+        app: The ASGI application to wrap.
+        sample_by_route: Make the sampling decision using the route template
+            (eg. `/users/{user_id}`) as the path. See `make_xray_middleware`.
+        name_by_route: Name each segment after the HTTP method and route
+            template. See `make_xray_middleware`.
+        annotate_route: Record the route template in the `route`
+            annotation. See `make_xray_middleware`.
+        exclude_paths: Request paths that are not traced at all. See
+            `make_xray_middleware`.
+        tail_sampler: Only keep the traces that this tail sampler decides to
+            keep when each request ends. See `make_xray_middleware`.
+        stack_deduplicator: Record unhandled exceptions with this. See
+            `make_xray_middleware`.
+    """
+
+    def __init__(
+        self,
+        app,
+        *,
+        sample_by_route: bool = False,
+        name_by_route: bool = False,
+        annotate_route: bool = False,
+        exclude_paths: Iterable[str] = (),
+        tail_sampler: Optional[TailSampler] = None,
+        stack_deduplicator: Optional[StackDeduplicator] = None,
+    ):
+        self.app = app
+        self._options = _MiddlewareOptions(
+            sample_by_route,
+            name_by_route,
+            annotate_route,
+            exclude_paths,
+            tail_sampler,
+            stack_deduplicator,
+        )
+
+    async def __call__(self, scope, receive, send):
+        options = self._options
+        if scope["type"] != "http" or (
+            options.is_excluded is not None and options.is_excluded(scope["path"])
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        headers = _RequestHeaders.from_raw(scope.get("headers", ()))
+
+        # Create X-Ray headers
+        xray_header = _parse_trace_header(headers.trace_header)
+
+        # Get name of service or generate a dynamic one from host
+        host = headers.host or _get_scope_server_host(scope)
+        name = _get_segment_name(host)
+
+        # Find the route template before the request is sampled, only if we
+        # need it
+        route = None
+        route_resolved = options.sample_by_route or options.name_by_route
+        routing_scope = None
+        if route_resolved:
+            route = get_scope_route(scope)
+        elif options.annotate_route:
+            # The route is found from the router's match, once it has routed
+            routing_scope = dict(scope)
+
+        sampling_req = {
+            "host": host,
+            "method": scope["method"],
+            "path": route.template
+            if options.sample_by_route and route
+            else scope["path"],
+            "service": name,
+        }
+
+        sampling_decision = calculate_sampling_decision(
+            trace_header=xray_header, recorder=xray_recorder, sampling_req=sampling_req
+        )
+
+        if options.name_by_route and route:
+            name = f"{scope['method']} {route.segment_name}"
+
+        body_progress = None
+
+        async def send_wrapper(message):
+            message_type = message["type"]
+            if message_type == "http.response.start":
+                message = _record_asgi_response_start(segment, xray_header, message)
+            await send(message)
+            if message_type == "http.response.body" and body_progress is not None:
+                body_progress.add_chunk(
+                    message.get("body", b""), message.get("more_body", False)
+                )
+
+        segment, tail_sampler = _begin_request_segment(
+            name, xray_header, sampling_decision, options
+        )
+        if segment.sampled:
+            body_progress = _ResponseBodyProgress()
+        try:
+            if segment.sampled:
+                _record_asgi_request(segment, scope, headers, host)
+
+            # Call next middleware or application
+            try:
+                await self.app(scope, receive, send_wrapper)
+            except Exception as ex:
+                _record_exception(segment, xray_header, ex, options)
+                raise
+        finally:
+            # The application may keep running after the response is complete
+            # (eg. background tasks), so the segment ends when the last byte
+            # of the body was sent. Note that we don't close the segment until
+            # the application is finished, so it can still add subsegments.
+            end_time = None
+            if body_progress is not None:
+                body_progress.record(segment)
+                end_time = body_progress.last_byte_time
+                if options.annotate_route:
+                    if not route_resolved:
+                        route = get_handled_scope_route(scope, routing_scope)
+                    _record_route(segment, route)
+            if tail_sampler is not None:
+                tail_sampler.end_trace(segment, end_time)
+            xray_recorder.end_segment(end_time)
+
+
+def _begin_request_segment(
+    name: str, xray_header: TraceHeader, sampling_decision, options: _MiddlewareOptions
+) -> Tuple[Segment, Optional[TailSampler]]:
+    """Start the segment for an incoming request, with tail sampling if enabled.
+
+    Returns:
+        The segment, and the tail sampler that decides whether to keep its
+        trace when the request ends (or None, if it has already been
+        decided).
+    """
+    tail_sampler = options.tail_sampler
+    if tail_sampler is None or xray_header.sampled not in (None, "?"):
+        return _begin_segment(name, xray_header, sampling_decision), None
+
+    segment = _begin_segment(name, xray_header, sampling_decision or 1)
+    if not segment.sampled:
+        # The SDK is disabled
+        return segment, None
+    tail_sampler.begin_trace(segment, sampling_decision)
+    return segment, tail_sampler
+
+
+def _begin_segment(name: str, xray_header: TraceHeader, sampling_decision) -> Segment:
+    """Start the segment for an incoming request.
+
+    If the request is not sampled, then we use a lightweight placeholder
+    segment that holds just enough to propagate the trace downstream. This
+    avoids wasting effort on a segment that will be thrown away.
+    """
+    if not sampling_decision and global_sdk_config.sdk_enabled():
+        segment = UnsampledSegment(name, traceid=xray_header.root)
+        xray_recorder.context.put_segment(segment)
+    else:
+        segment = xray_recorder.begin_segment(
+            name=name,
+            traceid=xray_header.root,
+            parent_id=xray_header.parent,
+            sampling=sampling_decision,
+        )
+
+    segment.save_origin_trace_header(xray_header)
+    return segment
+
+
+def _record_request(segment: Segment, request, headers: "_RequestHeaders"):
+    """Record the metadata for a HTTP request to the web app."""
+    segment.put_http_meta(http.URL, str(request.url))
+    segment.put_http_meta(http.METHOD, request.method)
+
+    if headers.user_agent is not None:
+        segment.put_http_meta(http.USER_AGENT, headers.user_agent)
+
+    if headers.forwarded_for is not None:
+        segment.put_http_meta(http.CLIENT_IP, headers.forwarded_for)
+        segment.put_http_meta(http.X_FORWARDED_FOR, True)
+    elif headers.remote_addr is not None:
+        segment.put_http_meta(http.CLIENT_IP, headers.remote_addr)
+    elif hasattr(request, "remote"):
+        segment.put_http_meta(http.CLIENT_IP, request.remote)
+    elif hasattr(request, "client") and request.client.host is not None:
+        segment.put_http_meta(http.CLIENT_IP, request.client.host)
+
+
+def _record_asgi_request(
+    segment: Segment, scope, headers: "_RequestHeaders", host: str
+):
+    """Record the metadata for a HTTP request to an ASGI app."""
+    segment.put_http_meta(http.URL, _get_scope_url(scope, host))
+    segment.put_http_meta(http.METHOD, scope["method"])
+
+    if headers.user_agent is not None:
+        segment.put_http_meta(http.USER_AGENT, headers.user_agent)
+
+    if headers.forwarded_for is not None:
+        segment.put_http_meta(http.CLIENT_IP, headers.forwarded_for)
+        segment.put_http_meta(http.X_FORWARDED_FOR, True)
+    elif headers.remote_addr is not None:
+        segment.put_http_meta(http.CLIENT_IP, headers.remote_addr)
+    elif scope.get("client"):
+        segment.put_http_meta(http.CLIENT_IP, scope["client"][0])
+
+
+class _RequestHeaders:
+    """The request headers that are used by the middleware.
+
+    The raw request headers are scanned just once, and only the values of the
+    headers that we need are decoded. This is much cheaper than building a
+    case-insensitive mapping of all the headers, and then looking up each
+    header we need in turn.
+
+    If a header is repeated, then the first value is used.
+    """
+
+    __slots__ = ("trace_header", "host", "user_agent", "forwarded_for", "remote_addr")
+
+    #: Position of each header we need, in the list of scanned values.
+    #:
+    #: NB: "remote_addr" and "remote-addr" are different headers. Don't
+    #: mistakenly think they are the same :)
+    _HEADER_INDEXES = {
+        http.XRAY_HEADER.lower().encode("latin-1"): 0,
+        http.ALT_XRAY_HEADER.lower().encode("latin-1"): 1,
+        b"host": 2,
+        b"user-agent": 3,
+        b"x-forwarded-for": 4,
+        b"remote_addr": 5,
+        b"remote-addr": 6,
+    }
+
+    #: Lengths of the header names we need, so that we only lower-case the
+    #: names that could possibly match.
+    _HEADER_NAME_LENGTHS = frozenset(len(name) for name in _HEADER_INDEXES)
+
+    def __init__(self, values: list):
+        self.trace_header = values[0] or values[1]
+        self.host = values[2]
+        self.user_agent = values[3]
+        self.forwarded_for = values[4]
+        self.remote_addr = values[5] or values[6]
+
+    @classmethod
+    def from_raw(cls, raw_headers) -> "_RequestHeaders":
+        """Scan a sequence of raw `(name, value)` byte string pairs."""
+        indexes = cls._HEADER_INDEXES
+        name_lengths = cls._HEADER_NAME_LENGTHS
+        values = [None] * len(indexes)
+
+        for name, value in raw_headers:
+            # Header names in an ASGI scope are already lower-case, but
+            # other frameworks keep the case that the client sent.
+            index = indexes.get(name)
+            if index is None and len(name) in name_lengths:
+                index = indexes.get(name.lower())
+            if index is not None and values[index] is None:
+                values[index] = value.decode("latin-1")
+
+        return cls(values)
+
+    @classmethod
+    def from_mapping(cls, headers) -> "_RequestHeaders":
+        """Look up the headers in a case-insensitive mapping."""
+        return cls(
+            [
+                headers.get(http.XRAY_HEADER),
+                headers.get(http.ALT_XRAY_HEADER),
+                headers.get("host"),
+                headers.get("User-Agent"),
+                headers.get("X-Forwarded-For"),
+                headers.get("remote_addr"),
+                headers.get("remote-addr"),
+            ]
+        )
+
+    @classmethod
+    def from_request(cls, request) -> "_RequestHeaders":
+        """Get the headers from any type of request object."""
+        if hasattr(request, "raw_headers"):
+            # aiohttp-style
+            return cls.from_raw(request.raw_headers)
+        elif hasattr(request, "scope"):
+            # starlette-style
+            return cls.from_raw(request.scope.get("headers", ()))
+        return cls.from_mapping(request.headers)
+
+
+def _parse_trace_header(header: Optional[str]) -> TraceHeader:
+    """Parse the value of a trace header from a request.
+
+    This gives the same result as `TraceHeader.from_header_str`, but is
+    faster because it makes a single pass over the header value. Unlike the
+    SDK, a malformed parameter (eg. a bare `Self` injected by a load
+    balancer) is skipped, rather than discarding the whole header.
+    """
+    if not header:
+        return TraceHeader()
+
+    root = parent = sampled = None
+    data = {}
+    for param in header.strip().split(";"):
+        key, sep, value = param.partition("=")
+        if not sep:
+            log.debug("malformed parameter %r in tracing header, ignore.", param)
+            continue
+        if "=" in value:
+            value = value.split("=", 1)[0]
+
+        if key == "Root":
+            root = value
+        elif key == "Parent":
+            parent = value
+        elif key == "Sampled":
+            sampled = value
+        elif key != "Self":
+            # Ignore any "Self=" trace ids injected from ALB.
+            data[key] = value
+
+    return TraceHeader(root=root, parent=parent, sampled=sampled, data=data)
+
+
+def _get_segment_name(host: str) -> str:
+    """Get the segment name for a request to the given host (and port)."""
+    return _calculate_segment_name(
+        host, xray_recorder.service, xray_recorder.dynamic_naming
+    )
+
+
+@lru_cache(maxsize=SEGMENT_NAME_CACHE_SIZE)
+def _calculate_segment_name(host: str, service: str, dynamic_naming) -> str:
+    """Calculate the segment name for a request to the given host.
+
+    This is equivalent to `calculate_segment_name` from the SDK, but the
+    result is cached, because matching the host against the dynamic naming
+    pattern is relatively slow. The recorder configuration is part of the
+    cache key, so re-configuring the recorder takes effect immediately.
+    """
+    if dynamic_naming:
+        return dynamic_naming.get_name(host.split(":", 1)[0])
+    else:
+        return service
+
+
+def _record_route(segment: Segment, route: Optional[RouteTemplate]):
+    """Record the route template that handles the request, if known."""
+    if route is not None:
+        segment.put_annotation(ROUTE_ANNOTATION, route.template)
+
+
+def _get_scope_server_host(scope) -> str:
+    """Get the host (and port) of the server from an ASGI scope.
+
+    This is the fallback when the request has no `Host` header.
+    """
+    server = scope.get("server")
+    if not server or server[0] is None:
+        return "localhost"
+
+    host, port = server
+    if port is None or port == _DEFAULT_PORTS.get(scope.get("scheme", "http")):
+        return host
+    return f"{host}:{port}"
+
+
+def _get_scope_url(scope, host: str) -> str:
+    """Reconstruct the full request URL from an ASGI scope."""
+    scheme = scope.get("scheme", "http")
+    url = f"{scheme}://{host}{scope.get('root_path', '')}{scope['path']}"
+
+    query_string = scope.get("query_string")
+    if query_string:
+        url += "?" + query_string.decode("latin-1")
+    return url
+
+
 def _get_request_path(request) -> str:
     """Get the path from any type of request object."""
     if hasattr(request, "path"):
@@ -123,7 +650,22 @@ def _get_response_status(response) -> int:
     raise TypeError(f"Don't know how to find the path for {type(response)}")
 
 
-def _record_exception(segment: Segment, xray_header: TraceHeader, ex: Exception):
+def _get_response_content_length(response) -> Optional[int]:
+    """Get the length of the body of any type of response object, if known."""
+    if "Content-Length" in response.headers:
+        return int(response.headers["Content-Length"])
+
+    # aiohttp-style response, where the body was set by the handler rather
+    # than streamed
+    return getattr(response, "content_length", None)
+
+
+def _record_exception(
+    segment: Segment,
+    xray_header: TraceHeader,
+    ex: Exception,
+    options: _MiddlewareOptions,
+):
     """Record an exception from the web app.
 
     Note that different web frameworks take different approaches to how
@@ -144,18 +686,206 @@ def _record_exception(segment: Segment, xray_header: TraceHeader, ex: Exception)
         _record_response(segment, xray_header, ex)
         return
 
+    # Don't waste time capturing the stack trace if it will be discarded
+    if not segment.sampled:
+        return
+
     # Default behaviour - assume this is a server error
     segment.put_http_meta(http.STATUS, 500)
-    stack = stacktrace.get_stacktrace(limit=xray_recorder.max_trace_back)
-    segment.add_exception(ex, stack)
+    _add_exception(segment, ex, options)
+
+
+def _add_exception(segment: Segment, ex: Exception, options: _MiddlewareOptions):
+    """Record an exception in the segment, with its stack trace if necessary."""
+    if options.stack_deduplicator is not None:
+        options.stack_deduplicator.add_exception(
+            segment, ex, limit=xray_recorder.max_trace_back
+        )
+    else:
+        stack = stacktrace.get_stacktrace(limit=xray_recorder.max_trace_back)
+        segment.add_exception(ex, stack)
 
 
 def _record_response(segment: Segment, xray_header: TraceHeader, response):
     """Record a HTTP response from the web app."""
-    segment.put_http_meta(http.STATUS, _get_response_status(response))
-    if "Content-Length" in response.headers:
-        length = int(response.headers["Content-Length"])
-        segment.put_http_meta(http.CONTENT_LENGTH, length)
+    if segment.sampled:
+        segment.put_http_meta(http.STATUS, _get_response_status(response))
+        length = _get_response_content_length(response)
+        if length is not None:
+            segment.put_http_meta(http.CONTENT_LENGTH, length)
 
-    header_str = prepare_response_header(xray_header, segment)
+    header_str = _prepare_response_header(xray_header, segment)
     response.headers[http.XRAY_HEADER] = header_str
+
+
+class _ResponseBodyProgress:
+    """Track the progress of sending a response body, without buffering it."""
+
+    __slots__ = ("size", "first_byte_time", "last_byte_time")
+
+    def __init__(self):
+        self.size = 0
+        self.first_byte_time: Optional[float] = None
+        self.last_byte_time: Optional[float] = None
+
+    def add_chunk(self, chunk, more_body: bool):
+        """Record that a chunk of the body has been sent."""
+        if chunk:
+            if self.first_byte_time is None:
+                self.first_byte_time = time.time()
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            self.size += len(chunk)
+
+        if not more_body:
+            self.last_byte_time = time.time()
+            if self.first_byte_time is None:
+                # Empty body
+                self.first_byte_time = self.last_byte_time
+
+    def record(self, segment: Segment):
+        """Record the response body in the segment, if it was completely sent.
+
+        The size of the body is only recorded if the response didn't have a
+        `Content-Length` header. The times to the first and last byte are
+        measured from the start of the segment, in seconds.
+        """
+        if self.last_byte_time is None:
+            return
+
+        if http.CONTENT_LENGTH not in segment.http.get("response", {}):
+            segment.put_http_meta(http.CONTENT_LENGTH, self.size)
+        segment.put_metadata(
+            "time_to_first_byte",
+            self.first_byte_time - segment.start_time,
+            BODY_TIMING_NAMESPACE,
+        )
+        segment.put_metadata(
+            "time_to_last_byte",
+            self.last_byte_time - segment.start_time,
+            BODY_TIMING_NAMESPACE,
+        )
+
+
+class _StreamedResponseTrace:
+    """Ends the segment of a starlette-style response, once its body is sent.
+
+    The body of the response is sent after the middleware has returned. The
+    segment is usually still the current segment (eg. with starlette's
+    `BaseHTTPMiddleware`), so it's ended through the recorder's context. This
+    releases it from the entity stacks that are shared with any tasks that
+    the handler started. Otherwise it's ended directly. The segment is ended
+    when the last chunk of the body has been sent. If the body isn't
+    completely sent (eg. the client disconnects before it starts), then the
+    segment is ended when the response has finished being called.
+    """
+
+    __slots__ = ("segment", "options", "tail_sampler", "progress", "ended")
+
+    def __init__(
+        self,
+        segment: Segment,
+        options: _MiddlewareOptions,
+        tail_sampler: Optional[TailSampler] = None,
+    ):
+        self.segment = segment
+        self.options = options
+        self.tail_sampler = tail_sampler
+        self.progress = _ResponseBodyProgress()
+        self.ended = False
+
+    def attach(self, response) -> "_TracedResponse":
+        """Trace the body of a response, and end the segment when it's sent.
+
+        Returns:
+            The response to return in place of the original one.
+        """
+        response.body_iterator = self.trace_body(response.body_iterator)
+        return _TracedResponse(response, self)
+
+    async def trace_body(self, body_iterator):
+        """Trace the chunks of a response body, and end the segment when done."""
+        progress = self.progress
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+                progress.add_chunk(chunk, more_body=True)
+            progress.add_chunk(b"", more_body=False)
+        except Exception as ex:
+            _add_exception(self.segment, ex, self.options)
+            raise
+        finally:
+            self.end()
+
+    def end(self):
+        """End the segment, if it hasn't been ended already."""
+        if self.ended:
+            return
+        self.ended = True
+
+        segment = self.segment
+        self.progress.record(segment)
+        end_time = self.progress.last_byte_time
+        if self.tail_sampler is not None:
+            self.tail_sampler.end_trace(segment, end_time)
+        if has_current_trace() and xray_recorder.current_segment() is segment:
+            xray_recorder.end_segment(end_time)
+        else:
+            segment.close(end_time)
+            if segment.sampled and segment.ready_to_send():
+                xray_recorder.emitter.send_entity(segment)
+
+
+class _TracedResponse:
+    """Starlette-style response, which ends the segment once it's been sent.
+
+    This is a fallback for when the body is never completely iterated over.
+    Other attributes are those of the original response.
+    """
+
+    __slots__ = ("response", "trace")
+
+    def __init__(self, response, trace: _StreamedResponseTrace):
+        self.response = response
+        self.trace = trace
+
+    def __getattr__(self, name: str):
+        return getattr(self.response, name)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.response(scope, receive, send)
+        finally:
+            self.trace.end()
+
+
+def _record_asgi_response_start(
+    segment: Segment, xray_header: TraceHeader, message: dict
+) -> dict:
+    """Record the start of a HTTP response from an ASGI app.
+
+    Returns:
+        A copy of the ASGI message, with the trace header added to the
+        response headers.
+    """
+    headers = list(message.get("headers", ()))
+
+    if segment.sampled:
+        segment.put_http_meta(http.STATUS, message["status"])
+        for key, value in headers:
+            if key.lower() == b"content-length":
+                segment.put_http_meta(http.CONTENT_LENGTH, int(value))
+                break
+
+    header_str = _prepare_response_header(xray_header, segment)
+    headers.append((_XRAY_HEADER_NAME, header_str.encode("latin-1")))
+
+    return dict(message, headers=headers)
+
+
+def _prepare_response_header(xray_header: TraceHeader, segment: Segment) -> str:
+    """Prepare the trace header to be inserted into the response."""
+    if isinstance(segment, UnsampledSegment):
+        # Always tell the caller that we didn't sample their request
+        return TraceHeader(root=segment.trace_id, sampled=0).to_header_str()
+    return prepare_response_header(xray_header, segment)
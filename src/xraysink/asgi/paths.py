@@ -0,0 +1,60 @@
+"""Match request paths against a set of path patterns."""
+
+import re
+from fnmatch import translate
+from typing import Callable
+from typing import Iterable
+from typing import Optional
+
+#: Characters that have a special meaning in a glob pattern.
+_GLOB_CHARS = frozenset("*?[")
+
+
+def compile_path_matcher(patterns: Iterable[str]) -> Optional[Callable[[str], bool]]:
+    """Compile some path patterns into a single function that checks a path.
+
+    Each pattern can be one of:
+
+    * An exact path, like `/health`
+    * A path prefix, which ends with `*` and has no other wildcards, like
+      `/internal/*`
+    * A glob pattern (as used by `fnmatch`), like `/api/*/status`. Note that
+      `*` will also match a `/`. Matching is case-sensitive.
+
+    The patterns are compiled once, so checking a path is cheap: a set lookup
+    for the exact paths, a single `str.startswith` call for all the prefixes,
+    and a single regular expression for all the globs.
+
+    Returns:
+        A function that returns true if a path matches any of the patterns,
+        or `None` if there are no patterns.
+    """
+    exact_paths = set()
+    prefixes = []
+    globs = []
+
+    for pattern in patterns:
+        wildcards = [i for i, char in enumerate(pattern) if char in _GLOB_CHARS]
+        if not wildcards:
+            exact_paths.add(pattern)
+        elif wildcards == [len(pattern) - 1] and pattern.endswith("*"):
+            prefixes.append(pattern[:-1])
+        else:
+            globs.append(translate(pattern))
+
+    checks = []
+    if exact_paths:
+        checks.append(frozenset(exact_paths).__contains__)
+    if prefixes:
+        prefix_tuple = tuple(prefixes)
+        checks.append(lambda path: path.startswith(prefix_tuple))
+    if globs:
+        glob_regex = re.compile("|".join(globs))
+        checks.append(lambda path: glob_regex.match(path) is not None)
+
+    if not checks:
+        return None
+    if len(checks) == 1:
+        return checks[0]
+
+    return lambda path: any(check(path) for check in checks)
@@ -0,0 +1,251 @@
+"""Find the route template that handles a request, for different frameworks."""
+
+import re
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+#: Maximum number of routes that we cache the template for.
+ROUTE_CACHE_SIZE: int = 1024
+
+#: Path parameters in a route template, like `{user_id}` or `{id:int}`.
+_PATH_PARAM_PATTERN = re.compile(r"{([^}:]+)(:[^}]*)?}")
+
+
+class RouteTemplate:
+    """The route template for a request, and the details derived from it.
+
+    Params:
+        template: The path template for the route, like `/users/{user_id}`.
+    """
+
+    __slots__ = ("template", "segment_name")
+
+    def __init__(self, template: str):
+        self.template = template
+
+        #: Version of the template that can be used in a segment name. X-Ray
+        #: doesn't allow braces in a segment name, so path parameters are
+        #: written like `/users/:user_id` instead.
+        self.segment_name = _PATH_PARAM_PATTERN.sub(r":\1", template)
+
+
+#: Cached route templates, keyed by the identity of the route object and the
+#: prefix it is mounted under. The route object is stored in the value, so
+#: that a re-used object ID can't match the wrong route.
+_route_templates: Dict[Tuple[int, str], Tuple[object, RouteTemplate]] = {}
+
+
+def get_request_route(request) -> Optional[RouteTemplate]:
+    """Get the route template that handles any type of request object."""
+    if hasattr(request, "match_info"):
+        # aiohttp-style. The route is resolved before middleware is called.
+        resource = request.match_info.route.resource
+        if resource is None:
+            return None
+        return _get_cached_route(resource, "") or _cache_route(
+            resource, "", resource.canonical
+        )
+    elif hasattr(request, "scope"):
+        # starlette-style
+        return get_scope_route(request.scope)
+    return None
+
+
+def get_handled_request_route(
+    request, routing_scope: Optional[dict] = None
+) -> Optional[RouteTemplate]:
+    """Get the route template that handled any type of request object.
+
+    This must be called after the request was handled. For a
+    starlette-style request, `routing_scope` must be a copy of the request's
+    scope from before it was handled. See `get_handled_scope_route`.
+    """
+    if routing_scope is not None and hasattr(request, "scope"):
+        return get_handled_scope_route(request.scope, routing_scope)
+    return get_request_route(request)
+
+
+def get_handled_scope_route(scope, routing_scope: dict) -> Optional[RouteTemplate]:
+    """Get the route template that handled the request in an ASGI scope.
+
+    This must be called after the application has handled the request. The
+    Starlette router records the route that it matched (or at least its
+    endpoint) in the scope, so the template is looked up in an index of the
+    application's routes, rather than matching the routes again. The routes
+    are only matched again if the endpoint is shared by several routes.
+
+    Params:
+        scope: The ASGI scope, after the request was handled.
+        routing_scope: A copy of the ASGI scope from before the request was
+            handled. The router changes some of the values (eg. a mounted
+            Starlette application replaces the `app`).
+    """
+    router = getattr(routing_scope.get("app"), "router", None)
+    if router is None:
+        return None
+
+    index = _get_route_index(router)
+    for key in ("route", "endpoint"):
+        handler = scope.get(key)
+        if handler is None:
+            continue
+
+        entry = index.templates.get(id(handler))
+        if entry is not None and entry[0] is handler:
+            if entry[1] is not None:
+                return entry[1]
+            # Shared by several routes
+            return _match_routes(router.routes, routing_scope, "")
+
+    # The router didn't match any route
+    return None
+
+
+def get_scope_route(scope) -> Optional[RouteTemplate]:
+    """Get the route template that will handle the request in an ASGI scope.
+
+    This matches the request against the routes of the Starlette (or
+    FastAPI) application in the scope, since the middleware is called
+    before the application's router. Returns `None` if the application is
+    not a Starlette application, or no route matches.
+    """
+    router = getattr(scope.get("app"), "router", None)
+    if router is None:
+        return None
+    return _match_routes(router.routes, scope, "")
+
+
+class _RouteIndex:
+    """The route templates of a Starlette router, keyed by each route's handler.
+
+    Params:
+        router: The Starlette router.
+    """
+
+    __slots__ = ("router", "route_count", "templates")
+
+    def __init__(self, router):
+        self.router = router
+        self.route_count = len(router.routes)
+
+        #: Each route object and endpoint, and its route template (or `None`
+        #: if it is shared by several routes), keyed by its identity.
+        self.templates: Dict[int, Tuple[object, Optional[RouteTemplate]]] = {}
+        self._add_routes(router.routes, "")
+
+    def _add_routes(self, routes, prefix: str):
+        for route in routes:
+            child_routes = getattr(route, "routes", None)
+            if child_routes:
+                # Mounted sub-application or router
+                self._add_routes(child_routes, prefix + getattr(route, "path", ""))
+                continue
+
+            path_format = getattr(route, "path_format", None)
+            if path_format is None:
+                continue
+
+            template = _get_cached_route(route, prefix) or _cache_route(
+                route, prefix, prefix + path_format
+            )
+            self._add(route, template)
+            self._add(getattr(route, "endpoint", None), template)
+            self._add(getattr(route, "app", None), template)
+
+    def _add(self, handler, template: RouteTemplate):
+        if handler is None:
+            return
+
+        key = id(handler)
+        existing = self.templates.get(key)
+        if existing is not None and (
+            existing[1] is None or existing[1].template != template.template
+        ):
+            template = None
+        self.templates[key] = (handler, template)
+
+
+#: Route index for each Starlette router, keyed by the identity of the router.
+_route_indexes: Dict[int, _RouteIndex] = {}
+
+
+def _get_route_index(router) -> _RouteIndex:
+    """Get the route index for a Starlette router, building it if necessary.
+
+    The index is rebuilt if routes are added to the router after it was
+    built.
+    """
+    index = _route_indexes.get(id(router))
+    if (
+        index is None
+        or index.router is not router
+        or index.route_count != len(router.routes)
+    ):
+        if len(_route_indexes) >= ROUTE_CACHE_SIZE:
+            _route_indexes.clear()
+        index = _route_indexes[id(router)] = _RouteIndex(router)
+    return index
+
+
+def _match_routes(routes, scope, prefix: str) -> Optional[RouteTemplate]:
+    """Find the Starlette route that matches a request.
+
+    Like the Starlette router, a full match is preferred, otherwise the
+    first partial match (eg. where only the HTTP method is different) is
+    used.
+    """
+    # Starlette is always installed if we have a Starlette app in the scope
+    from starlette.routing import Match
+
+    partial = None
+    for route in routes:
+        match, child_scope = route.matches(scope)
+        if match is Match.FULL:
+            return _get_starlette_route(route, dict(scope, **child_scope), prefix)
+        if match is Match.PARTIAL and partial is None:
+            partial = (route, child_scope)
+
+    if partial is not None:
+        route, child_scope = partial
+        return _get_starlette_route(route, dict(scope, **child_scope), prefix)
+    return None
+
+
+def _get_starlette_route(route, child_scope, prefix: str) -> Optional[RouteTemplate]:
+    """Get the route template for a matching Starlette route."""
+    child_routes = getattr(route, "routes", None)
+    if child_routes:
+        # Mounted sub-application or router
+        return _match_routes(
+            child_routes, child_scope, prefix + getattr(route, "path", "")
+        )
+
+    cached = _get_cached_route(route, prefix)
+    if cached is not None:
+        return cached
+
+    path_format = getattr(route, "path_format", None)
+    if path_format is None:
+        return None
+    return _cache_route(route, prefix, prefix + path_format)
+
+
+def _get_cached_route(route, prefix: str) -> Optional[RouteTemplate]:
+    """Get the cached details for a route, if any."""
+    cached = _route_templates.get((id(route), prefix))
+    if cached is not None and cached[0] is route:
+        return cached[1]
+    return None
+
+
+def _cache_route(route, prefix: str, template: str) -> RouteTemplate:
+    """Cache the details for the template of a route."""
+    if len(_route_templates) >= ROUTE_CACHE_SIZE:
+        # There should be a fixed number of routes, so this only happens
+        # when lots of applications are created (eg. in tests).
+        _route_templates.clear()
+
+    result = RouteTemplate(template)
+    _route_templates[(id(route), prefix)] = (route, result)
+    return result
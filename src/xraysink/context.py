@@ -1,49 +1,432 @@
 """Recorder context that works well with asyncio."""
 
 import asyncio
+import logging
 import sys
+import threading
+from contextvars import ContextVar
+from threading import get_ident
+from typing import Iterator
+from typing import Optional
 
+from aws_xray_sdk import global_sdk_config
 from aws_xray_sdk.core.async_context import AsyncContext as _CoreAsyncContext
+from aws_xray_sdk.core.async_context import task_factory as _core_task_factory
+from aws_xray_sdk.core.context import Context as _CoreContext
+from aws_xray_sdk.core.models.dummy_entities import DummySegment
+
+from .aggregation import SubsegmentAggregation
+from .entities import UNDECIDED
+
+log = logging.getLogger(__name__)
 
 _GTE_PY37 = sys.version_info.major == 3 and sys.version_info.minor >= 7
 
 
-def _context_aware_task_factory(loop, coro):
+class _EntityStack:
+    """Persistent stack of trace entities.
+
+    Each node holds the entity at the top of the stack, and a reference to
+    the rest of the stack below it. Pushing and popping return a new head
+    node, and never modify an existing node. This means a new task can share
+    the entity stack of it's parent task in O(1) time and memory, no matter
+    how deeply nested the subsegments are, and changes made by either task
+    are not visible to the other.
+
+    The one exception is that a node's entity is released (set to `None`)
+    once it has ended and the task that added it has moved on. Otherwise, a
+    long-lived task that was started during a request would keep that
+    request's whole segment tree alive for as long as the task runs. A
+    released node is skipped over, as if it had been popped.
+
+    An empty stack is represented by `None`.
     """
-    Custom task factory function.
+
+    __slots__ = ("entity", "parent")
+
+    def __init__(self, entity, parent: Optional["_EntityStack"] = None):
+        self.entity = entity
+        self.parent = parent
+
+    def push(self, entity) -> "_EntityStack":
+        """Get a new stack with an entity added to the top."""
+        return _EntityStack(entity, self)
+
+    def pop(self) -> Optional["_EntityStack"]:
+        """Get the stack without it's top entity."""
+        return self.parent
+
+    def __bool__(self) -> bool:
+        return _skip_released(self) is not None
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self._iter_from_top())
+
+    def __iter__(self) -> Iterator:
+        """Iterate over the entities from the bottom to the top of the stack.
+
+        This is provided for compatibility with code that expects a list of
+        entities, and is O(n).
+        """
+        return reversed(list(self._iter_from_top()))
+
+    def __getitem__(self, index: int):
+        if index == -1:
+            node = _skip_released(self)
+            if node is None:
+                raise IndexError("Entity stack is empty")
+            return node.entity
+        return list(self)[index]
+
+    def _iter_from_top(self) -> Iterator:
+        node = self
+        while node is not None:
+            if node.entity is not None:
+                yield node.entity
+            node = node.parent
+
+
+def _skip_released(stack: Optional[_EntityStack]) -> Optional[_EntityStack]:
+    """Get the top node of a stack that hasn't been released, if any."""
+    while stack is not None and stack.entity is None:
+        stack = stack.parent
+    return stack
+
+
+def _release_ended(stack: _EntityStack) -> _EntityStack:
+    """Release the ended entities in a stack, and get a private copy of it.
+
+    The copy still has all of the entities, so the caller can finish sending
+    the segment. But other tasks that share the stack won't keep the ended
+    entities alive.
     """
-    task = asyncio.Task(coro, loop=loop)
+    entities = []
+    node = stack
+    while node is not None:
+        entity = node.entity
+        if entity is not None:
+            entities.append(entity)
+            if not entity.in_progress:
+                node.entity = None
+        node = node.parent
+
+    copy = None
+    for entity in reversed(entities):
+        copy = _EntityStack(entity, copy)
+    return copy
 
-    # noinspection PyUnresolvedReferences,PyProtectedMember
-    if task._source_traceback:
-        # noinspection PyUnresolvedReferences,PyProtectedMember
-        del task._source_traceback[-1]
 
-    # Propagate only the X-Ray context to the new task, if present
+class _EntityStackMixin:
+    """Context methods that store the entities in an `_EntityStack`.
+
+    This replaces the list of entities used by the core `Context` class.
+    The implementing class must provide `_local.entities` as the head of the
+    stack.
+    """
+
+    #: Aggregation of repetitive subsegments, if enabled.
+    _aggregation: Optional[SubsegmentAggregation] = None
+
+    def put_segment(self, segment):
+        self._local.entities = _EntityStack(segment)
+
+    def end_segment(self, end_time=None):
+        super().end_segment(end_time)
+
+        stack = getattr(self._local, "entities", None)
+        if stack is not None:
+            self._local.entities = _release_ended(stack)
+
+    def set_trace_entity(self, trace_entity):
+        self._local.entities = _EntityStack(trace_entity)
+
+    def put_subsegment(self, subsegment):
+        entity = self.get_trace_entity()
+        if not entity:
+            log.warning(
+                "Active segment or subsegment not found. Discarded %s.", subsegment.name
+            )
+            return
+
+        entity.add_subsegment(subsegment)
+        if entity.sampled == UNDECIDED and subsegment.sampled:
+            # Propagate the undecided trace downstream from the subsegment too
+            subsegment.sampled = UNDECIDED
+        self._local.entities = self._local.entities.push(subsegment)
+
+    def end_subsegment(self, end_time=None):
+        subsegment = self.get_trace_entity()
+        if self._is_subsegment(subsegment):
+            subsegment.close(end_time)
+
+            # Other tasks may share this node, so release the subsegment
+            node = _skip_released(self._local.entities)
+            node.entity = None
+            stack = _skip_released(node.parent)
+            if stack is None:
+                # The segment has already ended and been released by another
+                # task, but the recorder still needs it to send the segment
+                stack = _EntityStack(subsegment.parent_segment)
+            self._local.entities = stack
+
+            if self._aggregation is not None and stack is not None:
+                self._aggregation.add(stack.entity, subsegment)
+            return True
+        else:
+            log.warning("No subsegment to end.")
+            return False
+
+    def get_trace_entity(self):
+        stack = _skip_released(getattr(self._local, "entities", None))
+        if stack is None:
+            if not global_sdk_config.sdk_enabled():
+                return DummySegment()
+            return self.handle_context_missing()
+
+        return stack.entity
+
+
+#: State for the task factory that is currently creating a task (per thread).
+_factory_state = threading.local()
+
+
+def _current_task(loop):
     if _GTE_PY37:
-        current_task = asyncio.current_task(loop=loop)
+        return asyncio.current_task(loop=loop)
     else:
-        current_task = asyncio.Task.current_task(loop=loop)
+        return asyncio.Task.current_task(loop=loop)
+
+
+def _get_task_xray_context(task) -> Optional[dict]:
+    """Get the X-Ray context that is stored on a task, if any.
+
+    A task that is started eagerly (eg. by `asyncio.eager_task_factory`)
+    starts executing inside the task factory, before we have a chance to
+    attach the propagated X-Ray context to it. So if the task doesn't have a
+    context and we are inside the task factory, then this must be that task,
+    and we attach the propagated context now.
+    """
+    if task is None:
+        return None
+
+    try:
+        return task.context
+    except AttributeError:
+        pass
+
+    pending_context = getattr(_factory_state, "pending_context", None)
+    if pending_context is not None:
+        task.context = pending_context
+    return pending_context
 
-    if current_task is not None and hasattr(current_task, "context"):
-        # Propagate a copy of the current stack of entities (segment, plus
-        # ordered subsegments). We don't want to share the same entity stack
-        # amongst concurrent tasks, because that's just wrong.
-        new_context = {"entities": list(current_task.context.get("entities", []))}
-        task.context = new_context
 
-    return task
+class _ContextAwareTaskFactory:
+    """
+    Custom task factory that propagates the X-Ray context to a new task.
+
+    Construction of the task is delegated to the task factory that was
+    previously installed on the loop (if any), so that this can be layered
+    on top of eager tasks, custom task classes, and so on.
+    """
+
+    __slots__ = ("inner_factory",)
+
+    def __init__(self, inner_factory=None):
+        self.inner_factory = inner_factory
+
+    def __call__(self, loop, coro, **kwargs):
+        # Propagate only the X-Ray context to the new task, if present.
+        #
+        # The stack of entities (segment, plus ordered subsegments) is
+        # immutable, so it's safe to share it amongst concurrent tasks -
+        # each task will push and pop it's own entities without affecting
+        # the others.
+        current_context = _get_task_xray_context(_current_task(loop))
+        if current_context is None:
+            new_context = None
+        else:
+            new_context = {"entities": current_context.get("entities")}
+
+        previous_pending_context = getattr(_factory_state, "pending_context", None)
+        _factory_state.pending_context = new_context
+        try:
+            if self.inner_factory is None:
+                task = asyncio.Task(coro, loop=loop, **kwargs)
+
+                # noinspection PyUnresolvedReferences,PyProtectedMember
+                if task._source_traceback:
+                    # noinspection PyUnresolvedReferences,PyProtectedMember
+                    del task._source_traceback[-1]
+            else:
+                task = self.inner_factory(loop, coro, **kwargs)
+        finally:
+            _factory_state.pending_context = previous_pending_context
+
+        # An eager task may already have had the context attached
+        if new_context is not None and not hasattr(task, "context"):
+            task.context = new_context
+
+        return task
+
+
+class _TaskLocalStorage:
+    """Task local storage for the stack of X-Ray entities.
 
+    This is like the `TaskLocalStorage` in aws_xray_sdk, except that it also
+    works for tasks that are started eagerly.
 
-class AsyncContext(_CoreAsyncContext):
+    Outside of the event loop (eg. in a thread pool executor), the entities
+    are stored per thread instead. Otherwise, a worker thread would see the
+    entities of whichever task the event loop happened to be running.
+    """
+
+    __slots__ = ("_loop", "_loop_thread_id", "_thread_local")
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._loop_thread_id = None
+        self._thread_local = threading.local()
+
+    def _is_loop_thread(self) -> bool:
+        """Whether the current thread is running the event loop."""
+        # Getting the running loop is relatively slow, so remember the thread.
+        # The callers check the remembered thread first, to save a call.
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        if running_loop is self._loop:
+            self._loop_thread_id = get_ident()
+            return True
+        return False
+
+    @property
+    def entities(self) -> Optional[_EntityStack]:
+        if get_ident() != self._loop_thread_id and not self._is_loop_thread():
+            return getattr(self._thread_local, "entities", None)
+
+        context = _get_task_xray_context(_current_task(self._loop))
+        if context is None:
+            return None
+        return context.get("entities")
+
+    @entities.setter
+    def entities(self, value: Optional[_EntityStack]):
+        if get_ident() != self._loop_thread_id and not self._is_loop_thread():
+            self._thread_local.entities = value
+            return
+
+        task = _current_task(self._loop)
+        if task is None:
+            return
+
+        context = _get_task_xray_context(task)
+        if context is None:
+            task.context = context = {}
+        context["entities"] = value
+
+    def clear(self):
+        if get_ident() != self._loop_thread_id and not self._is_loop_thread():
+            self._thread_local.__dict__.clear()
+            return
+
+        context = _get_task_xray_context(_current_task(self._loop))
+        if context is not None:
+            context.clear()
+
+
+class AsyncContext(_EntityStackMixin, _CoreAsyncContext):
     """
     Async Context for storing segments.
 
     Fixes bugs in the parent class when using asyncio tasks.
+
+    If the event loop already has a custom task factory, then the X-Ray
+    task factory will wrap it rather than replace it. This means you can use
+    this together with (say) `asyncio.eager_task_factory`, or a custom task
+    class. Note that the task factory must be installed before the context
+    is created.
+
+    Pass a `SubsegmentAggregation` as `aggregation` to fold repetitive
+    subsegments into summary subsegments.
     """
 
-    def __init__(self, *args, use_task_factory=True, **kwargs):
-        super().__init__(self, *args, use_task_factory=use_task_factory, **kwargs)
+    def __init__(
+        self,
+        *args,
+        use_task_factory=True,
+        aggregation: Optional[SubsegmentAggregation] = None,
+        **kwargs,
+    ):
+        super().__init__(self, *args, use_task_factory=False, **kwargs)
+        self._local = _TaskLocalStorage(loop=self._loop)
+        self._aggregation = aggregation
 
         if use_task_factory:
-            self._loop.set_task_factory(_context_aware_task_factory)
+            inner_factory = self._loop.get_task_factory()
+            if isinstance(inner_factory, _ContextAwareTaskFactory):
+                # Don't propagate the context twice
+                inner_factory = inner_factory.inner_factory
+            elif inner_factory is _core_task_factory:
+                # The task factory from aws_xray_sdk does the same job as
+                # ours, but with a different implementation of the context.
+                inner_factory = None
+
+            self._loop.set_task_factory(_ContextAwareTaskFactory(inner_factory))
+
+
+class _ContextVarLocal:
+    """Stand-in for `threading.local` that keeps the entities in a `ContextVar`."""
+
+    __slots__ = ("_var",)
+
+    def __init__(self, var: ContextVar):
+        self._var = var
+
+    @property
+    def entities(self) -> Optional[_EntityStack]:
+        return self._var.get()
+
+    @entities.setter
+    def entities(self, value: Optional[_EntityStack]):
+        self._var.set(value)
+
+    def clear(self):
+        self._var.set(None)
+
+
+class ContextVarAsyncContext(_EntityStackMixin, _CoreContext):
+    """
+    Async Context for storing segments, using context variables.
+
+    asyncio already copies the current `contextvars` context into every new
+    task, so this doesn't need a custom task factory. That means there is no
+    per-task overhead, and it works with any event loop (eg. uvloop), even
+    if the loop already has a custom task factory.
+
+    Each task sees the stack of entities that was current when the task was
+    created. Concurrent tasks don't share changes to their entity stack.
+
+    Pass a `SubsegmentAggregation` as `aggregation` to fold repetitive
+    subsegments into summary subsegments.
+
+    The `loop` and `use_task_factory` parameters are accepted for
+    compatibility with `AsyncContext`, and are ignored.
+    """
+
+    def __init__(
+        self,
+        context_missing="LOG_ERROR",
+        loop=None,
+        use_task_factory=None,
+        *,
+        aggregation: Optional[SubsegmentAggregation] = None,
+    ):
+        super().__init__(context_missing=context_missing)
+        self._local = _ContextVarLocal(
+            ContextVar(f"xraysink_entities_{id(self)}", default=None)
+        )
+        self._aggregation = aggregation
+
+    def clear_trace_entities(self):
+        self._local.clear()
@@ -0,0 +1 @@
+"""Emitters that send finished X-Ray entities to the daemon without blocking."""
@@ -0,0 +1,421 @@
+"""Emitter that sends batches of entities directly to the X-Ray API."""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Deque
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from botocore.exceptions import ClientError
+from botocore.exceptions import ConnectionError as BotoConnectionError
+from botocore.exceptions import HTTPClientError
+
+from .serialization import EntitySerializer
+from .serialization import serialize_entity
+from .udp import DEFAULT_MAX_QUEUE_SIZE
+
+log = logging.getLogger(__name__)
+
+#: Maximum number of segment documents in one `PutTraceSegments` request.
+MAX_BATCH_DOCUMENTS: int = 50
+
+#: Default maximum total size in bytes of the segment documents in a batch.
+DEFAULT_MAX_BATCH_BYTES: int = 64 * 1024
+
+#: Default maximum number of seconds that a document waits to be sent.
+DEFAULT_FLUSH_INTERVAL: float = 1.0
+
+#: Default maximum total size in bytes of the serialised documents that are
+#: waiting to be sent (including a batch that is being retried).
+DEFAULT_MAX_BUFFER_BYTES: int = 1024 * 1024
+
+#: Default maximum number of attempts to send a batch.
+DEFAULT_MAX_ATTEMPTS: int = 4
+
+#: Default delay in seconds before the first retry. This doubles for each
+#: subsequent retry, with random jitter.
+DEFAULT_BACKOFF_BASE: float = 0.1
+
+#: Maximum delay in seconds between attempts to send a batch.
+_MAX_BACKOFF: float = 5.0
+
+#: HTTP status codes of errors that are worth retrying.
+_RETRYABLE_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+#: Error codes for API throttling, which is worth retrying.
+_THROTTLING_ERROR_CODES = frozenset(
+    ["ThrottledException", "ThrottlingException", "TooManyRequestsException"]
+)
+
+
+class XRayAPIEmitter:
+    """Emitter that sends batches of entities with the `PutTraceSegments` API.
+
+    Rather than sending each entity to the X-Ray daemon in its own UDP
+    datagram, this serialises entities in a background thread and sends
+    them straight to the X-Ray API in batches. A batch has up to 50
+    documents, and up to `max_batch_bytes` in total. A batch is sent as soon
+    as it is full, or when its oldest document has waited `flush_interval`
+    seconds. All requests go over a single pooled HTTP connection (using
+    `botocore`), and failed requests are retried with exponential backoff.
+
+    Memory use is bounded. If more than `max_queue_size` entities are
+    waiting to be serialised, or the serialised documents waiting to be sent
+    exceed `max_buffer_bytes` (eg. while the API is unavailable), then new
+    entities are dropped. A document that is bigger than `max_batch_bytes` is
+    also dropped, since the API would reject it. The `enqueued`, `sent` and
+    `dropped` counters record what happened to each entity.
+
+    The background thread is started when the first entity is emitted. Call
+    `close()` when the application shuts down, so that any buffered
+    documents are sent and the thread stops.
+
+    Params:
+        region_name: AWS region of the X-Ray API. Defaults to the region
+            configured for `botocore`.
+        endpoint_url: Override the URL of the X-Ray API.
+        client: A `botocore` (or `boto3`) X-Ray client to use, rather than
+            creating one.
+        max_batch_bytes: Maximum total size of the documents in a batch.
+        flush_interval: Maximum number of seconds a document is buffered
+            before it is sent.
+        max_queue_size: Maximum number of entities waiting to be serialised.
+        max_buffer_bytes: Maximum total size of the documents waiting to be
+            sent.
+        max_attempts: Maximum number of attempts to send each batch.
+        backoff_base: Delay in seconds before the first retry.
+        serializer: Function that serialises an entity to a JSON segment
+            document.
+
+    Notes:
+        The process needs AWS credentials with permission for the
+        `xray:PutTraceSegments` action. `botocore` finds these in the same
+        way as for other AWS clients.
+    """
+
+    def __init__(
+        self,
+        *,
+        region_name: Optional[str] = None,
+        endpoint_url: Optional[str] = None,
+        client=None,
+        max_batch_bytes: int = DEFAULT_MAX_BATCH_BYTES,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+        max_buffer_bytes: int = DEFAULT_MAX_BUFFER_BYTES,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        backoff_base: float = DEFAULT_BACKOFF_BASE,
+        serializer: EntitySerializer = serialize_entity,
+    ):
+        self._region_name = region_name
+        self._endpoint_url = endpoint_url
+        self._client = client
+        self._max_batch_bytes = max_batch_bytes
+        self._flush_interval = flush_interval
+        self._max_queue_size = max_queue_size
+        self._max_buffer_bytes = max_buffer_bytes
+        self._max_attempts = max_attempts
+        self._backoff_base = backoff_base
+        self._serializer = serializer
+
+        # Entities waiting to be serialised. Guarded by the condition.
+        self._pending: Deque = deque()
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._flushing = False
+        self._busy = False
+
+        # Serialised documents waiting to be sent, with their size in bytes.
+        # Only used by the thread.
+        self._buffer: Deque[Tuple[str, int]] = deque()
+        self._buffer_bytes = 0
+        self._buffer_started = 0.0
+
+        # Only updated while holding the condition's lock
+        self._enqueued = 0
+        self._sent = 0
+        self._dropped = 0
+
+    def send_entity(self, entity):
+        """Queue a segment/subsegment to be sent to the X-Ray API.
+
+        This never blocks. If the queue is already full then the entity is
+        dropped.
+        """
+        with self._condition:
+            if len(self._pending) >= self._max_queue_size:
+                self._dropped += 1
+                log.debug("X-Ray emitter queue is full. Dropped entity %s", entity.id)
+                return
+
+            self._pending.append(entity)
+            self._enqueued += 1
+            if self._thread is None:
+                self._start()
+            self._condition.notify_all()
+
+    def set_daemon_address(self, address: Optional[str]):
+        """Ignore the daemon address, since this emitter doesn't use the daemon."""
+
+    @property
+    def enqueued(self) -> int:
+        """Number of entities that have been accepted into the queue."""
+        return self._enqueued
+
+    @property
+    def sent(self) -> int:
+        """Number of entities that have been sent to the X-Ray API."""
+        return self._sent
+
+    @property
+    def dropped(self) -> int:
+        """Number of entities that were discarded without being sent.
+
+        This includes entities rejected because the queue or buffer was full,
+        entities that failed to serialise or were too big, and entities in
+        a batch that failed to send (or that the API didn't process).
+        """
+        return self._dropped
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of entities currently waiting to be sent."""
+        return len(self._pending) + len(self._buffer)
+
+    @property
+    def buffer_bytes(self) -> int:
+        """Total size of the serialised documents waiting to be sent."""
+        return self._buffer_bytes
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every entity that is currently queued has been sent.
+
+        This sends the buffered documents straight away, even if the batch
+        isn't full.
+
+        Returns:
+            True if everything was sent, or false if the timeout expired first.
+        """
+        with self._condition:
+            if self._thread is None:
+                return True
+            self._flushing = True
+            self._condition.notify_all()
+            return self._condition.wait_for(
+                lambda: not self._pending and not self._buffer and not self._busy,
+                timeout,
+            )
+
+    async def drain(self):
+        """Send every entity that is currently queued.
+
+        This is a hook for graceful shutdown, for consistency with
+        `AsyncUDPEmitter`. It waits in the default executor, so the event
+        loop isn't blocked.
+        """
+        await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+    async def close(self):
+        """Send any buffered documents, then stop the background thread."""
+        await asyncio.get_running_loop().run_in_executor(None, self.shutdown)
+
+    def shutdown(self):
+        """Send any buffered documents, then stop the background thread.
+
+        This blocks, so it is suitable for use outside an event loop (eg. in
+        an `atexit` handler). The emitter starts a new thread if more
+        entities are emitted afterwards.
+        """
+        with self._condition:
+            thread = self._thread
+            if thread is None:
+                return
+            self._stopping = True
+            self._condition.notify_all()
+
+        thread.join()
+
+    def _start(self):
+        """Start the background thread. The caller must hold the lock."""
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._run, name="xraysink-api-emitter", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        """Serialise and send entities until the emitter is stopped."""
+        while True:
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+                self._condition.wait_for(self._has_work, self._get_wait_timeout())
+
+                entities = list(self._pending)
+                self._pending.clear()
+                flush_all = self._flushing or self._stopping
+                if flush_all and not entities and not self._buffer:
+                    self._flushing = False
+                    if self._stopping:
+                        self._thread = None
+                        return
+                    continue
+                self._busy = True
+
+            for entity in entities:
+                self._buffer_entity(entity)
+
+            while self._buffer and (flush_all or self._is_batch_ready()):
+                self._send_batch(*self._take_batch())
+
+    def _has_work(self) -> bool:
+        """Whether the thread has anything to do. The caller must hold the lock."""
+        return bool(
+            self._pending
+            or self._stopping
+            or self._flushing
+            or (self._buffer and self._is_batch_ready())
+        )
+
+    def _get_wait_timeout(self) -> Optional[float]:
+        """Number of seconds until the buffered documents must be sent."""
+        if not self._buffer:
+            return None
+        return max(0.0, self._buffer_started + self._flush_interval - time.monotonic())
+
+    def _is_batch_ready(self) -> bool:
+        """Whether a batch is full, or the oldest document has waited too long."""
+        return (
+            len(self._buffer) >= MAX_BATCH_DOCUMENTS
+            or self._buffer_bytes >= self._max_batch_bytes
+            or time.monotonic() - self._buffer_started >= self._flush_interval
+        )
+
+    def _buffer_entity(self, entity):
+        """Serialise an entity, and add it to the buffer if there is room."""
+        try:
+            document = self._serializer(entity)
+        except Exception:
+            log.exception("Failed to serialise entity for X-Ray API.")
+            self._count_dropped(1)
+            return
+
+        # The API limits the size of the UTF-8 encoded documents. A custom
+        # serializer may not escape non-ASCII characters.
+        size = len(document.encode("utf-8"))
+        if size > self._max_batch_bytes:
+            log.warning(
+                "Entity %s is too big to send to the X-Ray API (%d bytes)",
+                entity.id,
+                size,
+            )
+            self._count_dropped(1)
+            return
+        if self._buffer_bytes + size > self._max_buffer_bytes:
+            log.debug("X-Ray emitter buffer is full. Dropped entity %s", entity.id)
+            self._count_dropped(1)
+            return
+
+        if not self._buffer:
+            self._buffer_started = time.monotonic()
+        self._buffer.append((document, size))
+        self._buffer_bytes += size
+
+    def _take_batch(self) -> Tuple[List[str], int]:
+        """Take a batch of documents from the front of the buffer.
+
+        The documents stay in the memory budget until the batch has been
+        sent (or given up on).
+
+        Returns:
+            The documents, and their total size in bytes.
+        """
+        batch = []
+        batch_bytes = 0
+        while self._buffer and len(batch) < MAX_BATCH_DOCUMENTS:
+            size = self._buffer[0][1]
+            if batch and batch_bytes + size > self._max_batch_bytes:
+                break
+            batch.append(self._buffer.popleft()[0])
+            batch_bytes += size
+
+        # Start the interval again for the documents left for the next batch
+        self._buffer_started = time.monotonic()
+        return batch, batch_bytes
+
+    def _send_batch(self, batch: List[str], batch_bytes: int):
+        """Send a batch of documents, retrying if necessary."""
+        try:
+            for attempt in range(1, self._max_attempts + 1):
+                try:
+                    response = self._get_client().put_trace_segments(
+                        TraceSegmentDocuments=batch
+                    )
+                except Exception as exc:
+                    if attempt == self._max_attempts or not _is_retryable(exc):
+                        log.warning(
+                            "Failed to send %d entities to X-Ray API: %s",
+                            len(batch),
+                            exc,
+                        )
+                        self._count_dropped(len(batch))
+                        return
+                    time.sleep(self._get_backoff(attempt))
+                else:
+                    self._count_sent(batch, response)
+                    return
+        finally:
+            self._buffer_bytes -= batch_bytes
+
+    def _count_sent(self, batch: List[str], response: dict):
+        """Update the counters after a batch has been sent."""
+        unprocessed = response.get("UnprocessedTraceSegments") or []
+        if unprocessed:
+            log.warning(
+                "X-Ray API didn't process %d entities. First error: %s",
+                len(unprocessed),
+                unprocessed[0].get("Message") or unprocessed[0].get("ErrorCode"),
+            )
+        with self._condition:
+            self._sent += len(batch) - len(unprocessed)
+            self._dropped += len(unprocessed)
+
+    def _count_dropped(self, count: int):
+        with self._condition:
+            self._dropped += count
+
+    def _get_backoff(self, attempt: int) -> float:
+        """Number of seconds to wait before a retry, with "full jitter"."""
+        limit = min(_MAX_BACKOFF, self._backoff_base * 2 ** (attempt - 1))
+        return random.uniform(0, limit)
+
+    def _get_client(self):
+        """Get the X-Ray API client, creating it if necessary."""
+        if self._client is None:
+            from botocore.config import Config
+            from botocore.session import get_session
+
+            # Retries are handled by the emitter, so that the backoff is
+            # consistent between botocore versions
+            self._client = get_session().create_client(
+                "xray",
+                region_name=self._region_name,
+                endpoint_url=self._endpoint_url,
+                config=Config(retries={"max_attempts": 0}, max_pool_connections=1),
+            )
+        return self._client
+
+
+def _is_retryable(exc: Exception) -> bool:
+    """Whether a request to the X-Ray API is worth retrying after an error."""
+    if isinstance(exc, ClientError):
+        status = exc.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        code = exc.response.get("Error", {}).get("Code")
+        return status in _RETRYABLE_STATUS_CODES or code in _THROTTLING_ERROR_CODES
+    return isinstance(exc, (BotoConnectionError, HTTPClientError))
@@ -0,0 +1,644 @@
+"""Emitter that hands entities to a collector through a shared ring buffer.
+
+Note that this uses `fcntl`, so it's only available on POSIX platforms.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+import zlib
+from typing import Callable
+from typing import List
+from typing import Optional
+
+from aws_xray_sdk.core.daemon_config import DaemonConfig
+from aws_xray_sdk.core.emitters.udp_emitter import DEFAULT_DAEMON_ADDRESS
+from aws_xray_sdk.core.emitters.udp_emitter import PROTOCOL_DELIMITER
+from aws_xray_sdk.core.emitters.udp_emitter import PROTOCOL_HEADER
+
+from ..shared_memory import SharedMemoryFile
+from .serialization import EntitySerializer
+from .serialization import serialize_entity
+
+log = logging.getLogger(__name__)
+
+#: Default number of rings in the buffer, which is the maximum number of
+#: processes that can write to it at the same time.
+DEFAULT_RING_COUNT: int = 64
+
+#: Default size in bytes of the ring for each writer process.
+DEFAULT_RING_SIZE: int = 1024 * 1024
+
+#: Default number of seconds that the collector waits when the buffer is empty.
+DEFAULT_POLL_INTERVAL: float = 0.01
+
+#: Default maximum number of documents per second that the collector sends to
+#: the daemon. Sending faster than this overflows the daemon's receive buffer
+#: during a burst, so most of the burst would be lost.
+DEFAULT_MAX_SEND_RATE: float = 5000.0
+
+#: Function that sends a batch of segment documents (as UTF-8 JSON) somewhere.
+DocumentSender = Callable[[List[bytes]], None]
+
+#: Identifies a shared memory file that holds a ring buffer ("xraysink").
+_MAGIC: int = 0x78726179_73696E6B
+
+#: Header of the shared memory file: the magic number, the number of rings,
+#: and the size of each ring. The header is padded to `_HEADER_SIZE`.
+_FILE_HEADER = struct.Struct("QQQ")
+
+#: Size in bytes of the file header.
+_HEADER_SIZE: int = 64
+
+#: Size in bytes of the header of each ring. The fields written by the writer
+#: and by the reader are on separate cache lines.
+_RING_HEADER_SIZE: int = 128
+
+#: Offsets of the fields in a ring header. The head, written and overflowed
+#: fields are only written by the process that owns the ring, and the tail
+#: only by the collector, so they don't need a lock.
+_HEAD_OFFSET: int = 0
+_WRITTEN_OFFSET: int = 8
+_OVERFLOWED_OFFSET: int = 16
+_OWNER_OFFSET: int = 24
+_TAIL_OFFSET: int = 64
+
+#: A field in a header.
+_WORD = struct.Struct("Q")
+
+#: Header of each record in a ring: the length and CRC-32 of the document.
+_RECORD_HEADER = struct.Struct("II")
+
+#: Records start on a multiple of this many bytes, so that a record header
+#: is never split across the end of a ring.
+_ALIGNMENT: int = 8
+
+#: Number of times in a row that the collector finds an invalid record at the
+#: tail of a ring, before discarding the rest of the ring.
+_MAX_INVALID_READS: int = 100
+
+#: Number of seconds before a process tries again to claim a ring, when they
+#: were all in use.
+_CLAIM_RETRY_INTERVAL: float = 1.0
+
+#: Number of documents that the collector sends to the daemon in one go, when
+#: it limits the rate that it sends them.
+_SEND_BURST_SIZE: int = 8
+
+#: Prefix of each UDP message to the daemon.
+_MESSAGE_PREFIX: bytes = (PROTOCOL_HEADER + PROTOCOL_DELIMITER).encode("utf-8")
+
+
+def _align(size: int) -> int:
+    return (size + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+class SharedRingBuffer:
+    """Ring buffer in shared memory, for segment documents from many processes.
+
+    The buffer holds a fixed number of rings. Each writer process claims a
+    ring of its own, and a single collector reads from all of them. So each
+    ring has exactly one writer and one reader, which only update their own
+    position in the ring. Writing and reading don't need a lock, and a
+    writer never waits for the collector: if its ring is full, then the
+    document is dropped and the ring's `overflowed` counter is incremented.
+
+    Each record has the CRC-32 of its document, and the collector only reads
+    a record once its contents match. So the collector never sees a
+    partially written document, even if the memory writes become visible to
+    it out of order.
+
+    The shared memory is created by the first process to use it, with the
+    given number and size of rings. Every other process uses the same
+    geometry, whatever it asks for.
+
+    Params:
+        name: Name of the shared memory file.
+        ring_count: Number of rings, ie. the maximum number of writer
+            processes at the same time.
+        ring_size: Size in bytes of each ring.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        ring_count: int = DEFAULT_RING_COUNT,
+        ring_size: int = DEFAULT_RING_SIZE,
+    ):
+        ring_size = _align(ring_size)
+        self._memory = SharedMemoryFile(
+            name, _HEADER_SIZE + ring_count * (_RING_HEADER_SIZE + ring_size)
+        )
+        self._buf = self._memory.buf
+
+        with self._memory:
+            magic, count, size = _FILE_HEADER.unpack_from(self._buf, 0)
+            if magic != _MAGIC:
+                _FILE_HEADER.pack_into(self._buf, 0, _MAGIC, ring_count, ring_size)
+                count, size = ring_count, ring_size
+        self._ring_count = count
+        self._ring_size = size
+
+        # Only used by the collector
+        self._invalid_reads = [0] * count
+
+    @property
+    def ring_count(self) -> int:
+        return self._ring_count
+
+    @property
+    def ring_size(self) -> int:
+        return self._ring_size
+
+    @property
+    def written(self) -> int:
+        """Number of documents written to the buffer, by every process."""
+        return sum(self._get_field(i, _WRITTEN_OFFSET) for i in range(self._ring_count))
+
+    @property
+    def overflowed(self) -> int:
+        """Number of documents dropped because a ring was full or too small."""
+        return sum(
+            self._get_field(i, _OVERFLOWED_OFFSET) for i in range(self._ring_count)
+        )
+
+    def claim_ring(self) -> Optional[int]:
+        """Claim a ring for this process to write to.
+
+        Returns:
+            The index of the ring, or None if every ring is already owned by
+            a running process.
+        """
+        pid = os.getpid()
+        with self._memory:
+            for ring in range(self._ring_count):
+                owner = self._get_field(ring, _OWNER_OFFSET)
+                if owner == 0 or not _is_running(owner):
+                    self._set_field(ring, _OWNER_OFFSET, pid)
+                    return ring
+        return None
+
+    def release_ring(self, ring: int):
+        """Release a ring that this process claimed, so another can use it.
+
+        Any documents in the ring are still read by the collector.
+        """
+        with self._memory:
+            if self._get_field(ring, _OWNER_OFFSET) == os.getpid():
+                self._set_field(ring, _OWNER_OFFSET, 0)
+
+    def write(self, ring: int, document: bytes) -> bool:
+        """Write a document to a ring, if there is room for it.
+
+        Only the process that claimed the ring may write to it, and only from
+        one thread at a time.
+
+        Returns:
+            True if the document was written, or false if it was dropped.
+        """
+        buf = self._buf
+        ring_offset = self._get_ring_offset(ring)
+        data_offset = ring_offset + _RING_HEADER_SIZE
+        ring_size = self._ring_size
+
+        length = len(document)
+        record_size = _align(_RECORD_HEADER.size + length)
+        (head,) = _WORD.unpack_from(buf, ring_offset + _HEAD_OFFSET)
+        (tail,) = _WORD.unpack_from(buf, ring_offset + _TAIL_OFFSET)
+        if head + record_size - tail > ring_size:
+            self._increment_field(ring, _OVERFLOWED_OFFSET)
+            return False
+
+        position = head % ring_size
+        _RECORD_HEADER.pack_into(
+            buf, data_offset + position, length, zlib.crc32(document)
+        )
+
+        # The document may wrap around to the start of the ring
+        start = data_offset + (position + _RECORD_HEADER.size) % ring_size
+        first_length = min(length, data_offset + ring_size - start)
+        view = memoryview(document)
+        buf[start : start + first_length] = view[:first_length]
+        if first_length < length:
+            buf[data_offset : data_offset + length - first_length] = view[first_length:]
+
+        # Publish the record to the collector last
+        self._increment_field(ring, _WRITTEN_OFFSET)
+        _WORD.pack_into(buf, ring_offset + _HEAD_OFFSET, head + record_size)
+        return True
+
+    def read(self, ring: int) -> List[bytes]:
+        """Read every complete document from a ring, and free their space.
+
+        Only one process (the collector) may read from the buffer.
+        """
+        buf = self._buf
+        ring_offset = self._get_ring_offset(ring)
+        data_offset = ring_offset + _RING_HEADER_SIZE
+        ring_size = self._ring_size
+
+        (head,) = _WORD.unpack_from(buf, ring_offset + _HEAD_OFFSET)
+        (tail,) = _WORD.unpack_from(buf, ring_offset + _TAIL_OFFSET)
+        available = head - tail
+        if available <= 0:
+            return []
+
+        # Copy all the records in one go (or two, if they wrap around)
+        start = data_offset + tail % ring_size
+        end = start + available
+        if end <= data_offset + ring_size:
+            chunk = buf[start:end]
+        else:
+            wrapped = end - (data_offset + ring_size)
+            chunk = (
+                buf[start : data_offset + ring_size]
+                + buf[data_offset : data_offset + wrapped]
+            )
+
+        documents = []
+        offset = 0
+        while offset < available:
+            length, crc = _RECORD_HEADER.unpack_from(chunk, offset)
+            document = chunk[
+                offset + _RECORD_HEADER.size : offset + _RECORD_HEADER.size + length
+            ]
+            if len(document) != length or zlib.crc32(document) != crc:
+                # The record isn't visible yet, so try again next time
+                break
+            documents.append(document)
+            offset += _align(_RECORD_HEADER.size + length)
+
+        if offset == 0:
+            self._invalid_reads[ring] += 1
+            if self._invalid_reads[ring] < _MAX_INVALID_READS:
+                return documents
+            log.warning("Discarding invalid records from X-Ray ring buffer %d", ring)
+            offset = available
+        self._invalid_reads[ring] = 0
+
+        _WORD.pack_into(buf, ring_offset + _TAIL_OFFSET, tail + offset)
+        return documents
+
+    def unlink(self):
+        """Remove the shared memory file."""
+        self._memory.unlink()
+
+    def _get_ring_offset(self, ring: int) -> int:
+        return _HEADER_SIZE + ring * (_RING_HEADER_SIZE + self._ring_size)
+
+    def _get_field(self, ring: int, field_offset: int) -> int:
+        (value,) = _WORD.unpack_from(
+            self._buf, self._get_ring_offset(ring) + field_offset
+        )
+        return value
+
+    def _set_field(self, ring: int, field_offset: int, value: int):
+        _WORD.pack_into(self._buf, self._get_ring_offset(ring) + field_offset, value)
+
+    def _increment_field(self, ring: int, field_offset: int):
+        self._set_field(ring, field_offset, self._get_field(ring, field_offset) + 1)
+
+
+def _is_running(pid: int) -> bool:
+    """Whether a process is still running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists, but belongs to another user
+        pass
+    return True
+
+
+class SharedRingBufferEmitter:
+    """Emitter that writes entities to a ring buffer shared by worker processes.
+
+    This is a drop-in replacement for the SDK's `UDPEmitter`, for
+    applications with many worker processes (eg. under gunicorn or uvicorn).
+    Rather than each worker sending its own datagrams to the X-Ray daemon,
+    `send_entity()` serialises the entity and writes it to the worker's ring
+    in a `SharedRingBuffer`. A single `SharedRingBufferCollector` (in its own
+    process, or a thread of one process) drains the buffer in bulk and sends
+    the documents to the daemon.
+
+    A burst of segments then waits in the buffer, rather than overflowing
+    the daemon's receive buffer. If a worker's ring is full, then the entity
+    is dropped, and counted by both the emitter and the buffer.
+
+    Each process claims its ring when it first emits an entity (so the
+    emitter can be created before the workers are forked), and releases it
+    on `close()`. A ring whose process has exited is claimed again by
+    another process. If every ring is in use, then the entities are dropped,
+    and the emitter tries again to claim a ring after a second.
+
+    Params:
+        name: Name of the shared memory file for the buffer. This should be
+            distinct for each application, and the same in every worker and
+            the collector.
+        ring_count: Number of rings, if this creates the buffer.
+        ring_size: Size in bytes of each ring, if this creates the buffer.
+        serializer: Function that serialises an entity to a JSON segment
+            document.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        ring_count: int = DEFAULT_RING_COUNT,
+        ring_size: int = DEFAULT_RING_SIZE,
+        serializer: EntitySerializer = serialize_entity,
+    ):
+        self._buffer = SharedRingBuffer(
+            name, ring_count=ring_count, ring_size=ring_size
+        )
+        self._serializer = serializer
+
+        self._lock = threading.Lock()
+        self._ring: Optional[int] = None
+        self._pid: Optional[int] = None
+        self._claim_time = 0.0
+
+        self._enqueued = 0
+        self._dropped = 0
+
+    def send_entity(self, entity):
+        """Write a segment/subsegment to the ring buffer.
+
+        This never blocks on the collector. If the ring is full then the
+        entity is dropped.
+        """
+        try:
+            document = self._serializer(entity).encode("utf-8")
+        except Exception:
+            log.exception("Failed to serialise X-Ray entity.")
+            self._dropped += 1
+            return
+
+        with self._lock:
+            ring = self._get_ring()
+            if ring is not None and self._buffer.write(ring, document):
+                self._enqueued += 1
+                return
+            self._dropped += 1
+
+        log.debug("X-Ray ring buffer is full. Dropped entity %s", entity.id)
+
+    def set_daemon_address(self, address: Optional[str]):
+        """Ignored, since the collector sends the entities to the daemon."""
+
+    @property
+    def buffer(self) -> SharedRingBuffer:
+        return self._buffer
+
+    @property
+    def enqueued(self) -> int:
+        """Number of entities written to the ring buffer by this process."""
+        return self._enqueued
+
+    @property
+    def dropped(self) -> int:
+        """Number of entities from this process that were discarded.
+
+        This includes entities that didn't fit in the ring, and entities
+        that failed to serialise.
+        """
+        return self._dropped
+
+    async def drain(self):
+        """Nothing to do, since entities are written to the buffer straight away.
+
+        This is a hook for graceful shutdown, for consistency with
+        `AsyncUDPEmitter`.
+        """
+
+    async def close(self):
+        """Release this process's ring."""
+        self.shutdown()
+
+    def shutdown(self):
+        """Release this process's ring, so that another process can use it.
+
+        The emitter claims a ring again if more entities are emitted
+        afterwards.
+        """
+        with self._lock:
+            if self._ring is not None and self._pid == os.getpid():
+                self._buffer.release_ring(self._ring)
+            self._ring = None
+            self._pid = None
+
+    def _get_ring(self) -> Optional[int]:
+        """Get this process's ring, claiming it if necessary.
+
+        The caller must hold the lock.
+        """
+        pid = os.getpid()
+        if self._pid != pid:
+            # Either the first entity, or this is a forked child process
+            self._ring = None
+            self._pid = pid
+            self._claim_time = 0.0
+
+        if self._ring is None and time.monotonic() >= self._claim_time:
+            self._ring = self._buffer.claim_ring()
+            if self._ring is None:
+                log.warning("Every X-Ray ring buffer is in use by another process.")
+                self._claim_time = time.monotonic() + _CLAIM_RETRY_INTERVAL
+        return self._ring
+
+
+class SharedRingBufferCollector:
+    """Sends the documents from a shared ring buffer to the X-Ray daemon.
+
+    There must be a single collector for each buffer, running in its own
+    process or in a thread of one process (eg. the gunicorn master process).
+    `start()` starts a thread that drains the buffer whenever it has
+    documents, and otherwise polls it every `poll_interval` seconds.
+
+    The daemon's receive buffer is much smaller than the ring buffer, so a
+    burst sent as fast as possible overflows it, and most of the burst is
+    lost. So the documents are sent at no more than `max_send_rate` per
+    second, and bursts are held in the ring buffer and sent smoothly instead
+    (as long as they fit). Raise it if the daemon can keep up with more.
+
+    Params:
+        name: Name of the shared memory file for the buffer.
+        daemon_address: Address of the X-Ray daemon, in the same format as
+            `xray_recorder.configure(daemon_address=...)`
+        ring_count: Number of rings, if this creates the buffer.
+        ring_size: Size in bytes of each ring, if this creates the buffer.
+        poll_interval: Number of seconds to wait when the buffer is empty.
+        max_send_rate: Maximum number of documents sent to the daemon per
+            second, or `None` to send them as fast as possible.
+        sender: Function that sends each batch of documents, instead of
+            sending them to the daemon (eg. to forward them to an exporter).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        daemon_address: str = DEFAULT_DAEMON_ADDRESS,
+        *,
+        ring_count: int = DEFAULT_RING_COUNT,
+        ring_size: int = DEFAULT_RING_SIZE,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        max_send_rate: Optional[float] = DEFAULT_MAX_SEND_RATE,
+        sender: Optional[DocumentSender] = None,
+    ):
+        self._buffer = SharedRingBuffer(
+            name, ring_count=ring_count, ring_size=ring_size
+        )
+        self.set_daemon_address(daemon_address)
+        self._poll_interval = poll_interval
+        self._max_send_rate = max_send_rate
+        self._send_time = 0.0
+        self._sender = sender if sender is not None else self._send_to_daemon
+
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._socket: Optional[socket.socket] = None
+
+        self._received = 0
+        self._sent = 0
+        self._failed = 0
+
+    def set_daemon_address(self, address: Optional[str]):
+        """Set up the UDP IP and port from the raw daemon address string."""
+        if address:
+            daemon_config = DaemonConfig(address)
+            self._ip, self._port = daemon_config.udp_ip, daemon_config.udp_port
+
+    @property
+    def ip(self) -> str:
+        return self._ip
+
+    @property
+    def port(self) -> int:
+        return self._port
+
+    @property
+    def buffer(self) -> SharedRingBuffer:
+        return self._buffer
+
+    @property
+    def received(self) -> int:
+        """Number of documents read from the buffer."""
+        return self._received
+
+    @property
+    def sent(self) -> int:
+        """Number of documents that have been sent."""
+        return self._sent
+
+    @property
+    def overflowed(self) -> int:
+        """Number of documents that the writers dropped because a ring was full."""
+        return self._buffer.overflowed
+
+    @property
+    def dropped(self) -> int:
+        """Number of documents that were discarded without being sent.
+
+        This includes documents that didn't fit in a ring, and documents
+        that failed to send.
+        """
+        return self.overflowed + self._failed
+
+    def drain(self) -> int:
+        """Send every document that is currently in the buffer.
+
+        Returns:
+            The number of documents read from the buffer.
+        """
+        count = 0
+        with self._lock:
+            for ring in range(self._buffer.ring_count):
+                documents = self._buffer.read(ring)
+                if not documents:
+                    continue
+                count += len(documents)
+                self._received += len(documents)
+                try:
+                    self._sender(documents)
+                except Exception:
+                    log.exception("Failed to send documents to X-Ray.")
+                    self._failed += len(documents)
+                else:
+                    self._sent += len(documents)
+        return count
+
+    def start(self):
+        """Start the thread that drains the buffer, if it isn't already running."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="xraysink-collector", daemon=True
+            )
+            self._thread.start()
+
+    def shutdown(self):
+        """Stop the thread, then send whatever is left in the buffer.
+
+        This blocks, so it is suitable for use outside an event loop (eg. in
+        an `atexit` handler).
+        """
+        thread = self._thread
+        if thread is not None:
+            self._stopping.set()
+            thread.join()
+            self._thread = None
+
+        self.drain()
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    async def close(self):
+        """Stop the thread, and send whatever is left in the buffer."""
+        await asyncio.get_running_loop().run_in_executor(None, self.shutdown)
+
+    def _run(self):
+        """Drain the buffer until the collector is stopped."""
+        while not self._stopping.is_set():
+            try:
+                count = self.drain()
+            except Exception:
+                log.exception("Failed to read from X-Ray ring buffer.")
+                count = 0
+            if count == 0:
+                self._stopping.wait(self._poll_interval)
+
+    def _send_to_daemon(self, documents: List[bytes]):
+        """Send each document to the daemon in its own datagram."""
+        if self._socket is None:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sendto = self._socket.sendto
+        address = (self._ip, self._port)
+        for start in range(0, len(documents), _SEND_BURST_SIZE):
+            burst = documents[start : start + _SEND_BURST_SIZE]
+            self._wait_to_send(len(burst))
+            for document in burst:
+                sendto(_MESSAGE_PREFIX + document, address)
+
+    def _wait_to_send(self, count: int):
+        """Wait until some documents can be sent, without exceeding the rate."""
+        if self._max_send_rate is None:
+            return
+
+        # The documents are due to be sent once the previous ones are done,
+        # but unused time doesn't allow a burst beyond `_SEND_BURST_SIZE`
+        now = time.monotonic()
+        send_time = max(self._send_time, now - _SEND_BURST_SIZE / self._max_send_rate)
+        self._send_time = send_time + count / self._max_send_rate
+        if send_time > now:
+            time.sleep(send_time - now)
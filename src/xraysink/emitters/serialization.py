@@ -0,0 +1,131 @@
+"""Fast serialisation of X-Ray entities to segment documents."""
+
+import json.encoder
+from json.encoder import JSONEncoder
+from json.encoder import encode_basestring_ascii
+from typing import Callable
+from typing import Optional
+
+from aws_xray_sdk.core.models.entity import ORIGIN_TRACE_HEADER_ATTR_KEY
+from aws_xray_sdk.core.models.entity import Entity
+from aws_xray_sdk.core.models.segment import Segment
+from aws_xray_sdk.core.models.subsegment import Subsegment
+from aws_xray_sdk.core.utils.conversion import metadata_to_dict
+
+#: Function that serialises an entity to a JSON segment document.
+EntitySerializer = Callable[[Entity], str]
+
+#: Entity attributes that are never included in the segment document, for
+#: each `to_dict()` implementation that we know how to reproduce.
+_EXCLUDED_KEYS = {
+    Entity.to_dict: frozenset(["sampled", ORIGIN_TRACE_HEADER_ATTR_KEY]),
+    Segment.to_dict: frozenset(
+        ["sampled", ORIGIN_TRACE_HEADER_ATTR_KEY, "ref_counter", "_subsegments_counter"]
+    ),
+    Subsegment.to_dict: frozenset(
+        ["sampled", ORIGIN_TRACE_HEADER_ATTR_KEY, "parent_segment"]
+    ),
+}
+
+
+def _make_encoder(c_make_encoder: Optional[Callable]) -> Callable:
+    """Make a JSON encoder with the same output as `json.dumps(..., default=str)`.
+
+    Unlike `json.dumps()`, the encoder doesn't check for circular references.
+    It uses the C encoder from the `json` module if it's available, rather
+    than a `JSONEncoder` (which decides whether it can use the C encoder on
+    every call). Otherwise (eg. on PyPy), it falls back to a `JSONEncoder`.
+
+    Params:
+        c_make_encoder: The `json` module's factory for C encoders, or
+            `None` if it isn't available.
+
+    Returns:
+        Function that takes the object to encode and `0`, and returns an
+        iterable of the chunks of the JSON document.
+    """
+    if c_make_encoder is None:
+        return JSONEncoder(default=str, check_circular=False).iterencode
+
+    return c_make_encoder(
+        None,  # markers
+        str,  # default
+        encode_basestring_ascii,
+        None,  # indent
+        ": ",  # key_separator
+        ", ",  # item_separator
+        False,  # sort_keys
+        False,  # skipkeys
+        True,  # allow_nan
+    )
+
+
+#: Shared JSON encoder for segment documents. It keeps no state between
+#: calls, so it is created once and shared between threads. The C encoder
+#: factory isn't part of the public API of the `json` module, so it may not
+#: exist at all.
+_encode = _make_encoder(getattr(json.encoder, "c_make_encoder", None))
+
+
+def serialize_entity(entity: Entity) -> str:
+    """Serialise a segment or subsegment to a JSON segment document.
+
+    The output is identical to `entity.serialize()`, but it is cheaper for
+    an entity with lots of subsegments. The entity tree is walked once, with
+    a single dict comprehension for each entity that skips the attributes
+    with empty values. The values themselves are not copied. The whole tree
+    is then encoded by one call to the C JSON encoder (where available),
+    which is created once rather than for each entity.
+
+    Notes:
+        Entities from a subclass that overrides `to_dict()` or `serialize()`
+        are serialised by calling those methods instead.
+
+        Unlike `entity.serialize()`, a circular reference in an attribute
+        value raises `RecursionError` rather than `ValueError`.
+    """
+    if type(entity).serialize is not Entity.serialize:
+        return entity.serialize()
+    return "".join(_encode(_to_dict(entity), 0))
+
+
+def _to_dict(entity: Entity) -> dict:
+    """Convert an entity tree to dicts, like `Entity.to_dict()`."""
+    excluded_keys = _EXCLUDED_KEYS.get(type(entity).to_dict)
+    if excluded_keys is None:
+        return entity.to_dict()
+
+    # `value is False` keeps boolean attributes, like `in_progress`
+    result = {
+        key: value
+        for key, value in vars(entity).items()
+        if (value or value is False) and key not in excluded_keys
+    }
+
+    # Replacing a value keeps the original position of the key
+    if "subsegments" in result:
+        result["subsegments"] = [_to_dict(child) for child in result["subsegments"]]
+    if "cause" in result:
+        result["cause"] = _cause_to_dict(result["cause"])
+    if "metadata" in result:
+        result["metadata"] = metadata_to_dict(result["metadata"])
+    return result
+
+
+def _cause_to_dict(cause):
+    """Convert the cause of an error to dicts, like `Entity.to_dict()`."""
+    if not isinstance(cause, dict):
+        # The ID of an exception recorded by a subsegment
+        return cause
+
+    return {
+        "working_directory": cause["working_directory"],
+        "exceptions": [
+            {
+                key: value
+                for key, value in vars(throwable).items()
+                if value or value is False
+            }
+            for throwable in cause["exceptions"]
+        ],
+    }
@@ -0,0 +1,266 @@
+"""UDP emitter that serialises and sends entities from a pool of worker threads."""
+
+import asyncio
+import logging
+import socket
+import threading
+from collections import deque
+from typing import Deque
+from typing import List
+from typing import Optional
+
+from aws_xray_sdk.core.daemon_config import DaemonConfig
+from aws_xray_sdk.core.emitters.udp_emitter import DEFAULT_DAEMON_ADDRESS
+from aws_xray_sdk.core.emitters.udp_emitter import PROTOCOL_DELIMITER
+from aws_xray_sdk.core.emitters.udp_emitter import PROTOCOL_HEADER
+
+from .serialization import EntitySerializer
+from .serialization import serialize_entity
+from .udp import DEFAULT_MAX_QUEUE_SIZE
+
+log = logging.getLogger(__name__)
+
+#: Default number of worker threads that serialise and send entities.
+DEFAULT_WORKER_COUNT: int = 2
+
+
+class ThreadPoolUDPEmitter:
+    """Emitter that serialises and sends entities in a pool of worker threads.
+
+    This is a drop-in replacement for the SDK's `UDPEmitter`. Unlike the
+    `AsyncUDPEmitter`, which serialises entities in a task on the event loop,
+    `send_entity()` just hands the entity to a worker thread. Serialising a
+    large segment then doesn't hold up the other requests and tasks on the
+    event loop (apart from sharing the GIL with the worker thread).
+
+    Each worker thread has its own bounded queue. All the entities for a
+    trace go to the same worker, so they are sent in the order they were
+    emitted. If the queue for a worker is full, then the entity is dropped.
+    The `enqueued`, `sent` and `dropped` counters record what happened to
+    each entity.
+
+    The worker threads are started when the first entity is emitted. Call
+    `close()` when the application shuts down, so that any queued entities
+    are sent and the threads stop.
+
+    Params:
+        daemon_address: Address of the X-Ray daemon, in the same format as
+            `xray_recorder.configure(daemon_address=...)`
+        workers: Number of worker threads.
+        max_queue_size: Maximum number of entities waiting to be sent, for
+            each worker thread.
+        serializer: Function that serialises an entity to a JSON segment
+            document.
+
+    Notes:
+        An entity must not be changed after it is emitted, since it is
+        serialised concurrently by a worker thread.
+    """
+
+    def __init__(
+        self,
+        daemon_address: str = DEFAULT_DAEMON_ADDRESS,
+        *,
+        workers: int = DEFAULT_WORKER_COUNT,
+        max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+        serializer: EntitySerializer = serialize_entity,
+    ):
+        if workers < 1:
+            raise ValueError("ThreadPoolUDPEmitter needs at least one worker")
+
+        self.set_daemon_address(daemon_address)
+        self._max_queue_size = max_queue_size
+        self._serializer = serializer
+        self._workers: List[_Worker] = [_Worker(self, i) for i in range(workers)]
+
+    def send_entity(self, entity):
+        """Queue a segment/subsegment to be sent to the X-Ray daemon.
+
+        This never blocks. If the queue is already full then the entity is
+        dropped.
+        """
+        worker = self._workers[_get_worker_index(entity, len(self._workers))]
+        worker.put(entity)
+
+    def set_daemon_address(self, address: Optional[str]):
+        """Set up the UDP IP and port from the raw daemon address string."""
+        if address:
+            daemon_config = DaemonConfig(address)
+            self._ip, self._port = daemon_config.udp_ip, daemon_config.udp_port
+
+    @property
+    def ip(self) -> str:
+        return self._ip
+
+    @property
+    def port(self) -> int:
+        return self._port
+
+    @property
+    def workers(self) -> int:
+        """Number of worker threads."""
+        return len(self._workers)
+
+    @property
+    def enqueued(self) -> int:
+        """Number of entities that have been accepted into a queue."""
+        return sum(worker.enqueued for worker in self._workers)
+
+    @property
+    def sent(self) -> int:
+        """Number of entities that have been sent to the daemon."""
+        return sum(worker.sent for worker in self._workers)
+
+    @property
+    def dropped(self) -> int:
+        """Number of entities that were discarded without being sent.
+
+        This includes entities rejected because a queue was full, and
+        entities that failed to serialise or send.
+        """
+        return sum(worker.dropped for worker in self._workers)
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of entities currently waiting to be sent."""
+        return sum(len(worker.queue) for worker in self._workers)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every entity that is currently queued has been sent.
+
+        Params:
+            timeout: Maximum number of seconds to wait for each worker.
+
+        Returns:
+            True if all the queues were emptied, or false if the timeout
+            expired first.
+        """
+        # Wait for every worker, even if one of them times out
+        idle = [worker.wait_until_idle(timeout) for worker in self._workers]
+        return all(idle)
+
+    async def drain(self):
+        """Send every entity that is currently queued.
+
+        This is a hook for graceful shutdown, for consistency with
+        `AsyncUDPEmitter`. It waits in the default executor, so the event
+        loop isn't blocked.
+        """
+        await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+    async def close(self):
+        """Drain the queues, then stop the worker threads and close the sockets."""
+        await self.drain()
+        await asyncio.get_running_loop().run_in_executor(None, self.shutdown)
+
+    def shutdown(self):
+        """Stop the worker threads once their queues are empty.
+
+        This blocks, so it is suitable for use outside an event loop (eg. in
+        an `atexit` handler). The emitter starts new worker threads if more
+        entities are emitted afterwards.
+        """
+        for worker in self._workers:
+            worker.stop()
+
+    def _send(self, sock: socket.socket, entity):
+        """Serialise an entity and send it to the daemon."""
+        message = PROTOCOL_HEADER + PROTOCOL_DELIMITER + self._serializer(entity)
+        sock.sendto(message.encode("utf-8"), (self._ip, self._port))
+
+
+def _get_worker_index(entity, worker_count: int) -> int:
+    """Choose the worker for an entity, so that a trace always uses the same one."""
+    if worker_count == 1:
+        return 0
+    return hash(getattr(entity, "trace_id", None)) % worker_count
+
+
+class _Worker:
+    """A worker thread, and the queue of entities that it sends."""
+
+    def __init__(self, emitter: ThreadPoolUDPEmitter, index: int):
+        self.emitter = emitter
+        self.index = index
+
+        self.queue: Deque = deque()
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self.stopping = False
+        self.busy = False
+
+        # Only updated while holding the condition's lock
+        self.enqueued = 0
+        self.sent = 0
+        self.dropped = 0
+
+    def put(self, entity):
+        """Add an entity to the queue, and start the thread if necessary."""
+        with self.condition:
+            if len(self.queue) >= self.emitter._max_queue_size:
+                self.dropped += 1
+                log.debug("X-Ray emitter queue is full. Dropped entity %s", entity.id)
+                return
+
+            self.queue.append(entity)
+            self.enqueued += 1
+            if self.thread is None:
+                self._start()
+            self.condition.notify_all()
+
+    def wait_until_idle(self, timeout: Optional[float]) -> bool:
+        """Wait until the queue is empty and nothing is being sent."""
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: not self.queue and not self.busy, timeout
+            )
+
+    def stop(self):
+        """Stop the thread once the queue is empty, and wait for it to finish."""
+        with self.condition:
+            thread = self.thread
+            if thread is None:
+                return
+            self.stopping = True
+            self.condition.notify_all()
+
+        thread.join()
+
+    def _start(self):
+        """Start the worker thread. The caller must hold the lock."""
+        self.stopping = False
+        self.thread = threading.Thread(
+            target=self._run, name=f"xraysink-emitter-{self.index}", daemon=True
+        )
+        self.thread.start()
+
+    def _run(self):
+        """Send entities from the queue until the worker is stopped."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            while True:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+                    self.condition.wait_for(lambda: self.queue or self.stopping)
+                    if not self.queue:
+                        self.thread = None
+                        return
+                    entity = self.queue.popleft()
+                    self.busy = True
+
+                try:
+                    self.emitter._send(sock, entity)
+                except Exception:
+                    log.exception("Failed to send entity to X-Ray daemon.")
+                    sent = False
+                else:
+                    sent = True
+
+                with self.condition:
+                    if sent:
+                        self.sent += 1
+                    else:
+                        self.dropped += 1
+        finally:
+            sock.close()
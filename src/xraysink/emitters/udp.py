@@ -0,0 +1,300 @@
+"""Non-blocking UDP emitter for asyncio applications."""
+
+import asyncio
+import logging
+from collections import deque
+from contextlib import suppress
+from typing import Deque
+from typing import Optional
+
+from aws_xray_sdk.core.daemon_config import DaemonConfig
+from aws_xray_sdk.core.emitters.udp_emitter import DEFAULT_DAEMON_ADDRESS
+from aws_xray_sdk.core.emitters.udp_emitter import PROTOCOL_DELIMITER
+from aws_xray_sdk.core.emitters.udp_emitter import PROTOCOL_HEADER
+
+from .serialization import EntitySerializer
+from .serialization import serialize_entity
+
+log = logging.getLogger(__name__)
+
+#: Default maximum number of entities waiting to be sent to the daemon.
+DEFAULT_MAX_QUEUE_SIZE: int = 1000
+
+#: Number of entities sent in one go before yielding back to the event loop.
+_FLUSH_BATCH_SIZE: int = 50
+
+
+class _DaemonProtocol(asyncio.DatagramProtocol):
+    """Datagram protocol for the (write-only) connection to the daemon."""
+
+    def error_received(self, exc):
+        log.warning("Error sending entity to X-Ray daemon: %s", exc)
+
+
+class AsyncUDPEmitter:
+    """Emitter that sends entities to the X-Ray daemon from a background task.
+
+    This is a drop-in replacement for the SDK's `UDPEmitter`. However, rather
+    than serialising and sending each entity inline (ie. on the request path,
+    when the segment is ended), `send_entity()` just puts the entity in a
+    bounded queue. A background coroutine running on the event loop then
+    serialises the queued entities and sends them over an asyncio datagram
+    transport.
+
+    If the queue is full, then the entity is dropped. The `enqueued`, `sent`
+    and `dropped` counters record what happened to each entity.
+
+    The background coroutine is started on the running event loop when the
+    first entity is emitted. Call `close()` when the application shuts down,
+    so that any queued entities are sent before the loop stops. If the loop
+    is closed anyway (eg. by each `asyncio.run()`), or the emitter is used
+    from another running loop, then it starts again on that loop.
+
+    Params:
+        daemon_address: Address of the X-Ray daemon, in the same format as
+            `xray_recorder.configure(daemon_address=...)`
+        max_queue_size: Maximum number of entities waiting to be sent.
+        serializer: Function that serialises an entity to a JSON segment
+            document. Defaults to `serialize_entity()`, which produces the
+            same output as `entity.serialize()` but much faster.
+    """
+
+    def __init__(
+        self,
+        daemon_address: str = DEFAULT_DAEMON_ADDRESS,
+        *,
+        max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+        serializer: EntitySerializer = serialize_entity,
+    ):
+        self._max_queue_size = max_queue_size
+        self._serializer = serializer
+
+        self._queue: Deque = deque()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        self.set_daemon_address(daemon_address)
+
+        self._enqueued = 0
+        self._sent = 0
+        self._dropped = 0
+
+    def send_entity(self, entity):
+        """Queue a segment/subsegment to be sent to the X-Ray daemon.
+
+        This never blocks. If the queue is already full then the entity is
+        dropped.
+        """
+        if len(self._queue) >= self._max_queue_size:
+            self._dropped += 1
+            log.debug("X-Ray emitter queue is full. Dropped entity %s", entity.id)
+            return
+
+        self._queue.append(entity)
+        self._enqueued += 1
+        self._notify_flusher()
+
+    def set_daemon_address(self, address: Optional[str]):
+        """Set up the UDP IP and port from the raw daemon address string.
+
+        If the connection to the daemon is already open, then it is closed,
+        and the next entities are sent over a new connection to the new
+        address.
+        """
+        if address:
+            daemon_config = DaemonConfig(address)
+            self._ip, self._port = daemon_config.udp_ip, daemon_config.udp_port
+
+            transport, self._transport = self._transport, None
+            if transport is not None:
+                self._close_transport(transport)
+
+    @property
+    def ip(self) -> str:
+        return self._ip
+
+    @property
+    def port(self) -> int:
+        return self._port
+
+    @property
+    def enqueued(self) -> int:
+        """Number of entities that have been accepted into the queue."""
+        return self._enqueued
+
+    @property
+    def sent(self) -> int:
+        """Number of entities that have been sent to the daemon."""
+        return self._sent
+
+    @property
+    def dropped(self) -> int:
+        """Number of entities that were discarded without being sent.
+
+        This includes entities rejected because the queue was full, and
+        entities that failed to serialise or send.
+        """
+        return self._dropped
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of entities currently waiting to be sent."""
+        return len(self._queue)
+
+    async def drain(self):
+        """Send every entity that is currently queued.
+
+        This is a hook for graceful shutdown. It doesn't stop the emitter,
+        so entities that are emitted afterwards are still sent.
+        """
+        if not self._queue:
+            return
+
+        self._ensure_started(asyncio.get_running_loop())
+        while self._queue:
+            await self._open_transport()
+            self._flush_batch()
+            await asyncio.sleep(0)
+
+    async def close(self):
+        """Drain the queue, then stop the background task and close the socket."""
+        if self._loop not in (None, asyncio.get_running_loop()):
+            self._stop_on_loop(self._loop)
+        await self.drain()
+
+        if self._flusher is not None:
+            self._flusher.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._flusher
+            self._flusher = None
+
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+        self._loop = None
+        self._wakeup = None
+        self._connect_lock = None
+
+    def _notify_flusher(self):
+        """Wake up the background task to send the queued entities."""
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is not None:
+            self._ensure_started(running_loop)
+            self._wakeup.set()
+            return
+
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            # No usable event loop. The queued entities will be sent when
+            # the emitter is next used from inside an event loop.
+            return
+
+        # Entity was emitted from another thread. The loop may be closed in
+        # the meantime, in which case the entity waits for the next loop.
+        with suppress(RuntimeError):
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _ensure_started(self, loop: asyncio.AbstractEventLoop):
+        """Start the background task on the given event loop, if necessary.
+
+        If it was started on another event loop (which has probably been
+        closed), then that task and its transport are abandoned.
+        """
+        if self._loop is loop:
+            return
+        if self._loop is not None:
+            self._stop_on_loop(self._loop)
+
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._connect_lock = asyncio.Lock()
+        self._flusher = loop.create_task(self._flush_forever())
+
+    def _stop_on_loop(self, loop: asyncio.AbstractEventLoop):
+        """Stop the background task on a loop that is no longer used."""
+        flusher, transport = self._flusher, self._transport
+        self._loop = None
+        self._wakeup = None
+        self._connect_lock = None
+        self._flusher = None
+        self._transport = None
+
+        if not loop.is_closed():
+            with suppress(RuntimeError):
+                loop.call_soon_threadsafe(flusher.cancel)
+        if transport is not None:
+            self._close_transport(transport, loop)
+
+    def _close_transport(
+        self,
+        transport: asyncio.DatagramTransport,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+    ):
+        """Close a transport that is no longer used, from any thread."""
+        if loop is None:
+            loop = self._loop
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        # If the loop is closed, then the transport can't be closed cleanly.
+        # Its socket is closed when it's garbage collected.
+        with suppress(RuntimeError):
+            if running_loop is loop:
+                transport.close()
+            else:
+                loop.call_soon_threadsafe(transport.close)
+
+    async def _open_transport(self):
+        """Open the datagram transport to the daemon, if necessary."""
+        async with self._connect_lock:
+            if self._transport is None:
+                self._transport, _ = await self._loop.create_datagram_endpoint(
+                    _DaemonProtocol, remote_addr=(self._ip, self._port)
+                )
+
+    async def _flush_forever(self):
+        """Background task that sends queued entities until cancelled."""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            while self._queue:
+                # The transport is closed if the daemon address changes, so
+                # it may need to be reopened before each batch
+                try:
+                    await self._open_transport()
+                except Exception:
+                    log.exception("Failed to open connection to X-Ray daemon.")
+                    self._dropped += len(self._queue)
+                    self._queue.clear()
+                    break
+
+                self._flush_batch()
+
+                # Give other tasks a chance to run between batches
+                await asyncio.sleep(0)
+
+    def _flush_batch(self):
+        """Send a limited number of entities from the front of the queue."""
+        transport = self._transport
+        for _ in range(min(_FLUSH_BATCH_SIZE, len(self._queue))):
+            entity = self._queue.popleft()
+            try:
+                message = (
+                    PROTOCOL_HEADER + PROTOCOL_DELIMITER + self._serializer(entity)
+                )
+                transport.sendto(message.encode("utf-8"))
+            except Exception:
+                log.exception("Failed to send entity to X-Ray daemon.")
+                self._dropped += 1
+            else:
+                self._sent += 1
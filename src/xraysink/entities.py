@@ -0,0 +1,69 @@
+"""Lightweight X-Ray trace entities."""
+
+from typing import Optional
+
+from aws_xray_sdk.core.models.dummy_entities import DummySegment
+from aws_xray_sdk.core.models.traceid import TraceId
+
+#: Entity ID used for entities that are never sent to X-Ray.
+NOOP_ENTITY_ID: str = "0000000000000000"
+
+#: Sampling decision of a segment whose trace hasn't been decided yet. This is
+#: what the X-Ray trace header uses for an undecided trace.
+UNDECIDED: str = "?"
+
+
+class UnsampledSegment(DummySegment):
+    """Placeholder for a segment that will not be sampled.
+
+    Like the SDK's `DummySegment`, all the data recorded in this segment is
+    discarded. However, this is much cheaper to create, because it only holds
+    the minimum needed to propagate the trace downstream:
+
+    * The trace ID (either from the incoming request, or a new one). Unlike
+      `DummySegment`, this is a real trace ID, so that downstream services
+      and the response header refer to the same trace.
+    * The sampling decision (ie. not sampled)
+    * A count of open subsegments, so the recorder knows when the segment
+      is finished. Subsegments are not retained.
+
+    Notes:
+        The parent constructor is deliberately not called, since it
+        allocates a lot of per-entity state that we don't need.
+    """
+
+    # Default values for the entity attributes that are never changed
+    id = NOOP_ENTITY_ID
+    parent_id = None
+    user = None
+    subsegments = ()
+
+    def __init__(self, name: str, traceid: Optional[str] = None):
+        self.name = name
+        self.trace_id = traceid or TraceId().to_id()
+        self.sampled = False
+        self.in_progress = True
+        self._open_subsegments = 0
+
+    def add_subsegment(self, subsegment):
+        self._check_ended()
+        subsegment.parent_id = self.id
+        self._open_subsegments += 1
+
+    def remove_subsegment(self, subsegment):
+        pass
+
+    def increment(self):
+        self._open_subsegments += 1
+
+    def decrement_ref_counter(self):
+        self._open_subsegments -= 1
+
+    def ready_to_send(self):
+        return self._open_subsegments <= 0 and not self.in_progress
+
+    def get_total_subsegments_size(self):
+        return 0
+
+    def decrement_subsegments_size(self):
+        pass
@@ -0,0 +1,364 @@
+"""Propagate the X-Ray trace context into thread and process pool executors."""
+
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from aws_xray_sdk.core import xray_recorder
+from aws_xray_sdk.core.models.segment import Segment
+from aws_xray_sdk.core.models.subsegment import Subsegment
+
+from .context import ContextVarAsyncContext
+from .util import get_trace_entities
+from .util import has_current_trace
+from .util import set_trace_entities
+
+
+class XRayThreadPoolExecutor(ThreadPoolExecutor):
+    """Thread pool executor that propagates the current trace to its workers.
+
+    Each submitted function is executed in a subsegment of the entity that was
+    current when it was submitted (eg. the request's segment), rather than
+    failing with `context_missing` errors. So calls made from the worker thread
+    (eg. boto3 calls) are traced as usual. The worker thread's own trace
+    entities are restored afterwards. If there isn't a current trace, then
+    the function is executed as normal.
+
+    Use this with `loop.run_in_executor()`, or install it as the default
+    executor so that `loop.run_in_executor(None, ...)` and
+    `asyncio.to_thread()` propagate the trace too:
+
+        loop.set_default_executor(XRayThreadPoolExecutor())
+
+    This needs a recorder context that can store trace entities in a thread,
+    such as the xraysink `AsyncContext` or `ContextVarAsyncContext` (not the
+    `AsyncContext` from aws_xray_sdk).
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        if not isinstance(fn, _TracedCall):
+            fn = _TracedCall.from_call(functools.partial(fn, *args, **kwargs))
+            args = ()
+            kwargs = {}
+        return super().submit(fn, *args, **kwargs)
+
+
+async def to_thread(func, *args, **kwargs):
+    """Execute a function in a thread, in a subsegment of the current trace.
+
+    This is like `asyncio.to_thread()` (which is only available in Python
+    3.9+), and uses the event loop's default executor. The current trace is
+    propagated to the thread in the same way as for `XRayThreadPoolExecutor`.
+    """
+    loop = asyncio.get_running_loop()
+    call = _TracedCall(
+        functools.partial(func, *args, **kwargs), contextvars.copy_context()
+    )
+    return await loop.run_in_executor(None, call)
+
+
+class XRayProcessPoolExecutor(ProcessPoolExecutor):
+    """Process pool executor that records the work of its workers in the trace.
+
+    Each submitted function is executed in a subsegment of the entity that was
+    current when it was submitted, in the same way as for
+    `XRayThreadPoolExecutor`. The trace ID and the subsegment's ID are sent to
+    the worker process, which records any subsegments created by the function
+    (eg. by the X-Ray SDK's patched libraries, or `xray_recorder.capture()`)
+    in memory, rather than sending them to the X-Ray daemon. They are
+    returned as plain dictionaries along with the function's result (or
+    exception), and grafted onto the subsegment in this process.
+
+    So the worker processes don't need their own connection to the X-Ray
+    daemon, and the trace shows where the time was spent in each worker.
+
+    The worker processes use the X-Ray SDK's global `xray_recorder`, which is
+    reconfigured to use an xraysink `ContextVarAsyncContext` and to keep the
+    entities in memory.
+
+    If there isn't a current trace, or it isn't sampled, then the function is
+    executed as normal.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        if not has_current_trace():
+            return super().submit(fn, *args, **kwargs)
+        parent = xray_recorder.get_trace_entity()
+        if not parent.sampled:
+            return super().submit(fn, *args, **kwargs)
+
+        segment = parent if isinstance(parent, Segment) else parent.parent_segment
+        subsegment = Subsegment(_get_name(fn), "local", segment)
+        parent.add_subsegment(subsegment)
+
+        try:
+            worker_future = super().submit(
+                _execute_in_process,
+                fn,
+                args,
+                kwargs,
+                subsegment.trace_id,
+                subsegment.id,
+            )
+        except BaseException:
+            _end_subsegment(subsegment)
+            raise
+
+        future = Future()
+        future.add_done_callback(functools.partial(_cancel_worker, worker_future))
+        worker_future.add_done_callback(
+            functools.partial(
+                _graft_worker_result, future, subsegment, _get_running_loop()
+            )
+        )
+        return future
+
+
+class _TracedCall:
+    """Function call that is executed with the trace entities of its caller.
+
+    The entities are captured when this is created, so it must be created in
+    the thread (or task) that submitted the call.
+
+    Params:
+        func: The function call to execute.
+        context: The `contextvars` context to execute the call in, if any.
+    """
+
+    __slots__ = ("_func", "_context", "_entities", "_name")
+
+    def __init__(
+        self, func: functools.partial, context: Optional[contextvars.Context] = None
+    ):
+        self._func = func
+        self._context = context
+        self._name = _get_name(func.func)
+        self._entities = get_trace_entities()
+        if isinstance(self._entities, list):
+            # The aws_xray_sdk contexts use a mutable list, which mustn't be
+            # shared between threads. The xraysink stacks are immutable.
+            self._entities = list(self._entities)
+
+    @classmethod
+    def from_call(cls, func: functools.partial) -> "_TracedCall":
+        """Create a traced call, unwrapping a call to `Context.run()`.
+
+        `asyncio.to_thread()` submits `partial(context.run, func, ...)` to the
+        executor. The trace entities must be set inside that context (they
+        may be stored in a context variable), so we run the context ourselves.
+        """
+        context = getattr(func.func, "__self__", None)
+        if isinstance(context, contextvars.Context) and func.args:
+            inner = functools.partial(*func.args, **func.keywords)
+            return cls(inner, context)
+        return cls(func)
+
+    def __call__(self):
+        if self._context is None:
+            return self._call()
+        return self._context.run(self._call)
+
+    def _call(self):
+        if not self._entities:
+            return self._func()
+
+        saved_entities = get_trace_entities()
+        set_trace_entities(self._entities)
+        try:
+            with xray_recorder.in_subsegment(self._name, namespace="local"):
+                return self._func()
+        finally:
+            set_trace_entities(saved_entities)
+
+
+def _get_name(func) -> str:
+    """Get a subsegment name for a function."""
+    while isinstance(func, functools.partial):
+        func = func.func
+    return getattr(func, "__qualname__", None) or type(func).__name__
+
+
+#: Attribute of an exception raised in a worker process, which holds the
+#: documents that were recorded before it was raised.
+_DOCUMENTS_ATTR = "_xraysink_documents"
+
+
+class _CollectingEmitter:
+    """Emitter that keeps the entities in memory, for a worker process."""
+
+    def __init__(self):
+        self._documents: List[Dict[str, Any]] = []
+
+    def send_entity(self, entity):
+        self._documents.append(entity.to_dict())
+
+    def set_daemon_address(self, address):
+        pass
+
+    def pop_all(self) -> List[Dict[str, Any]]:
+        documents = self._documents
+        self._documents = []
+        return documents
+
+
+def _get_process_emitter() -> _CollectingEmitter:
+    """Configure the recorder in a worker process, if it isn't already."""
+    emitter = xray_recorder.emitter
+    if not isinstance(emitter, _CollectingEmitter):
+        # A forked worker process inherits the recorder of its parent, whose
+        # context may be tied to an event loop (and the emitter to a socket)
+        emitter = _CollectingEmitter()
+        xray_recorder.context = ContextVarAsyncContext()
+        xray_recorder.emitter = emitter
+    return emitter
+
+
+def _execute_in_process(func, args, kwargs, trace_id: str, parent_id: str):
+    """Execute a function in a worker process, and record its subsegments.
+
+    Returns:
+        Tuple of the function's result, and the documents for the
+        subsegments that were recorded. If the function raises an exception,
+        then the documents are attached to the exception instead.
+    """
+    emitter = _get_process_emitter()
+
+    # The root segment is never sent. It stands in for the subsegment in the
+    # parent process, so it has the same ID (which is used as the parent ID
+    # for any subsegments that are streamed).
+    root = Segment(_get_name(func), entityid=parent_id, traceid=trace_id)
+    xray_recorder.context.put_segment(root)
+    try:
+        result = func(*args, **kwargs)
+    except Exception as exc:
+        setattr(exc, _DOCUMENTS_ATTR, _pop_documents(root, emitter))
+        raise
+    finally:
+        xray_recorder.context.clear_trace_entities()
+
+    return result, _pop_documents(root, emitter)
+
+
+def _pop_documents(root: Segment, emitter: _CollectingEmitter) -> List[dict]:
+    """Get the documents for everything recorded under the root segment."""
+    documents = emitter.pop_all()
+    documents.extend(subsegment.to_dict() for subsegment in root.subsegments)
+    return documents
+
+
+def _cancel_worker(worker_future: Future, future: Future):
+    if future.cancelled():
+        worker_future.cancel()
+
+
+def _graft_worker_result(
+    future: Future,
+    subsegment: Subsegment,
+    loop: Optional[asyncio.AbstractEventLoop],
+    worker_future: Future,
+):
+    """Graft the documents from a worker process, and resolve the future.
+
+    This is called in the executor's management thread. The segment is ended
+    (and sent, if it's ready) by the event loop's thread, so the subsegment is
+    ended in that thread too. Otherwise both threads could see that the
+    segment is ready to send, and send it twice.
+    """
+    if worker_future.cancelled():
+        _call_in_loop(loop, _end_subsegment, subsegment)
+        future.cancel()
+        return
+
+    exception = worker_future.exception()
+    if exception is None:
+        result, documents = worker_future.result()
+    else:
+        documents = getattr(exception, _DOCUMENTS_ATTR, ())
+        if documents:
+            delattr(exception, _DOCUMENTS_ATTR)
+
+    _call_in_loop(loop, _end_worker_subsegment, subsegment, documents, exception)
+
+    # Resolve the future after the subsegment has ended (or has been scheduled
+    # to end, before any callbacks that wake up the caller), so that the
+    # caller can't end the segment first
+    if future.cancelled():
+        return
+    if exception is None:
+        future.set_result(result)
+    else:
+        future.set_exception(exception)
+
+
+def _get_running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _call_in_loop(loop: Optional[asyncio.AbstractEventLoop], callback, *args):
+    """Call a function in the event loop's thread, or now if there isn't one."""
+    if loop is not None:
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+            return
+        except RuntimeError:
+            # The loop is closed, so it can't be ending the segment
+            pass
+    callback(*args)
+
+
+def _end_worker_subsegment(
+    subsegment: Subsegment, documents: List[dict], exception: Optional[BaseException]
+):
+    """Record the result of a worker process, and end its subsegment."""
+    if exception is not None:
+        subsegment.add_exception(exception, stack=[])
+    _graft_documents(subsegment, documents)
+    _end_subsegment(subsegment)
+
+
+def _graft_documents(subsegment: Subsegment, documents: List[dict]):
+    """Add the documents recorded by a worker process to the trace."""
+    segment = subsegment.parent_segment
+    for document in documents:
+        grafted = _GraftedSubsegment(document, segment)
+        if document.get("parent_id") == subsegment.id:
+            subsegment.add_subsegment(grafted)
+            segment.decrement_ref_counter()
+        else:
+            # A subsegment that was streamed out of a deeper subsegment
+            xray_recorder.emitter.send_entity(grafted)
+
+
+def _end_subsegment(subsegment: Subsegment):
+    """End a subsegment that isn't on the stack of trace entities."""
+    subsegment.close()
+
+    # If the segment has already ended, then it was waiting for this
+    segment = subsegment.parent_segment
+    if segment.ready_to_send():
+        xray_recorder.emitter.send_entity(segment)
+
+
+class _GraftedSubsegment(Subsegment):
+    """Completed subsegment that was recorded by another process."""
+
+    def __init__(self, document: Dict[str, Any], segment: Segment):
+        super().__init__(document["name"], document.get("namespace", "local"), segment)
+        self.id = document["id"]
+        self.start_time = document["start_time"]
+        self.end_time = document.get("end_time")
+        self.in_progress = False
+        self._document = document
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self._document
@@ -0,0 +1 @@
+"""Samplers that make faster sampling decisions than the SDK's samplers."""
@@ -0,0 +1,269 @@
+"""Sampler that samples fewer traces while the process is under pressure."""
+
+import asyncio
+import random
+import threading
+import time
+import weakref
+from typing import Optional
+
+#: Default number of seconds between adjustments of the sampled fraction.
+DEFAULT_ADJUST_INTERVAL: float = 1.0
+
+#: Default event loop lag (in seconds) above which the sampler backs off.
+DEFAULT_MAX_LOOP_LAG: float = 0.05
+
+#: Default emitter queue depth above which the sampler backs off. This is half
+#: of the emitters' default maximum queue size.
+DEFAULT_MAX_QUEUE_DEPTH: int = 500
+
+#: Default factor that the sampled fraction is multiplied by under pressure.
+DEFAULT_BACKOFF_FACTOR: float = 0.5
+
+#: Default amount that the sampled fraction recovers by, each interval without
+#: pressure.
+DEFAULT_RECOVERY_STEP: float = 0.1
+
+#: Default lowest sampled fraction that the sampler backs off to.
+DEFAULT_MIN_FRACTION: float = 0.01
+
+#: Number of seconds between probes of the event loop lag.
+_LAG_PROBE_INTERVAL: float = 0.1
+
+
+class _LoopLagMonitor:
+    """Measures how late the event loop runs a callback that is due regularly.
+
+    The probe is a chain of `call_at()` callbacks rather than a task, so it
+    doesn't need to be cancelled when the loop is closed. The callbacks only
+    refer to the monitor weakly, so the chain stops once the sampler that
+    owns the monitor is gone (or the monitor is stopped).
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.max_lag = 0.0
+        self.stopped = False
+        self._due = loop.time() + _LAG_PROBE_INTERVAL
+        loop.call_at(self._due, _probe_loop_lag, weakref.ref(self))
+
+    def take_max_lag(self) -> float:
+        """Get the largest lag since the last call, including an overdue probe."""
+        max_lag = max(self.max_lag, self.loop.time() - self._due)
+        self.max_lag = 0.0
+        return max_lag
+
+
+def _probe_loop_lag(monitor_ref: "weakref.ref[_LoopLagMonitor]"):
+    monitor = monitor_ref()
+    if monitor is None or monitor.stopped:
+        return
+    now = monitor.loop.time()
+    monitor.max_lag = max(monitor.max_lag, now - monitor._due)
+    monitor._due = now + _LAG_PROBE_INTERVAL
+    monitor.loop.call_at(monitor._due, _probe_loop_lag, monitor_ref)
+
+
+class AdaptiveSampler:
+    """Sampler that lowers the sampled fraction while the process is overloaded.
+
+    The cost of tracing grows with the number of traced requests, so it is at
+    its highest during a spike in traffic, just when the process can least
+    afford it. This sampler wraps another sampler, and only keeps a fraction
+    of the traces that the other sampler decides to sample. Every
+    `adjust_interval` seconds, the fraction is adjusted by a simple control
+    loop:
+
+    * If the process is under pressure, the fraction is multiplied by
+      `backoff_factor` (but not below `min_fraction`). The signals for
+      pressure are the lag of the event loop (measured while the sampler is
+      used on a running loop), and the queue depth and dropped entities of
+      the emitter (if one is given).
+    * Otherwise the fraction recovers by `recovery_step`, up to 1.
+    * The fraction is also capped so that the number of traces per second
+      stays under `max_traces_per_sec`, based on the rate of requests that
+      the other sampler decided to sample in the last interval. This is the
+      budget for the cost of tracing.
+
+    So it backs off quickly, and recovers gradually once the load falls. The
+    adjustment is made during a sampling decision, so there isn't a
+    background thread.
+
+    Use it with the xraysink middleware (or the SDK's recorder) in place of
+    the sampler that it wraps:
+
+        xray_recorder.configure(
+            sampler=AdaptiveSampler(
+                LocalSampler(), emitter=emitter, max_traces_per_sec=50
+            ),
+            emitter=emitter,
+        )
+
+    Params:
+        sampler: The sampler that makes the underlying sampling decisions.
+        emitter: The recorder's emitter. If it has `queue_depth` or `dropped`
+            properties (as the xraysink emitters do), they are used as
+            signals for pressure.
+        max_traces_per_sec: Maximum number of traces per second, or None
+            for no limit.
+        max_loop_lag: Event loop lag (in seconds) above which the sampler
+            backs off.
+        max_queue_depth: Emitter queue depth above which the sampler backs
+            off.
+        min_fraction: Lowest fraction that the sampler backs off to under
+            pressure.
+        backoff_factor: Factor that the fraction is multiplied by under
+            pressure.
+        recovery_step: Amount that the fraction recovers by, each interval
+            without pressure.
+        adjust_interval: Number of seconds between adjustments.
+
+    Notes:
+        The recorder only calls `load_settings()` for a sampler whose class
+        is named `DefaultSampler`. So to wrap a `DefaultSampler`, configure
+        the recorder with it first, then replace the recorder's sampler with
+        the `AdaptiveSampler`.
+
+        A trace that is dropped by this sampler still counts as sampled by
+        the wrapped sampler (eg. for its reservoir).
+
+        The lag of the event loop is probed every 0.1 seconds, until
+        `close()` is called or the sampler is discarded.
+    """
+
+    def __init__(
+        self,
+        sampler,
+        *,
+        emitter=None,
+        max_traces_per_sec: Optional[float] = None,
+        max_loop_lag: float = DEFAULT_MAX_LOOP_LAG,
+        max_queue_depth: int = DEFAULT_MAX_QUEUE_DEPTH,
+        min_fraction: float = DEFAULT_MIN_FRACTION,
+        backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+        recovery_step: float = DEFAULT_RECOVERY_STEP,
+        adjust_interval: float = DEFAULT_ADJUST_INTERVAL,
+    ):
+        if not 0 < backoff_factor < 1:
+            raise ValueError("The backoff factor must be between 0 and 1")
+
+        self._sampler = sampler
+        self._emitter = emitter
+        self._max_traces_per_sec = max_traces_per_sec
+        self._max_loop_lag = max_loop_lag
+        self._max_queue_depth = max_queue_depth
+        self._min_fraction = min_fraction
+        self._backoff_factor = backoff_factor
+        self._recovery_step = recovery_step
+        self._adjust_interval = adjust_interval
+
+        self._fraction = 1.0
+        self._lock = threading.Lock()
+        self._monitor: Optional[_LoopLagMonitor] = None
+        self._loop_lag = 0.0
+        self._last_dropped = getattr(emitter, "dropped", 0)
+        self._interval_start = time.monotonic()
+        self._next_adjust = self._interval_start + adjust_interval
+
+        # Sampling decisions in the current interval. These are approximate
+        # if decisions are made in several threads at once.
+        self._candidates = 0
+
+    @property
+    def sampler(self):
+        """The sampler that makes the underlying sampling decisions."""
+        return self._sampler
+
+    @property
+    def fraction(self) -> float:
+        """Fraction of the wrapped sampler's sampled traces that are kept."""
+        return self._fraction
+
+    @property
+    def loop_lag(self) -> float:
+        """Largest event loop lag (in seconds) in the last interval."""
+        return self._loop_lag
+
+    def should_trace(self, sampling_req=None):
+        """Decide whether to sample a request.
+
+        Returns:
+            The wrapped sampler's decision if the trace is kept, or false.
+        """
+        now = time.monotonic()
+        if now >= self._next_adjust and self._lock.acquire(blocking=False):
+            try:
+                self._adjust(now)
+            finally:
+                self._lock.release()
+
+        decision = self._sampler.should_trace(sampling_req)
+        if not decision:
+            return False
+
+        self._candidates += 1
+        if self._fraction < 1.0 and random.random() >= self._fraction:
+            return False
+        return decision
+
+    def load_local_rules(self, rules):
+        self._sampler.load_local_rules(rules)
+
+    def load_settings(self, daemon_config, context, origin=None):
+        self._sampler.load_settings(daemon_config, context, origin)
+
+    def start(self):
+        self._sampler.start()
+
+    def close(self):
+        """Stop monitoring the lag of the event loop."""
+        monitor = self._monitor
+        if monitor is not None:
+            monitor.stopped = True
+            self._monitor = None
+
+    def _adjust(self, now: float):
+        """Adjust the sampled fraction, at the end of an interval."""
+        self._loop_lag = self._take_loop_lag()
+        emitter = self._emitter
+        dropped = getattr(emitter, "dropped", 0)
+        under_pressure = (
+            self._loop_lag > self._max_loop_lag
+            or getattr(emitter, "queue_depth", 0) > self._max_queue_depth
+            or dropped > self._last_dropped
+        )
+        self._last_dropped = dropped
+
+        if under_pressure:
+            fraction = max(self._min_fraction, self._fraction * self._backoff_factor)
+        else:
+            fraction = min(1.0, self._fraction + self._recovery_step)
+
+        if self._max_traces_per_sec is not None and self._candidates:
+            elapsed = now - self._interval_start
+            candidate_rate = self._candidates / elapsed
+            fraction = min(fraction, self._max_traces_per_sec / candidate_rate)
+
+        self._fraction = fraction
+        self._candidates = 0
+        self._interval_start = now
+        self._next_adjust = now + self._adjust_interval
+
+    def _take_loop_lag(self) -> float:
+        """Get the largest event loop lag since the last adjustment.
+
+        This starts monitoring the running event loop (if there is one), so
+        the lag is only known from the second interval on that loop.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return 0.0
+
+        monitor = self._monitor
+        if monitor is None or monitor.loop is not loop:
+            if monitor is not None:
+                monitor.stopped = True
+            self._monitor = _LoopLagMonitor(loop)
+            return 0.0
+        return monitor.take_max_lag()
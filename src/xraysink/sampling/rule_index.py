@@ -0,0 +1,212 @@
+"""Sampler that matches centralized sampling rules with a compiled index."""
+
+from functools import lru_cache
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+from aws_xray_sdk.core.sampling.rule_cache import RuleCache
+from aws_xray_sdk.core.sampling.rule_poller import RulePoller
+from aws_xray_sdk.core.sampling.sampler import DefaultSampler
+from aws_xray_sdk.core.sampling.sampling_rule import SamplingRule
+from aws_xray_sdk.core.sampling.target_poller import TargetPoller
+
+#: Default number of distinct requests that we remember the matched rule for.
+DEFAULT_DECISION_CACHE_SIZE: int = 4096
+
+#: Characters that have a special meaning in a sampling rule pattern.
+_WILDCARD_CHARS = ("*", "?")
+
+
+class _TrieNode:
+    """Node in a prefix trie of the literal prefixes of the path patterns."""
+
+    __slots__ = ("children", "rule_positions")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.rule_positions: List[int] = []
+
+
+class _RuleIndex:
+    """Compiled index over an ordered list of sampling rules.
+
+    A request can only match a rule if the request path starts with the
+    literal (ie. non-wildcard) prefix of the rule's path pattern. So the
+    path patterns are compiled into a trie of their literal prefixes, and
+    walking the request path through the trie finds the small number of
+    candidate rules to be fully matched. This means the cost of finding a
+    rule depends on the length of the path, rather than the number of rules.
+
+    The matched rule for each distinct request is also cached. The index
+    (and it's cache) is immutable, so it is simply replaced when the rules
+    change.
+
+    Params:
+        rules: The sampling rules, in order of priority.
+        cache_size: Maximum number of requests to cache the matched rule for.
+    """
+
+    def __init__(self, rules: List[SamplingRule], cache_size: int):
+        self._rules = list(rules)
+        self._default_position: Optional[int] = None
+        self._root = _TrieNode()
+
+        # Rules that could match any path
+        self._unconditional_positions: List[int] = []
+
+        for position, rule in enumerate(self._rules):
+            if self._default_position is None and rule.is_default():
+                self._default_position = position
+
+            # noinspection PyProtectedMember
+            pattern = rule._path
+            if pattern is None:
+                # Never matches a request with a path, so this rule is only
+                # a candidate for requests without a path.
+                continue
+
+            prefix = _get_literal_prefix(pattern).lower()
+            if not prefix:
+                self._unconditional_positions.append(position)
+                continue
+
+            node = self._root
+            for char in prefix:
+                node = node.children.setdefault(char, _TrieNode())
+            node.rule_positions.append(position)
+
+        self.find_rule = lru_cache(maxsize=cache_size)(self._find_rule)
+
+    def _find_rule(
+        self,
+        host: Optional[str],
+        method: Optional[str],
+        path: Optional[str],
+        service: Optional[str],
+        service_type: Optional[str],
+    ) -> Optional[SamplingRule]:
+        """Find the first rule that matches the request, else the default rule.
+
+        This gives the same result as `RuleCache.get_matched_rule`.
+        """
+        sampling_req = {
+            "host": host,
+            "method": method,
+            "path": path,
+            "service": service,
+            "service_type": service_type,
+        }
+
+        for position in self._get_candidate_positions(path):
+            if self._default_position is not None and position > self._default_position:
+                break
+            rule = self._rules[position]
+            if rule.match(sampling_req):
+                return rule
+
+        if self._default_position is None:
+            return None
+        return self._rules[self._default_position]
+
+    def _get_candidate_positions(self, path: Optional[str]) -> Iterable[int]:
+        """Get the position of each rule that could match the path, in order."""
+        if not path:
+            # Every rule matches a missing path
+            return range(len(self._rules))
+
+        candidates = list(self._unconditional_positions)
+        node = self._root
+        for char in path.lower():
+            node = node.children.get(char)
+            if node is None:
+                break
+            candidates.extend(node.rule_positions)
+
+        candidates.sort()
+        return candidates
+
+
+def _get_literal_prefix(pattern: str) -> str:
+    """Get the part of a wildcard pattern before the first wildcard."""
+    end = len(pattern)
+    for char in _WILDCARD_CHARS:
+        index = pattern.find(char)
+        if index != -1:
+            end = min(end, index)
+    return pattern[:end]
+
+
+class IndexedRuleCache(RuleCache):
+    """Cache of centralized sampling rules, that matches rules using an index.
+
+    This is a drop-in replacement for the SDK's `RuleCache`. Finding the
+    matched rule for a request takes roughly constant time, no matter how
+    many sampling rules there are. The index is rebuilt whenever the
+    sampling rules are refreshed.
+
+    Params:
+        cache_size: Maximum number of distinct requests to cache the matched
+            rule for. Note that the request path is part of the cache key,
+            so applications with many distinct paths will see less benefit
+            from this cache.
+    """
+
+    def __init__(self, cache_size: int = DEFAULT_DECISION_CACHE_SIZE):
+        self._cache_size = cache_size
+        self._index: Optional[_RuleIndex] = None
+        super().__init__()
+
+    def get_matched_rule(self, sampling_req, now):
+        if self._is_expired(now):
+            return None
+
+        index = self._index
+        if index is None:
+            index = self._index = _RuleIndex(self.rules, self._cache_size)
+
+        return index.find_rule(
+            sampling_req.get("host"),
+            sampling_req.get("method"),
+            sampling_req.get("path"),
+            sampling_req.get("service"),
+            sampling_req.get("service_type"),
+        )
+
+    def _load_rules(self, rules):
+        super()._load_rules(rules)
+
+        # The rules are sorted after they have been set, so make sure that we
+        # don't keep an index that was built in the meantime.
+        self._index = None
+
+    @property
+    def rules(self):
+        return self._rules
+
+    @rules.setter
+    def rules(self, v):
+        self._rules = v
+        self._index = None
+
+
+class IndexedSampler(DefaultSampler):
+    """Sampler for centralized sampling rules, that matches rules using an index.
+
+    This behaves exactly like the SDK's `DefaultSampler`, except that the
+    centralized sampling rules are kept in an `IndexedRuleCache`, so the
+    cost of a sampling decision doesn't grow with the number of rules.
+
+    Params:
+        cache_size: Maximum number of distinct requests to cache the matched
+            rule for.
+    """
+
+    def __init__(self, cache_size: int = DEFAULT_DECISION_CACHE_SIZE):
+        super().__init__()
+        self._cache = IndexedRuleCache(cache_size)
+        self._rule_poller = RulePoller(self._cache, self._connector)
+        self._target_poller = TargetPoller(
+            self._cache, self._rule_poller, self._connector
+        )
@@ -0,0 +1,133 @@
+"""Local sampler whose reservoirs are shared by all the processes on a host.
+
+Note that this uses `fcntl`, so it's only available on POSIX platforms.
+"""
+
+import struct
+import time
+
+from aws_xray_sdk.core.exceptions.exceptions import InvalidSamplingManifestError
+from aws_xray_sdk.core.sampling.local.sampler import LocalSampler
+from aws_xray_sdk.core.sampling.local.sampler import local_sampling_rule
+
+from ..shared_memory import SharedMemoryFile
+
+#: Maximum number of local sampling rules (including the default rule).
+MAX_RULE_COUNT: int = 512
+
+#: Counter for a reservoir, holding the current second in the high 32 bits and
+#: the number of traces taken in that second in the low 32 bits. A single
+#: 8-byte word is read and written in one go, so a reader never sees the
+#: second of one write with the count of another.
+_COUNTER = struct.Struct("Q")
+
+#: Mask for the number of traces taken, in a counter.
+_USED_MASK: int = 0xFFFFFFFF
+
+
+class SharedReservoir:
+    """Reservoir of traces per second, that is shared by processes on a host.
+
+    This is a drop-in replacement for the SDK's local `Reservoir`. The number
+    of traces taken in the current second is kept in shared memory, so the
+    limit applies to all the processes using the same counter together.
+
+    Once the limit for the current second has been reached, `take()` only
+    reads the counter, without taking the lock. So under load, almost every
+    decision costs about the same as for the SDK's reservoir.
+
+    Params:
+        counters: The shared memory for the counters.
+        slot: Index of this reservoir's counter.
+        traces_per_sec: Maximum number of traces taken each second.
+    """
+
+    __slots__ = ("_counters", "_offset", "traces_per_sec")
+
+    def __init__(self, counters: SharedMemoryFile, slot: int, traces_per_sec: int):
+        self._counters = counters
+        self._offset = slot * _COUNTER.size
+        self.traces_per_sec = traces_per_sec
+
+    @property
+    def used_this_sec(self) -> int:
+        """Number of traces taken in the current second, by every process."""
+        (counter,) = _COUNTER.unpack_from(self._counters.buf, self._offset)
+        if counter >> 32 != int(time.time()):
+            return 0
+        return counter & _USED_MASK
+
+    def take(self) -> bool:
+        """Take a trace from the reservoir, if there are any left this second."""
+        if self.traces_per_sec <= 0:
+            return False
+
+        now = int(time.time())
+        buf = self._counters.buf
+        (counter,) = _COUNTER.unpack_from(buf, self._offset)
+        if counter >> 32 == now and counter & _USED_MASK >= self.traces_per_sec:
+            return False
+
+        with self._counters:
+            # Another process may have moved on to the next second while we
+            # were waiting for the lock, so don't move the counter back
+            now = int(time.time())
+            (counter,) = _COUNTER.unpack_from(buf, self._offset)
+            used = counter & _USED_MASK if counter >> 32 == now else 0
+            if used >= self.traces_per_sec:
+                return False
+            _COUNTER.pack_into(buf, self._offset, (now << 32) | (used + 1))
+            return True
+
+
+class SharedReservoirSampler(LocalSampler):
+    """Local sampler that applies each rule's reservoir across processes.
+
+    When an application runs several worker processes (eg. under gunicorn or
+    uvicorn), the SDK's `LocalSampler` in each worker takes its own
+    `fixed_target` traces per second, so the host sends that many times more
+    traces than configured. This sampler keeps the reservoirs in shared
+    memory instead, so that each rule's `fixed_target` is the limit for all
+    the worker processes that use the same `name`. The `rate` for requests
+    beyond the reservoir is still applied by each process on its own.
+
+    Each worker creates its own sampler, with the same name and rules:
+
+        xray_recorder.configure(sampler=SharedReservoirSampler("my-app-xray"))
+
+    Rules are matched to the shared counters by their position, so every
+    worker must use the same rules. The shared memory isn't removed when the
+    workers exit, so that a restarted worker shares the same counters. Use
+    `unlink()` to remove it.
+
+    Centralized sampling rules don't need this, since the X-Ray service
+    divides the reservoir for each rule between all the instances that use
+    it.
+
+    Params:
+        name: Name of the shared memory file for the reservoirs. This should
+            be distinct for each application.
+        rules: The local sampling rules, in the same format as for the
+            SDK's `LocalSampler`.
+    """
+
+    def __init__(self, name: str, rules=local_sampling_rule):
+        self._counters = SharedMemoryFile(name, MAX_RULE_COUNT * _COUNTER.size)
+        super().__init__(rules)
+
+    def load_local_rules(self, rules):
+        super().load_local_rules(rules)
+
+        sampling_rules = [*self._rules, self._default_rule]
+        if len(sampling_rules) > MAX_RULE_COUNT:
+            raise InvalidSamplingManifestError(
+                f"A shared reservoir supports at most {MAX_RULE_COUNT} rules"
+            )
+
+        for slot, rule in enumerate(sampling_rules):
+            # noinspection PyProtectedMember
+            rule._reservoir = SharedReservoir(self._counters, slot, rule.fixed_target)
+
+    def unlink(self):
+        """Remove the shared memory file for the reservoirs."""
+        self._counters.unlink()
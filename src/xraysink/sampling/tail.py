@@ -0,0 +1,291 @@
+"""Tail-based sampling, which decides whether to keep a trace when it ends."""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from aws_xray_sdk.core.models import http
+from aws_xray_sdk.core.models.segment import Segment
+
+from ..emitters.serialization import EntitySerializer
+from ..emitters.serialization import serialize_entity
+from ..entities import UNDECIDED
+
+#: Default duration (in seconds) above which a request is always kept.
+DEFAULT_LATENCY_THRESHOLD: float = 1.0
+
+#: Default maximum number of bytes of streamed subsegments held in the buffer.
+DEFAULT_MAX_BUFFER_BYTES: int = 4 * 1024 * 1024
+
+#: Number of recently decided traces whose decisions are remembered, for the
+#: entities that are emitted after their request has ended (eg. by a task).
+MAX_DECIDED_TRACES: int = 10_000
+
+#: Metadata namespace for a kept trace whose streamed subsegments didn't fit in
+#: the buffer.
+TAIL_SAMPLING_NAMESPACE: str = "tail_sampling"
+
+
+class _BufferedDocument:
+    """Serialised subsegment, that is held until its trace is decided.
+
+    An emitter serialises this by calling `serialize()`, so it can be passed
+    to any emitter in place of the subsegment.
+    """
+
+    __slots__ = ("id", "trace_id", "document")
+
+    def __init__(self, entity_id: str, trace_id: str, document: str):
+        self.id = entity_id
+        self.trace_id = trace_id
+        self.document = document
+
+    def serialize(self) -> str:
+        return self.document
+
+
+class _PendingTrace:
+    """A trace that hasn't been decided yet, and its buffered subsegments."""
+
+    __slots__ = ("baseline", "documents", "size", "overflowed", "dropped")
+
+    def __init__(self, baseline: bool):
+        self.baseline = baseline
+        self.documents: List[_BufferedDocument] = []
+        self.size = 0
+        self.overflowed = False
+        self.dropped = 0
+
+
+class TailSampler:
+    """Emitter that only sends the traces of slow or failed requests.
+
+    With a tail sampler, the middleware records every request that doesn't
+    already have a sampling decision from upstream, then decides whether to
+    keep the trace when the request ends. A trace is kept if:
+
+    * The request failed (a 5xx response, or an exception), or was throttled.
+    * The request took longer than `latency_threshold` seconds.
+    * The recorder's sampler decided to sample the request when it started.
+      This is the baseline of ordinary requests, so the sampling rules can
+      use a much lower rate than for head sampling.
+
+    A discarded trace is simply never emitted. The trace of each request is
+    held in its segment until it ends, which only grows until the recorder
+    streams out completed subsegments. Streamed subsegments are passed to
+    this emitter, which holds them as JSON documents until the trace is
+    decided. The total size of the held documents is limited to
+    `max_buffer_bytes`. If a trace's documents don't fit, then they are
+    discarded. If the trace is kept anyway, then its segment is still sent,
+    with the number of discarded subsegments in the `truncated_subsegments`
+    metadata of the `tail_sampling` namespace. Entities that are emitted
+    after their trace was decided (eg. by a task that outlives the request)
+    are sent or discarded with the rest of the trace, for the last
+    `MAX_DECIDED_TRACES` traces.
+
+    Configure the recorder to use the tail sampler as its emitter, and pass
+    the same tail sampler to the middleware:
+
+        tail_sampler = TailSampler(AsyncUDPEmitter(), latency_threshold=0.5)
+        xray_recorder.configure(emitter=tail_sampler)
+        app.middlewares.append(make_xray_middleware(tail_sampler=tail_sampler))
+
+    Any other attributes (eg. `close()`) are those of the wrapped emitter.
+
+    Params:
+        emitter: The emitter that sends the kept traces.
+        latency_threshold: Duration (in seconds) above which a request is
+            always kept.
+        keep_client_errors: Also keep requests with a 4xx response.
+        max_buffer_bytes: Maximum number of bytes of streamed subsegments
+            held until their traces are decided.
+        serializer: Function that serialises a streamed subsegment to a JSON
+            segment document.
+
+    Notes:
+        Downstream services are called before the trace is decided. A
+        baseline trace is propagated as sampled (`Sampled=1`), and any other
+        trace as undecided (`Sampled=?`), so downstream services make their
+        own sampling decision. Until then, the segment's `sampled` attribute
+        is `"?"`. Subsegments only inherit this with the xraysink recorder
+        contexts, so with other contexts, calls made in a subsegment are
+        propagated as sampled.
+    """
+
+    def __init__(
+        self,
+        emitter,
+        *,
+        latency_threshold: float = DEFAULT_LATENCY_THRESHOLD,
+        keep_client_errors: bool = False,
+        max_buffer_bytes: int = DEFAULT_MAX_BUFFER_BYTES,
+        serializer: EntitySerializer = serialize_entity,
+    ):
+        self._emitter = emitter
+        self._latency_threshold = latency_threshold
+        self._keep_client_errors = keep_client_errors
+        self._max_buffer_bytes = max_buffer_bytes
+        self._serializer = serializer
+
+        self._lock = threading.Lock()
+        self._pending: Dict[str, _PendingTrace] = {}
+        self._decided: "OrderedDict[str, bool]" = OrderedDict()
+        self._buffer_bytes = 0
+
+        # Only updated while holding the lock
+        self._kept = 0
+        self._discarded = 0
+        self._overflowed = 0
+
+    def __getattr__(self, name):
+        if name == "_emitter":
+            # Not set up yet (eg. while unpickling)
+            raise AttributeError(name)
+        return getattr(self._emitter, name)
+
+    @property
+    def emitter(self):
+        """The emitter that sends the kept traces."""
+        return self._emitter
+
+    @property
+    def kept(self) -> int:
+        """Number of traces that were kept."""
+        return self._kept
+
+    @property
+    def discarded(self) -> int:
+        """Number of traces that were discarded."""
+        return self._discarded
+
+    @property
+    def overflowed(self) -> int:
+        """Number of traces whose streamed subsegments didn't fit in the buffer."""
+        return self._overflowed
+
+    @property
+    def pending(self) -> int:
+        """Number of traces that haven't been decided yet."""
+        return len(self._pending)
+
+    @property
+    def buffer_bytes(self) -> int:
+        """Number of bytes of streamed subsegments held in the buffer."""
+        return self._buffer_bytes
+
+    def send_entity(self, entity):
+        """Send an entity, or hold it until its trace has been decided."""
+        trace = self._pending.get(entity.trace_id) if self._pending else None
+        if trace is None:
+            if self._decided.get(entity.trace_id, True):
+                self._emitter.send_entity(entity)
+            return
+        if trace.overflowed:
+            with self._lock:
+                trace.dropped += 1
+            return
+
+        document = _BufferedDocument(
+            entity.id, entity.trace_id, self._serializer(entity)
+        )
+        size = len(document.document)
+        with self._lock:
+            if trace.overflowed:
+                trace.dropped += 1
+                return
+            if self._buffer_bytes + size > self._max_buffer_bytes:
+                trace.overflowed = True
+                trace.dropped = len(trace.documents) + 1
+                self._buffer_bytes -= trace.size
+                trace.documents = []
+                trace.size = 0
+                return
+            trace.documents.append(document)
+            trace.size += size
+            self._buffer_bytes += size
+
+    def set_daemon_address(self, address: Optional[str]):
+        self._emitter.set_daemon_address(address)
+
+    def begin_trace(self, segment: Segment, baseline: bool):
+        """Start recording a request, whose trace is decided when it ends.
+
+        If the recorder's sampler didn't sample the request, then the
+        segment's `sampled` attribute is set to `UNDECIDED`. This is still
+        true (so the request is recorded), but it's propagated downstream as
+        `Sampled=?`.
+
+        Params:
+            segment: The (sampled) segment for the request.
+            baseline: Whether the recorder's sampler decided to sample the
+                request.
+        """
+        if not baseline:
+            segment.sampled = UNDECIDED
+        with self._lock:
+            self._pending[segment.trace_id] = _PendingTrace(bool(baseline))
+
+    def end_trace(self, segment: Segment, end_time: Optional[float] = None) -> bool:
+        """Decide whether to keep the trace for a request that has ended.
+
+        This must be called before the segment is ended. If the trace is
+        discarded, then the segment is marked as not sampled, so that the
+        recorder doesn't emit it. A failed or slow request is kept even if
+        its streamed subsegments didn't fit in the buffer, with the number
+        that were discarded in the segment's metadata.
+
+        Params:
+            segment: The segment for the request.
+            end_time: Time the request ended, or None for now.
+
+        Returns:
+            True if the trace is kept.
+        """
+        with self._lock:
+            trace = self._pending.pop(segment.trace_id, None)
+            if trace is None:
+                return segment.sampled
+            self._buffer_bytes -= trace.size
+
+            keep = trace.baseline or self._is_outlier(segment, end_time)
+            if keep:
+                self._kept += 1
+            else:
+                self._discarded += 1
+            self._overflowed += trace.overflowed
+
+            self._decided[segment.trace_id] = keep
+            if len(self._decided) > MAX_DECIDED_TRACES:
+                self._decided.popitem(last=False)
+
+        if keep:
+            segment.sampled = True
+            if trace.overflowed:
+                segment.put_metadata(
+                    "truncated_subsegments", trace.dropped, TAIL_SAMPLING_NAMESPACE
+                )
+            for document in trace.documents:
+                self._emitter.send_entity(document)
+        else:
+            segment.sampled = False
+        return keep
+
+    def _is_outlier(self, segment: Segment, end_time: Optional[float]) -> bool:
+        """Check if a request failed or was slow."""
+        if getattr(segment, "fault", False) or getattr(segment, "throttle", False):
+            return True
+
+        status = segment.http.get("response", {}).get(http.STATUS)
+        if status is not None and (
+            status >= 500
+            or status == 429
+            or (self._keep_client_errors and status >= 400)
+        ):
+            return True
+
+        if end_time is None:
+            end_time = time.time()
+        return end_time - segment.start_time > self._latency_threshold
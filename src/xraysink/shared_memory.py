@@ -0,0 +1,90 @@
+"""Memory shared between the worker processes on a host.
+
+Note that this uses `fcntl`, so it's only available on POSIX platforms.
+"""
+
+import contextlib
+import fcntl
+import mmap
+import os
+import tempfile
+import threading
+
+#: Directory for the shared memory files. This is a memory-backed file system
+#: on Linux, so the contents are never written to disk.
+SHARED_MEMORY_DIR: str = (
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+)
+
+
+class SharedMemoryFile:
+    """Block of shared memory with a host-wide lock, that is found by name.
+
+    The memory is a memory-mapped file, which is created by whichever process
+    gets there first and mapped by name in every other process (including
+    unrelated ones). Using it as a context manager locks the file with
+    `flock()`, which excludes every other process and thread that uses the
+    same file.
+
+    The `multiprocessing.shared_memory` module isn't used, since it registers
+    each block with a resource tracker that removes the block as soon as the
+    process that created it exits (even though other workers are still using
+    it), and which is shared by processes started with `multiprocessing`.
+
+    The file isn't removed when a process exits, only by `unlink()`.
+
+    Params:
+        name: Name of the shared memory file.
+        size: Minimum size of the memory in bytes. A new file (or the part
+            of an existing file that it grows by) is filled with zeros.
+    """
+
+    def __init__(self, name: str, size: int):
+        self._path = os.path.join(SHARED_MEMORY_DIR, name)
+        self._thread_lock = threading.Lock()
+        self._lock_fd = None
+        self._lock_pid = None
+
+        with self:
+            # Sized under the lock, so that a process can't map the file
+            # before it has been sized
+            if os.fstat(self._lock_fd).st_size < size:
+                os.ftruncate(self._lock_fd, size)
+            self.buf = mmap.mmap(self._lock_fd, os.fstat(self._lock_fd).st_size)
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            fd = self._get_lock_fd()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        finally:
+            self._thread_lock.release()
+
+    def _get_lock_fd(self) -> int:
+        """Get the file descriptor to lock, which is opened in each process.
+
+        A forked process shares its parent's open file description, and a
+        `flock()` lock belongs to that, so the child must open its own. The
+        memory map is still shared with the parent.
+        """
+        pid = os.getpid()
+        if self._lock_pid != pid:
+            self._lock_fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._lock_pid = pid
+        return self._lock_fd
+
+    def unlink(self):
+        """Remove the shared memory file."""
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self._path)
@@ -0,0 +1,163 @@
+"""Deduplication of the stack traces recorded for repeated exceptions."""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from typing import Tuple
+
+from aws_xray_sdk.core.models.entity import Entity
+from aws_xray_sdk.core.utils import stacktrace
+
+#: Default number of seconds that a captured stack trace is referred to by
+#: later occurrences of the same exception, before it is captured again.
+DEFAULT_STACK_WINDOW: float = 60.0
+
+#: Default maximum number of distinct exceptions that we remember the captured
+#: stack trace for.
+DEFAULT_MAX_FINGERPRINTS: int = 1024
+
+#: Metadata namespace for the references to the captured stack traces. Each
+#: key is the ID of a recorded exception.
+STACK_NAMESPACE: str = "exception_stack"
+
+#: Fingerprint of an exception: its type, and the file and line it was raised at.
+Fingerprint = Tuple[str, str, Optional[Tuple[str, int]]]
+
+
+class _CapturedStack:
+    """The exception that a stack trace was captured for, in the current window."""
+
+    __slots__ = ("exception_id", "trace_id", "window_end", "occurrences")
+
+    def __init__(self, exception_id: str, trace_id: str, window_end: float):
+        self.exception_id = exception_id
+        self.trace_id = trace_id
+        self.window_end = window_end
+        self.occurrences = 1
+
+
+class StackDeduplicator:
+    """Records exceptions, capturing the stack trace for each distinct one just once.
+
+    Capturing and serialising a stack trace is relatively expensive, and when
+    lots of requests hit the same bug (eg. during an incident), every trace
+    gets the same stack. This fingerprints each exception by its type and
+    where it was raised, and only captures the stack trace for the first
+    occurrence in each `window` seconds. Later occurrences in the window are
+    recorded with their type and message, but without a stack trace.
+
+    Every recorded exception also has metadata in the `exception_stack`
+    namespace of the entity it's recorded in, under the exception's ID. This
+    has the `stack_id` and `trace_id` of the exception that has the stack
+    trace (which may be in another trace), and the `occurrence` number of
+    the exception in the window. So an entity can record several exceptions.
+
+    Params:
+        window: Number of seconds that a captured stack trace is referred to
+            by later occurrences of the same exception.
+        max_fingerprints: Maximum number of distinct exceptions to remember.
+            The least recently seen exceptions are forgotten first.
+    """
+
+    def __init__(
+        self,
+        window: float = DEFAULT_STACK_WINDOW,
+        max_fingerprints: int = DEFAULT_MAX_FINGERPRINTS,
+    ):
+        self._window = window
+        self._max_fingerprints = max_fingerprints
+        self._lock = threading.Lock()
+        self._stacks: "OrderedDict[Fingerprint, _CapturedStack]" = OrderedDict()
+
+        # Only updated while holding the lock
+        self._captured = 0
+        self._deduplicated = 0
+
+    @property
+    def captured(self) -> int:
+        """Number of exceptions that were recorded with a stack trace."""
+        return self._captured
+
+    @property
+    def deduplicated(self) -> int:
+        """Number of exceptions that referred to an earlier stack trace."""
+        return self._deduplicated
+
+    def add_exception(
+        self,
+        entity: Entity,
+        exception: BaseException,
+        limit: Optional[int] = None,
+        remote: bool = False,
+    ):
+        """Record an exception in a segment or subsegment.
+
+        This must be called while handling the exception, like
+        `stacktrace.get_stacktrace()`.
+
+        Params:
+            entity: The segment or subsegment to record the exception in.
+            exception: The exception.
+            limit: Maximum number of stack frames to capture, in the same
+                format as `xray_recorder.max_trace_back`.
+            remote: Whether the exception came from a downstream service.
+        """
+        if hasattr(exception, "_recorded"):
+            # Already recorded in a subsegment, so the entity just refers to it
+            entity.add_exception(exception, [], remote)
+            return
+
+        fingerprint = _get_fingerprint(exception)
+        now = time.monotonic()
+        with self._lock:
+            captured = self._stacks.get(fingerprint)
+            if captured is not None and now < captured.window_end:
+                captured.occurrences += 1
+                self._stacks.move_to_end(fingerprint)
+                self._deduplicated += 1
+                stack_id = captured.exception_id
+                stack_trace_id = captured.trace_id
+                occurrence = captured.occurrences
+            else:
+                captured = None
+
+        if captured is None:
+            stack = stacktrace.get_stacktrace(limit=limit)
+            entity.add_exception(exception, stack, remote)
+            stack_id = entity.cause["exceptions"][-1].id
+            stack_trace_id = entity.trace_id
+            occurrence = 1
+            with self._lock:
+                self._stacks[fingerprint] = _CapturedStack(
+                    stack_id, stack_trace_id, now + self._window
+                )
+                self._stacks.move_to_end(fingerprint)
+                while len(self._stacks) > self._max_fingerprints:
+                    self._stacks.popitem(last=False)
+                self._captured += 1
+        else:
+            entity.add_exception(exception, [], remote)
+
+        entity.put_metadata(
+            entity.cause["exceptions"][-1].id,
+            {
+                "stack_id": stack_id,
+                "trace_id": stack_trace_id,
+                "occurrence": occurrence,
+            },
+            STACK_NAMESPACE,
+        )
+
+
+def _get_fingerprint(exception: BaseException) -> Fingerprint:
+    """Get the fingerprint of an exception, without extracting its stack."""
+    raise_site = None
+    tb = exception.__traceback__
+    if tb is not None:
+        while tb.tb_next is not None:
+            tb = tb.tb_next
+        raise_site = (tb.tb_frame.f_code.co_filename, tb.tb_lineno)
+
+    exception_type = type(exception)
+    return exception_type.__module__, exception_type.__qualname__, raise_site
@@ -0,0 +1,106 @@
+"""Strategies for streaming subsegments out of a segment that is still open."""
+
+import logging
+from typing import Optional
+from weakref import WeakKeyDictionary
+
+from aws_xray_sdk.core.streaming.default_streaming import DefaultStreaming
+
+log = logging.getLogger(__name__)
+
+#: Whether we have warned that the recorder has no `SegmentStreaming` strategy.
+_logged_missing_strategy = False
+
+
+class SegmentStreaming(DefaultStreaming):
+    """Streaming strategy that can use a different threshold for some segments.
+
+    The SDK's streaming strategy uses a single threshold for every segment.
+    This wraps that strategy (or any other), so that some segments can have
+    their own threshold, eg. a long-running background task that should
+    stream its subsegments much sooner than a request would.
+
+    Once a segment with its own threshold has more subsegments than that,
+    each completed subsegment tree is emitted as an independent document and
+    released from its parent, in the same way as for the SDK's strategy.
+    Any other segment is handled by the wrapped strategy.
+
+    Params:
+        fallback: Strategy to use for segments without their own threshold.
+            Defaults to the SDK's `DefaultStreaming`.
+    """
+
+    def __init__(self, fallback=None):
+        super().__init__()
+        self._fallback = fallback if fallback is not None else DefaultStreaming()
+
+        # Keyed by the segment object, so that the threshold isn't an
+        # attribute that would be serialised with the segment
+        self._segment_thresholds = WeakKeyDictionary()
+
+    @property
+    def fallback(self):
+        """The strategy used for segments without their own threshold."""
+        return self._fallback
+
+    @property
+    def streaming_threshold(self):
+        return self._fallback.streaming_threshold
+
+    @streaming_threshold.setter
+    def streaming_threshold(self, value):
+        self._fallback.streaming_threshold = value
+
+    def set_segment_threshold(self, segment, threshold: int):
+        """Use a different streaming threshold for a segment."""
+        self._segment_thresholds[segment] = threshold
+
+    def get_segment_threshold(self, segment) -> Optional[int]:
+        """Get the streaming threshold for a segment, if it has its own."""
+        if segment is None:
+            return None
+        return self._segment_thresholds.get(segment)
+
+    def is_eligible(self, segment) -> bool:
+        threshold = self.get_segment_threshold(segment)
+        if threshold is None:
+            return self._fallback.is_eligible(segment)
+
+        if not segment.sampled:
+            return False
+        return segment.get_total_subsegments_size() > threshold
+
+    def stream(self, entity, callback):
+        if self.get_segment_threshold(entity) is None:
+            self._fallback.stream(entity, callback)
+        else:
+            super().stream(entity, callback)
+
+
+def set_segment_streaming_threshold(recorder, segment, threshold: int) -> bool:
+    """Stream the subsegments of a segment once it has more than some number.
+
+    The recorder must already be configured with a `SegmentStreaming`
+    strategy, eg. `xray_recorder.configure(streaming=SegmentStreaming())`.
+    The recorder's configuration is never changed here, so otherwise this
+    logs a warning (the first time), and the segment uses the recorder's
+    streaming threshold.
+
+    Returns:
+        Whether the segment has its own streaming threshold.
+    """
+    global _logged_missing_strategy
+
+    streaming = recorder.streaming
+    if not isinstance(streaming, SegmentStreaming):
+        if not _logged_missing_strategy:
+            _logged_missing_strategy = True
+            log.warning(
+                "Can't set a streaming threshold for segment %s, because the "
+                "recorder isn't configured with a SegmentStreaming strategy.",
+                segment.name,
+            )
+        return False
+
+    streaming.set_segment_threshold(segment, threshold)
+    return True
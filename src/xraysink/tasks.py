@@ -11,7 +11,11 @@ from aws_xray_sdk.core.models import http
 from aws_xray_sdk.core.models.subsegment import Subsegment
 
 from . import __version__ as xraysink_version
+from .entities import UNDECIDED
+from .streaming import set_segment_streaming_threshold
+from .util import get_trace_entities
 from .util import has_current_trace
+from .util import set_trace_entities
 
 #: URL scheme for the synthetic URL's used by background tasks.
 TASK_SCHEME: str = "task"
@@ -20,7 +24,12 @@ TASK_SCHEME: str = "task"
 TASK_URL_FORMAT: str = TASK_SCHEME + "://localhost/{task_path}"  # noqa: FS003
 
 
-def xray_task_async(*, _url_path: Optional[str] = None):
+def xray_task_async(
+    *,
+    inline: bool = False,
+    streaming_threshold: Optional[int] = None,
+    _url_path: Optional[str] = None,
+):
     """Decorator for a coroutine that executes an independent traced task.
 
     If there is an existing trace segment, we create a new segment using that
@@ -28,7 +37,8 @@ def xray_task_async(*, _url_path: Optional[str] = None):
     because we can't ensure that the subsegment would finish whilst the parent
     segment is still active; additionally, the purpose of this decorator is
     to manage *independent* segments), and additionally execute the decorated
-    coroutine in a task. Otherwise, we originate a new trace.
+    coroutine in a task (unless `inline` is set). Otherwise, we originate a
+    new trace.
 
     Notes:
         The X-Ray data model doesn't really allow for an internally originated
@@ -48,6 +58,20 @@ def xray_task_async(*, _url_path: Optional[str] = None):
         made-up URL scheme.
 
     Params:
+        inline: Whether to execute the decorated coroutine in the task that
+            awaits it, rather than in a new asyncio task, when there is an
+            existing trace segment. The task's segment replaces the current
+            trace entities whilst the coroutine runs, and they are restored
+            afterwards. This avoids the cost of scheduling a task for a
+            coroutine that is always awaited immediately, but the result
+            must be awaited (it won't run in the background).
+        streaming_threshold: Maximum number of subsegments kept in the task's
+            segment. Once there are more than this, completed subsegments are
+            sent to X-Ray as independent documents and released from the
+            segment, so that memory use for a long-running task depends on how
+            many subsegments are open at once, not on the total work done. The
+            default is to use the recorder's streaming threshold. The
+            recorder must be configured with a `SegmentStreaming` strategy.
         _url_path: String to use as the path of the synthetic URL. The default
             value is determined from the name of the decorated function.
     """
@@ -79,30 +103,52 @@ def xray_task_async(*, _url_path: Optional[str] = None):
                 )
 
                 coro = _execute_task_in_segment(
-                    wrapped, args, kwargs, task_path, parent=subsegment
+                    wrapped,
+                    args,
+                    kwargs,
+                    task_path,
+                    parent=subsegment,
+                    streaming_threshold=streaming_threshold,
                 )
 
-                # We always execute the wrapped function in an asyncio task,
-                # because it needs to be in it's own segment and the X-Ray
-                # context is intended to handle only 1 segment at a time.
+                # The wrapped function needs to be in it's own segment, and the
+                # X-Ray context is intended to handle only 1 segment at a time.
+                # So either swap the entities around an inline coroutine, or
+                # execute it in an asyncio task.
+                if inline:
+                    return _execute_task_inline(coro)
                 return ensure_future(coro)
         else:
             # Start a segment from scratch (ie. start a new trace)
-            return _execute_task_in_segment(wrapped, args, kwargs, task_path)
+            return _execute_task_in_segment(
+                wrapped,
+                args,
+                kwargs,
+                task_path,
+                streaming_threshold=streaming_threshold,
+            )
 
     return wrapper
 
 
 async def _execute_task_in_segment(
-    wrapped, args, kwargs, task_path, parent: Subsegment = None
+    wrapped,
+    args,
+    kwargs,
+    task_path,
+    parent: Subsegment = None,
+    streaming_threshold: Optional[int] = None,
 ):
     """Execute a wrapped function inside a new X-Ray segment"""
     # Setup trace context from parent, if necessary
     segment_params = {}
     if parent is not None:
         xray_recorder.clear_trace_entities()
+        # The task's segment is recorded even if the parent's trace hasn't
+        # been decided yet by a tail sampler
+        sampling = 1 if parent.sampled == UNDECIDED else parent.sampled
         segment_params.update(
-            traceid=parent.trace_id, parent_id=parent.id, sampling=parent.sampled
+            traceid=parent.trace_id, parent_id=parent.id, sampling=sampling
         )
 
     # Create a new segment for the task
@@ -113,10 +159,25 @@ async def _execute_task_in_segment(
         segment.put_http_meta(
             http.USER_AGENT, f"BackgroundTask xraysink/{xraysink_version}"
         )
+        if streaming_threshold is not None:
+            set_segment_streaming_threshold(xray_recorder, segment, streaming_threshold)
 
         return await wrapped(*args, **kwargs)
 
 
+async def _execute_task_inline(coro):
+    """Execute a task's coroutine in the current asyncio task.
+
+    The coroutine replaces the trace entities with the task's segment, so the
+    current entities are saved and then restored once it has finished.
+    """
+    entities = get_trace_entities()
+    try:
+        return await coro
+    finally:
+        set_trace_entities(entities)
+
+
 def _get_task_path(wrapped, instance) -> str:
     """Get the synthetic URL path for a task, based on the `wrapt` parameters."""
     funcname = wrapped.__name__
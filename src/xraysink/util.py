@@ -12,3 +12,18 @@ def has_current_trace() -> bool:
     """
     # See authoritative implementation in aws_xray_sdk.core.context.Context.get_trace_entity()
     return bool(getattr(xray_recorder.context._local, "entities", None))
+
+
+# noinspection PyProtectedMember
+def get_trace_entities():
+    """Get the current stack of trace entities, so it can be restored later.
+
+    The value is opaque, and depends on the recorder's context implementation.
+    """
+    return getattr(xray_recorder.context._local, "entities", None)
+
+
+# noinspection PyProtectedMember
+def set_trace_entities(entities):
+    """Restore a stack of trace entities from `get_trace_entities()`."""
+    xray_recorder.context._local.entities = entities
@@ -6,7 +6,13 @@ from aiohttp import web
 from aiohttp.web_exceptions import HTTPUnauthorized
 from aiohttp.web_exceptions import HTTPUnprocessableEntity
 
+from xraysink.asgi.middleware import make_xray_middleware
 from xraysink.asgi.middleware import xray_middleware
+from xraysink.util import has_current_trace
+
+from ._streaming import STREAMING_CHUNK
+from ._streaming import STREAMING_CHUNK_COUNT
+from ._streaming import STREAMING_CHUNK_DELAY
 
 
 class AioHttpServerFactory:
@@ -17,6 +23,9 @@ class AioHttpServerFactory:
 
     __test__ = False
 
+    def __init__(self, **middleware_options):
+        self.middleware_options = middleware_options
+
     async def handle_ok(self, request: web.Request) -> web.Response:
         """
         Handle / request
@@ -65,8 +74,36 @@ class AioHttpServerFactory:
         await asyncio.sleep(0.3)
         return web.Response(text="ok")
 
+    async def handle_has_trace(self, request: web.Request) -> web.Response:
+        """
+        Handle /has_trace request, which reports whether there is a current trace
+        """
+        return web.Response(text="yes" if has_current_trace() else "no")
+
+    async def handle_streaming(self, request: web.Request) -> web.StreamResponse:
+        """
+        Handle /streaming request, which sends a chunked response body
+        """
+        response = web.StreamResponse(headers={"Content-Type": "text/plain"})
+        await response.prepare(request)
+        for _ in range(STREAMING_CHUNK_COUNT):
+            await asyncio.sleep(STREAMING_CHUNK_DELAY)
+            await response.write(STREAMING_CHUNK)
+        await response.write_eof()
+        return response
+
+    async def handle_user(self, request: web.Request) -> web.Response:
+        """
+        Handle /users/{user_id} request
+        """
+        return web.Response(text=f"user {request.match_info['user_id']}")
+
     def get_app(self) -> web.Application:
-        app = web.Application(middlewares=[xray_middleware])
+        if self.middleware_options:
+            middleware = make_xray_middleware(**self.middleware_options)
+        else:
+            middleware = xray_middleware
+        app = web.Application(middlewares=[middleware])
         app.router.add_get("/", self.handle_ok)
         app.router.add_get(
             "/client_error_as_http_exception",
@@ -81,10 +118,13 @@ class AioHttpServerFactory:
         )
         app.router.add_get("/delay", self.handle_delay)
         app.router.add_get("/exception", self.handle_exception)
+        app.router.add_get("/has_trace", self.handle_has_trace)
+        app.router.add_get("/streaming", self.handle_streaming)
         app.router.add_get("/unauthorized", self.handle_unauthorized)
+        app.router.add_get(r"/users/{user_id:\d+}", self.handle_user)
 
         return app
 
     @classmethod
-    def app(cls) -> web.Application:
-        return cls().get_app()
+    def app(cls, **middleware_options) -> web.Application:
+        return cls(**middleware_options).get_app()
@@ -5,13 +5,20 @@ from fastapi import FastAPI
 from fastapi import HTTPException
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import JSONResponse
+from starlette.responses import StreamingResponse
 from starlette.status import HTTP_401_UNAUTHORIZED
 from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
 
-from xraysink.asgi.middleware import xray_middleware
+from xraysink.asgi.middleware import XRayASGIMiddleware
+from xraysink.asgi.middleware import make_xray_middleware
+from xraysink.util import has_current_trace
 
+from ._streaming import STREAMING_CHUNK
+from ._streaming import STREAMING_CHUNK_COUNT
+from ._streaming import STREAMING_CHUNK_DELAY
 
-__all__ = ["fastapi_native_middleware_factory"]
+
+__all__ = ["fastapi_asgi_middleware_factory", "fastapi_native_middleware_factory"]
 
 
 async def handle_request(content_length: Optional[int] = None) -> str:
@@ -21,11 +28,28 @@ async def handle_request(content_length: Optional[int] = None) -> str:
     return "ok"
 
 
+async def handle_user(user_id: int) -> str:
+    return f"user {user_id}"
+
+
+async def handle_streaming() -> StreamingResponse:
+    async def generate_body():
+        for _ in range(STREAMING_CHUNK_COUNT):
+            await asyncio.sleep(STREAMING_CHUNK_DELAY)
+            yield STREAMING_CHUNK
+
+    return StreamingResponse(generate_body(), media_type="text/plain")
+
+
 async def handle_with_delay() -> str:
     await asyncio.sleep(0.3)
     return "ok"
 
 
+async def handle_has_trace() -> str:
+    return "yes" if has_current_trace() else "no"
+
+
 async def handle_with_keyerror() -> str:
     return {}["key"]
 
@@ -44,15 +68,29 @@ async def client_induced_exception_handler(request, ex):
     )
 
 
-def fastapi_native_middleware_factory():
+def fastapi_native_middleware_factory(**middleware_options):
     """Create a FastAPI app that uses native-style middleware."""
     app = FastAPI()
+    app.add_middleware(
+        BaseHTTPMiddleware, dispatch=make_xray_middleware(**middleware_options)
+    )
+    _add_routes(app)
+    return app
+
+
+def fastapi_asgi_middleware_factory(**middleware_options):
+    """Create a FastAPI app that uses pure ASGI middleware."""
+    app = FastAPI()
+    app.add_middleware(XRayASGIMiddleware, **middleware_options)
+    _add_routes(app)
+    return app
 
+
+def _add_routes(app: FastAPI):
+    """Add the test endpoints (and related handlers) to a FastAPI app."""
     # Exception handler for `/client_error_from_handled_exception`
     app.add_exception_handler(IndexError, client_induced_exception_handler)
 
-    app.add_middleware(BaseHTTPMiddleware, dispatch=xray_middleware)
-
     app.add_api_route("/", handle_request)
     app.add_api_route("/client_error_as_http_exception", handle_with_http_exception)
     app.add_api_route(
@@ -63,8 +101,9 @@ def fastapi_native_middleware_factory():
     app.add_api_route("/client_error_from_handled_exception", handle_with_indexerror)
     app.add_api_route("/delay", handle_with_delay)
     app.add_api_route("/exception", handle_with_keyerror)
+    app.add_api_route("/has_trace", handle_has_trace)
+    app.add_api_route("/streaming", handle_streaming)
     app.add_api_route(
         "/unauthorized", handle_request, status_code=HTTP_401_UNAUTHORIZED
     )
-
-    return app
+    app.add_api_route("/users/{user_id}", handle_user)
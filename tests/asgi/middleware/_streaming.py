@@ -0,0 +1,10 @@
+"""Details of the streaming response used by the test servers."""
+
+#: Chunk of the response body.
+STREAMING_CHUNK = b"0123456789"
+
+#: Number of chunks in the response body.
+STREAMING_CHUNK_COUNT = 3
+
+#: Delay in seconds before sending each chunk.
+STREAMING_CHUNK_DELAY = 0.05
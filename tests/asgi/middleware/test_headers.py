@@ -0,0 +1,103 @@
+"""Tests for the request header handling in the middleware."""
+
+import pytest
+from aws_xray_sdk.core.models.trace_header import TraceHeader
+
+from xraysink.asgi.middleware import _parse_trace_header
+from xraysink.asgi.middleware import _RequestHeaders
+
+
+class TestRequestHeaders:
+    def test_should_find_headers_regardless_of_case(self):
+        # Exercise
+        headers = _RequestHeaders.from_raw(
+            [
+                (b"Accept", b"*/*"),
+                (b"X-Amzn-Trace-Id", b"Root=1-5759e988-bd862e3fe1be46a994272793"),
+                (b"Host", b"example.com:8080"),
+                (b"User-Agent", b"test-agent"),
+                (b"X-Forwarded-For", b"10.1.2.3"),
+            ]
+        )
+
+        # Verify
+        assert headers.trace_header == "Root=1-5759e988-bd862e3fe1be46a994272793"
+        assert headers.host == "example.com:8080"
+        assert headers.user_agent == "test-agent"
+        assert headers.forwarded_for == "10.1.2.3"
+        assert headers.remote_addr is None
+
+    def test_should_use_first_value_of_repeated_header(self):
+        # Exercise
+        headers = _RequestHeaders.from_raw([(b"host", b"first"), (b"host", b"second")])
+
+        # Verify
+        assert headers.host == "first"
+
+    def test_should_use_alternative_trace_header(self):
+        # Exercise
+        headers = _RequestHeaders.from_raw(
+            [(b"http_x_amzn_trace_id", b"Root=1-5759e988-bd862e3fe1be46a994272793")]
+        )
+
+        # Verify
+        assert headers.trace_header == "Root=1-5759e988-bd862e3fe1be46a994272793"
+
+    def test_should_match_header_mapping(self):
+        # Setup
+        mapping = {
+            "X-Amzn-Trace-Id": "Root=1-5759e988-bd862e3fe1be46a994272793",
+            "host": "example.com",
+            "remote-addr": "10.1.2.3",
+        }
+
+        # Exercise
+        headers = _RequestHeaders.from_mapping(mapping)
+
+        # Verify
+        assert headers.trace_header == mapping["X-Amzn-Trace-Id"]
+        assert headers.host == "example.com"
+        assert headers.user_agent is None
+        assert headers.remote_addr == "10.1.2.3"
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        None,
+        "",
+        "Root=1-5759e988-bd862e3fe1be46a994272793",
+        "Root=1-5759e988-bd862e3fe1be46a994272793;Parent=53995c3f42cd8ad8;Sampled=1",
+        "  Root=1-5759e988-bd862e3fe1be46a994272793;Sampled=?  ",
+        "Self=1-67891234-12456789abcdef012345678;Root=1-5759e988-bd862e3fe1be46a9942",
+        "Root=1-5759e988-bd862e3fe1be46a994272793;Lineage=a87bd80c:1|68fd508a:5",
+        "Root=1-5759e988-bd862e3fe1be46a994272793;Extra=a=b",
+    ],
+)
+def test_should_parse_trace_header_like_sdk(header):
+    # Exercise
+    actual = _parse_trace_header(header)
+
+    # Verify
+    expected = TraceHeader.from_header_str(header)
+    assert actual.to_header_str() == expected.to_header_str()
+    assert actual.data == expected.data
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        "Self;Root=1-5759e988-bd862e3fe1be46a994272793;Parent=53995c3f42cd8ad8;Sampled=1",
+        "Root=1-5759e988-bd862e3fe1be46a994272793;malformed;Parent=53995c3f42cd8ad8;Sampled=1",
+        "Root=1-5759e988-bd862e3fe1be46a994272793;Parent=53995c3f42cd8ad8;Sampled=1;",
+    ],
+)
+def test_should_skip_malformed_trace_header_parameters(header):
+    # Exercise
+    actual = _parse_trace_header(header)
+
+    # Verify
+    assert actual.root == "1-5759e988-bd862e3fe1be46a994272793"
+    assert actual.parent == "53995c3f42cd8ad8"
+    assert actual.sampled == 1
+    assert actual.data == {}
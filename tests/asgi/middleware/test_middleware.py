@@ -1,8 +1,10 @@
 """Test the ASGI middleware with all asyncio server's."""
 
 import asyncio
+from contextlib import ExitStack
 from datetime import datetime
 from typing import Union
+from unittest.mock import patch
 from urllib.parse import urlparse
 
 import aiohttp.web_app
@@ -13,13 +15,30 @@ from async_asgi_testclient import TestClient
 from aws_xray_sdk import global_sdk_config
 from aws_xray_sdk.core.models import http
 from aws_xray_sdk.core.models.segment import Segment
+from aws_xray_sdk.ext.util import calculate_sampling_decision
+from aws_xray_sdk.ext.util import inject_trace_header
+from starlette.responses import StreamingResponse
 from starlette.status import HTTP_200_OK
 from starlette.status import HTTP_401_UNAUTHORIZED
+from starlette.status import HTTP_404_NOT_FOUND
 from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
 from starlette.status import HTTP_500_INTERNAL_SERVER_ERROR
 
+from xraysink.asgi.middleware import XRayASGIMiddleware
+from xraysink.context import AsyncContext
+from xraysink.context import ContextVarAsyncContext
+from xraysink.sampling.tail import TailSampler
+from xraysink.stacks import STACK_NAMESPACE
+from xraysink.stacks import StackDeduplicator
+from xraysink.tasks import xray_task_async
+from xraysink.util import has_current_trace
+
 from ._aiohttp import AioHttpServerFactory
+from ._fastapi import fastapi_asgi_middleware_factory
 from ._fastapi import fastapi_native_middleware_factory
+from ._streaming import STREAMING_CHUNK
+from ._streaming import STREAMING_CHUNK_COUNT
+from ._streaming import STREAMING_CHUNK_DELAY
 
 pytestmark = pytest.mark.asyncio
 
@@ -38,21 +57,28 @@ async def loop(event_loop):
     return event_loop
 
 
+@pytest.fixture()
+def middleware_options() -> dict:
+    """Options for the middleware. Override this by parametrizing a test."""
+    return {}
+
+
 @pytest.fixture(
     params=[
         pytest.param(AioHttpServerFactory.app, id="aiohttp"),
         pytest.param(fastapi_native_middleware_factory, id="fastapi"),
+        pytest.param(fastapi_asgi_middleware_factory, id="fastapi-asgi"),
     ]
 )
-async def client(request, aiohttp_client):  # noqa: F811
+async def client(request, aiohttp_client, middleware_options):  # noqa: F811
     """Get a client for each of the server frameworks under test."""
     appfactory = request.param
-    app = appfactory()
+    app = appfactory(**middleware_options)
 
     if isinstance(app, aiohttp.web_app.Application):
         # Note that aiohttp is not actually ASGI-compliant, so we need to use
         # a custom client (not the usual `async_asgi_testclient.AsyncTestClient`)
-        client = await aiohttp_client(AioHttpServerFactory.app())
+        client = await aiohttp_client(app)
         yield client
     else:
         # A normal ASGI-compliant app
@@ -172,6 +198,151 @@ class TestRequestHandler:
         self._verify_xray_request(segment, "/", client_ip=fake_ip, x_forwarded_for=True)
         self._verify_xray_response(segment, HTTP_200_OK)
 
+    async def test_should_continue_trace_from_lower_case_trace_header(
+        self, client, recorder
+    ):
+        # Setup
+        trace_id = "1-5759e988-bd862e3fe1be46a994272793"
+        trace_header = f"Root={trace_id};Parent=53995c3f42cd8ad8;Sampled=1"
+
+        # Exercise
+        server_response = await client.get(
+            "/", headers={http.XRAY_HEADER.lower(): trace_header}
+        )
+
+        # Verify
+        await self._verify_http_status(server_response, HTTP_200_OK)
+
+        segment = recorder.emitter.pop()
+        assert segment.trace_id == trace_id
+        assert segment.parent_id == "53995c3f42cd8ad8"
+
+    async def test_should_use_dynamic_segment_name(self, client, recorder):
+        # Setup
+        recorder.configure(dynamic_naming="*")
+
+        # Exercise
+        await client.get("/")
+        recorder.configure(dynamic_naming="not-this-host")
+        await client.get("/")
+
+        # Verify
+        first_segment, second_segment = recorder.emitter.segments
+        assert first_segment.name != "test", "Should be named after the host"
+        assert second_segment.name == "test", "Should use the new configuration"
+
+    async def test_should_not_resolve_route_by_default(self, client, recorder):
+        # Exercise
+        route_functions = [
+            "get_request_route",
+            "get_scope_route",
+            "get_handled_request_route",
+            "get_handled_scope_route",
+        ]
+        with ExitStack() as stack:
+            mocks = [
+                stack.enter_context(patch(f"xraysink.asgi.middleware.{name}"))
+                for name in route_functions
+            ]
+            server_response = await client.get("/users/123")
+
+        # Verify
+        await self._verify_http_status(server_response, HTTP_200_OK)
+        for mock in mocks:
+            mock.assert_not_called()
+
+        segment = recorder.emitter.pop()
+        assert "route" not in segment.annotations
+
+    @pytest.mark.parametrize("middleware_options", [{"annotate_route": True}])
+    async def test_should_record_route_template(self, client, recorder):
+        # Exercise
+        with patch("xraysink.asgi.routes._match_routes") as mock_match_routes:
+            server_response = await client.get("/users/123")
+
+        # Verify
+        await self._verify_http_status(server_response, HTTP_200_OK)
+        mock_match_routes.assert_not_called()
+
+        segment = recorder.emitter.pop()
+        assert segment.annotations["route"] == "/users/{user_id}"
+        assert segment.name == "test", "Segment should be named after the service"
+        self._verify_xray_request(segment, "/users/123")
+
+    @pytest.mark.parametrize("middleware_options", [{"annotate_route": True}])
+    async def test_should_not_record_route_template_for_unknown_route(
+        self, client, recorder
+    ):
+        # Exercise
+        server_response = await client.get("/no/such/route")
+
+        # Verify
+        await self._verify_http_status(server_response, HTTP_404_NOT_FOUND)
+
+        segment = recorder.emitter.pop()
+        assert "route" not in segment.annotations
+
+    @pytest.mark.parametrize(
+        "middleware_options",
+        [{"sample_by_route": True, "name_by_route": True, "annotate_route": True}],
+    )
+    async def test_should_sample_and_name_segment_by_route(self, client, recorder):
+        # Exercise
+        with patch(
+            "xraysink.asgi.middleware.calculate_sampling_decision",
+            wraps=calculate_sampling_decision,
+        ) as mock_sampling_decision:
+            server_response = await client.get("/users/123")
+
+        # Verify
+        await self._verify_http_status(server_response, HTTP_200_OK)
+
+        sampling_req = mock_sampling_decision.call_args.kwargs["sampling_req"]
+        assert sampling_req["path"] == "/users/{user_id}"
+
+        segment = recorder.emitter.pop()
+        assert segment.name == "GET /users/:user_id"
+        assert segment.annotations["route"] == "/users/{user_id}"
+        self._verify_xray_request(segment, "/users/123")
+
+    @pytest.mark.parametrize(
+        "middleware_options", [{"sample_by_route": True, "name_by_route": True}]
+    )
+    async def test_should_sample_unknown_route_by_path(self, client, recorder):
+        # Exercise
+        with patch(
+            "xraysink.asgi.middleware.calculate_sampling_decision",
+            wraps=calculate_sampling_decision,
+        ) as mock_sampling_decision:
+            await client.get("/no/such/route")
+
+        # Verify
+        sampling_req = mock_sampling_decision.call_args.kwargs["sampling_req"]
+        assert sampling_req["path"] == "/no/such/route"
+
+        segment = recorder.emitter.pop()
+        assert segment.name == "test"
+
+    @pytest.mark.parametrize("middleware_options", [{"exclude_paths": ["/has_*"]}])
+    async def test_should_not_trace_excluded_path(self, client, recorder):
+        # Exercise
+        server_response = await client.get("/has_trace")
+
+        # Verify
+        await self._verify_http_status(server_response, HTTP_200_OK)
+        assert "no" in await _get_response_text(server_response)
+
+        assert recorder.emitter.pop() is None, "Should not emit a segment"
+        assert http.XRAY_HEADER not in server_response.headers
+
+    @pytest.mark.parametrize("middleware_options", [{"exclude_paths": ["/has_*"]}])
+    async def test_should_trace_path_that_is_not_excluded(self, client, recorder):
+        # Exercise
+        await client.get("/")
+
+        # Verify
+        assert recorder.emitter.pop() is not None
+
     async def test_should_record_response_content_length(self, client, recorder):
         # Exercise
         server_response = await client.get("/?content_length=100")
@@ -183,6 +354,42 @@ class TestRequestHandler:
         self._verify_xray_request(segment, "/")
         self._verify_xray_response(segment, HTTP_200_OK, content_length=100)
 
+    async def test_should_end_segment_after_streaming_response(self, client, recorder):
+        # Exercise
+        server_response = await client.get("/streaming")
+
+        # Verify
+        await self._verify_http_status(server_response, HTTP_200_OK)
+        body_size = STREAMING_CHUNK_COUNT * len(STREAMING_CHUNK)
+        assert len(await _get_response_text(server_response)) == body_size
+
+        segment = recorder.emitter.pop()
+        self._verify_xray_response(segment, HTTP_200_OK)
+
+        min_duration = STREAMING_CHUNK_COUNT * STREAMING_CHUNK_DELAY
+        assert segment.end_time - segment.start_time >= min_duration
+
+    async def test_should_record_streaming_response_body(self, client, recorder):
+        if "aiohttp" in type(client).__module__:
+            pytest.skip("aiohttp handlers send the body themselves")
+
+        # Exercise
+        await client.get("/streaming")
+
+        # Verify
+        segment = recorder.emitter.pop()
+        body_size = STREAMING_CHUNK_COUNT * len(STREAMING_CHUNK)
+        self._verify_xray_response(segment, HTTP_200_OK, content_length=body_size)
+
+        timing = segment.metadata["response_body"]
+        assert timing["time_to_first_byte"] >= STREAMING_CHUNK_DELAY
+        assert (
+            timing["time_to_last_byte"] >= STREAMING_CHUNK_COUNT * STREAMING_CHUNK_DELAY
+        )
+        assert timing["time_to_last_byte"] == pytest.approx(
+            segment.end_time - segment.start_time
+        )
+
     @pytest.mark.parametrize(
         "path",
         [
@@ -291,6 +498,56 @@ class TestRequestHandler:
         ids = [item.id for item in recorder.emitter.segments]
         assert len(ids) == len(set(ids)), "All ID's should be different"
 
+    async def test_should_not_record_unsampled_request(self, client, recorder):
+        # Setup
+        trace_id = "1-5759e988-bd862e3fe1be46a994272793"
+        trace_header = f"Root={trace_id};Parent=53995c3f42cd8ad8;Sampled=0"
+
+        # Exercise
+        server_response = await client.get(
+            "/", headers={http.XRAY_HEADER: trace_header}
+        )
+
+        # Verify
+        await self._verify_http_status(server_response, HTTP_200_OK)
+        assert recorder.emitter.pop() is None, "Should not emit a segment"
+
+        xray_header = server_response.headers[http.XRAY_HEADER]
+        assert f"Root={trace_id}" in xray_header
+        assert "Sampled=0" in xray_header
+
+    async def test_should_have_current_trace_for_unsampled_request(
+        self, client, recorder
+    ):
+        # Exercise
+        server_response = await client.get(
+            "/has_trace",
+            headers={
+                http.XRAY_HEADER: "Root=1-5759e988-bd862e3fe1be46a994272793;Sampled=0"
+            },
+        )
+
+        # Verify
+        await self._verify_http_status(server_response, HTTP_200_OK)
+        assert "yes" in await _get_response_text(server_response)
+
+    async def test_should_not_record_unsampled_server_exception(self, client, recorder):
+        # Exercise
+        headers = {
+            http.XRAY_HEADER: "Root=1-5759e988-bd862e3fe1be46a994272793;Sampled=0"
+        }
+        if isinstance(client, TestClient):
+            with pytest.raises(KeyError):
+                _ = await client.get("/exception", headers=headers)
+        else:
+            server_response = await client.get("/exception", headers=headers)
+            await self._verify_http_status(
+                server_response, HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        # Verify
+        assert recorder.emitter.pop() is None, "Should not emit a segment"
+
     async def test_should_not_record_when_sdk_is_disabled(self, client, recorder):
         # Setup
         global_sdk_config.set_sdk_enabled(False)
@@ -303,3 +560,393 @@ class TestRequestHandler:
 
         segment = recorder.emitter.pop()
         assert not segment
+
+
+class _NeverSampler:
+    """Sampler that doesn't sample any request when it starts."""
+
+    def should_trace(self, sampling_req=None):
+        return False
+
+
+class TestTailSampling:
+    """Verify that the middleware only keeps the traces chosen by a tail sampler."""
+
+    @pytest.fixture()
+    def tail_sampler(self, recorder) -> TailSampler:
+        tail_sampler = TailSampler(recorder.emitter, latency_threshold=0.2)
+        recorder.configure(emitter=tail_sampler, sampling=True, sampler=_NeverSampler())
+        return tail_sampler
+
+    @pytest.fixture()
+    def middleware_options(self, tail_sampler) -> dict:
+        return {"tail_sampler": tail_sampler}
+
+    async def test_should_discard_fast_successful_request(
+        self, client, recorder, tail_sampler
+    ):
+        # Exercise
+        server_response = await client.get("/")
+
+        # Verify
+        assert server_response.headers[http.XRAY_HEADER]
+        assert tail_sampler.emitter.pop() is None, "Should not emit a segment"
+        assert tail_sampler.discarded == 1
+        assert tail_sampler.pending == 0
+
+    async def test_should_keep_failed_request(self, client, recorder, tail_sampler):
+        # Exercise
+        if isinstance(client, TestClient):
+            with pytest.raises(KeyError):
+                _ = await client.get("/exception")
+        else:
+            await client.get("/exception")
+
+        # Verify
+        segment = tail_sampler.emitter.pop()
+        assert segment.fault
+        assert segment.http["response"]["status"] == HTTP_500_INTERNAL_SERVER_ERROR
+        assert tail_sampler.kept == 1
+
+    async def test_should_keep_slow_request(self, client, recorder, tail_sampler):
+        # Exercise
+        await client.get("/delay")
+
+        # Verify
+        segment = tail_sampler.emitter.pop()
+        assert segment.end_time - segment.start_time > 0.2
+        assert segment.http["response"]["status"] == HTTP_200_OK
+
+    async def test_should_keep_baseline_request(self, client, recorder, tail_sampler):
+        # Setup
+        recorder.sampler.should_trace = lambda sampling_req=None: True
+
+        # Exercise
+        await client.get("/")
+
+        # Verify
+        segment = tail_sampler.emitter.pop()
+        assert segment.http["response"]["status"] == HTTP_200_OK
+        assert tail_sampler.kept == 1
+
+    async def test_should_keep_request_sampled_upstream(
+        self, client, recorder, tail_sampler
+    ):
+        # Setup
+        trace_id = "1-5759e988-bd862e3fe1be46a994272793"
+        trace_header = f"Root={trace_id};Parent=53995c3f42cd8ad8;Sampled=1"
+
+        # Exercise
+        await client.get("/", headers={http.XRAY_HEADER: trace_header})
+
+        # Verify
+        segment = tail_sampler.emitter.pop()
+        assert segment.trace_id == trace_id
+        assert tail_sampler.kept == 0
+        assert tail_sampler.discarded == 0
+
+
+class TestStackDeduplication:
+    """Verify that the middleware only captures the stack of a repeated exception once."""
+
+    @pytest.fixture()
+    def stack_deduplicator(self) -> StackDeduplicator:
+        return StackDeduplicator()
+
+    @pytest.fixture()
+    def middleware_options(self, stack_deduplicator) -> dict:
+        return {"stack_deduplicator": stack_deduplicator}
+
+    async def test_should_refer_to_stack_of_first_exception(
+        self, client, recorder, stack_deduplicator
+    ):
+        # Exercise
+        for _ in range(2):
+            if isinstance(client, TestClient):
+                with pytest.raises(KeyError):
+                    _ = await client.get("/exception")
+            else:
+                await client.get("/exception")
+
+        # Verify
+        first, second = recorder.emitter.segments
+        (first_exception,) = first.cause["exceptions"]
+        (second_exception,) = second.cause["exceptions"]
+
+        assert first_exception.stack
+        assert not second_exception.stack
+        assert second_exception.type == "KeyError"
+        assert second.fault
+        assert second.metadata[STACK_NAMESPACE] == {
+            second_exception.id: {
+                "stack_id": first_exception.id,
+                "trace_id": first.trace_id,
+                "occurrence": 2,
+            }
+        }
+        assert stack_deduplicator.deduplicated == 1
+
+
+async def test_should_end_asgi_segment_when_response_body_is_complete(recorder):
+    # Setup
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"abc", "more_body": True})
+        await send({"type": "http.response.body", "body": b"de"})
+
+        # Some background work, after the response has been sent
+        await asyncio.sleep(0.2)
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(message):
+        pass
+
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": []}
+
+    # Exercise
+    await XRayASGIMiddleware(app)(scope, receive, send)
+
+    # Verify
+    segment = recorder.emitter.pop()
+    assert segment.end_time - segment.start_time < 0.2
+    assert segment.http["response"]["content_length"] == 5
+    assert segment.metadata["response_body"]["time_to_last_byte"] < 0.2
+
+
+def _make_scope(path: str) -> dict:
+    return {
+        "type": "http",
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"127.0.0.1")],
+        "client": ("127.0.0.1", 43567),
+        "server": ("127.0.0.1", 80),
+    }
+
+
+@pytest.mark.parametrize(
+    "app_factory",
+    [
+        pytest.param(fastapi_native_middleware_factory, id="fastapi"),
+        pytest.param(fastapi_asgi_middleware_factory, id="fastapi-asgi"),
+    ],
+)
+async def test_should_end_segment_when_client_disconnects_before_body(
+    recorder, app_factory
+):
+    # Setup
+    app = app_factory()
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        # The disconnect is noticed while the response is being started
+        await asyncio.sleep(0.01)
+
+    # Exercise
+    await app(_make_scope("/"), receive, send)
+
+    # Verify
+    segment = recorder.emitter.pop()
+    assert segment is not None, "Segment should be emitted"
+    assert not segment.in_progress
+    assert segment.http["response"]["status"] == HTTP_200_OK
+
+
+async def test_should_end_tail_sampled_trace_when_client_disconnects_before_body(
+    recorder,
+):
+    # Setup
+    tail_sampler = TailSampler(recorder.emitter)
+    recorder.configure(emitter=tail_sampler, sampling=True, sampler=_NeverSampler())
+    app = fastapi_native_middleware_factory(tail_sampler=tail_sampler)
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        await asyncio.sleep(0.01)
+
+    # Exercise
+    await app(_make_scope("/"), receive, send)
+
+    # Verify
+    assert tail_sampler.pending == 0
+    assert tail_sampler.discarded == 1
+
+
+@pytest.mark.parametrize(
+    "context_class",
+    [
+        pytest.param(AsyncContext, id="xraysink"),
+        pytest.param(ContextVarAsyncContext, id="xraysink-contextvars"),
+    ],
+)
+@pytest.mark.parametrize(
+    "app_factory",
+    [
+        pytest.param(fastapi_native_middleware_factory, id="fastapi"),
+        pytest.param(fastapi_asgi_middleware_factory, id="fastapi-asgi"),
+    ],
+)
+async def test_task_started_by_streamed_request_should_not_see_ended_segment(
+    recorder, app_factory, context_class
+):
+    # Setup
+    recorder.configure(context=context_class(use_task_factory=True))
+    stop = asyncio.Event()
+    tasks = []
+    traces_seen = []
+
+    async def poll():
+        await stop.wait()
+        traces_seen.append(has_current_trace())
+
+    async def generate_body():
+        yield b"ok"
+
+    app = app_factory()
+
+    @app.get("/spawn")
+    async def handle_spawn():
+        tasks.append(asyncio.ensure_future(poll()))
+        return StreamingResponse(generate_body(), media_type="text/plain")
+
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # The client stays connected
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        pass
+
+    # Exercise
+    await app(_make_scope("/spawn"), receive, send)
+    segment = recorder.emitter.pop()
+    stop.set()
+    await asyncio.gather(*tasks)
+
+    # Verify
+    assert segment is not None, "Segment should be emitted"
+    assert not segment.in_progress
+    assert traces_seen == [False], "Task should not see the ended segment"
+
+
+@pytest.mark.parametrize(("baseline", "expected_sampled"), [(False, "?"), (True, "1")])
+@pytest.mark.parametrize(
+    "app_factory",
+    [
+        pytest.param(fastapi_native_middleware_factory, id="fastapi"),
+        pytest.param(fastapi_asgi_middleware_factory, id="fastapi-asgi"),
+    ],
+)
+async def test_should_propagate_baseline_decision_of_tail_sampled_trace(
+    recorder, app_factory, baseline, expected_sampled
+):
+    # Setup
+    tail_sampler = TailSampler(recorder.emitter)
+    recorder.configure(
+        emitter=tail_sampler,
+        sampling=True,
+        sampler=_NeverSampler(),
+        context=AsyncContext(),
+    )
+    recorder.sampler.should_trace = lambda sampling_req=None: baseline
+    app = app_factory(tail_sampler=tail_sampler)
+    downstream_headers = []
+
+    @app.get("/downstream")
+    async def handle_downstream():
+        async with recorder.in_subsegment_async("call", namespace="remote") as call:
+            headers = {}
+            inject_trace_header(headers, call)
+            downstream_headers.append(headers[http.XRAY_HEADER])
+        return "ok"
+
+    messages = [
+        {"type": "http.disconnect"},
+        {"type": "http.request", "body": b"", "more_body": False},
+    ]
+
+    async def receive():
+        return messages.pop() if len(messages) > 1 else messages[0]
+
+    async def send(message):
+        pass
+
+    # Exercise
+    await app(_make_scope("/downstream"), receive, send)
+
+    # Verify
+    (header,) = downstream_headers
+    assert f"Sampled={expected_sampled}" in header.split(";")
+    assert tail_sampler.pending == 0
+
+
+@pytest.mark.parametrize(("baseline", "expected_count"), [(False, 0), (True, 2)])
+async def test_should_decide_task_that_outlives_tail_sampled_request(
+    recorder, baseline, expected_count
+):
+    # Setup
+    tail_sampler = TailSampler(recorder.emitter)
+    recorder.configure(
+        emitter=tail_sampler,
+        sampling=True,
+        sampler=_NeverSampler(),
+        context=AsyncContext(use_task_factory=True),
+    )
+    recorder.sampler.should_trace = lambda sampling_req=None: baseline
+    app = fastapi_native_middleware_factory(tail_sampler=tail_sampler)
+    stop = asyncio.Event()
+    tasks = []
+
+    @xray_task_async()
+    async def outlive_request():
+        await stop.wait()
+
+    @app.get("/outlive")
+    async def handle_outlive():
+        tasks.append(outlive_request())
+        return "ok"
+
+    messages = [
+        {"type": "http.disconnect"},
+        {"type": "http.request", "body": b"", "more_body": False},
+    ]
+
+    async def receive():
+        return messages.pop() if len(messages) > 1 else messages[0]
+
+    async def send(message):
+        pass
+
+    # Exercise
+    await app(_make_scope("/outlive"), receive, send)
+    pending = tail_sampler.pending
+    stop.set()
+    await asyncio.gather(*tasks)
+
+    # Verify
+    assert pending == 0, "Request's trace should be decided before the task ends"
+    entities = tail_sampler.emitter.segments
+    assert len(entities) == expected_count
+    assert len({entity.trace_id for entity in entities}) <= 1
+
+
+async def _get_response_text(
+    response: Union[requests.Response, aiohttp.ClientResponse],
+) -> str:
+    """Get the body of a response as text."""
+    if isinstance(response, aiohttp.ClientResponse):
+        return await response.text()
+    return response.text
@@ -0,0 +1,56 @@
+"""Tests for matching request paths."""
+
+import pytest
+
+from xraysink.asgi.paths import compile_path_matcher
+
+
+class TestCompilePathMatcher:
+    def test_should_not_compile_empty_patterns(self):
+        # Exercise
+        matcher = compile_path_matcher([])
+
+        # Verify
+        assert matcher is None
+
+    @pytest.mark.parametrize(
+        ("path", "expected"),
+        [
+            ("/health", True),
+            ("/health/", False),
+            ("/healthz", False),
+            ("/internal/metrics", True),
+            ("/internal", False),
+            ("/api/v1/status", True),
+            ("/api/v1/users/status", True),
+            ("/api/v1/statuses", False),
+            ("/ping", True),
+            ("/pong", True),
+            ("/prong", False),
+            ("/", False),
+        ],
+    )
+    def test_should_match_any_pattern(self, path, expected):
+        # Setup
+        matcher = compile_path_matcher(
+            ["/health", "/internal/*", "/api/*/status", "/p?ng", "/ping"]
+        )
+
+        # Exercise
+        actual = matcher(path)
+
+        # Verify
+        assert actual is expected
+
+    @pytest.mark.parametrize(
+        "patterns",
+        [["/health"], ["/internal/*"], ["/api/*/status"]],
+        ids=["exact", "prefix", "glob"],
+    )
+    def test_should_match_single_type_of_pattern(self, patterns):
+        # Exercise
+        matcher = compile_path_matcher(patterns)
+
+        # Verify
+        assert matcher(patterns[0].replace("*", "x")) is True
+        assert matcher("/other") is False
@@ -0,0 +1,158 @@
+"""Tests for finding the route template of a request."""
+
+from unittest.mock import patch
+
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Mount
+from starlette.routing import Route
+
+from xraysink.asgi.routes import RouteTemplate
+from xraysink.asgi.routes import get_handled_scope_route
+from xraysink.asgi.routes import get_scope_route
+
+
+async def _endpoint(request):
+    return PlainTextResponse("ok")
+
+
+async def _user_endpoint(request):
+    return PlainTextResponse("user")
+
+
+def _make_scope(app, path: str, method: str = "GET") -> dict:
+    return {"type": "http", "app": app, "method": method, "path": path}
+
+
+def _make_app() -> Starlette:
+    return Starlette(
+        routes=[
+            Route("/users/{user_id:int}", _endpoint),
+            Route("/orders", _endpoint, methods=["POST"]),
+            Mount("/api/v1", routes=[Route("/items/{item_id}", _endpoint)]),
+        ]
+    )
+
+
+class TestRouteTemplate:
+    def test_should_remove_braces_from_segment_name(self):
+        # Exercise
+        route = RouteTemplate("/users/{user_id}/orders/{order_id:int}")
+
+        # Verify
+        assert route.template == "/users/{user_id}/orders/{order_id:int}"
+        assert route.segment_name == "/users/:user_id/orders/:order_id"
+
+
+class TestGetScopeRoute:
+    def test_should_find_route_without_path_convertor(self):
+        # Exercise
+        route = get_scope_route(_make_scope(_make_app(), "/users/123"))
+
+        # Verify
+        assert route.template == "/users/{user_id}"
+
+    def test_should_find_route_in_mount(self):
+        # Exercise
+        route = get_scope_route(_make_scope(_make_app(), "/api/v1/items/abc"))
+
+        # Verify
+        assert route.template == "/api/v1/items/{item_id}"
+
+    def test_should_find_route_with_different_method(self):
+        # Exercise
+        route = get_scope_route(_make_scope(_make_app(), "/orders", method="GET"))
+
+        # Verify
+        assert route.template == "/orders"
+
+    def test_should_not_find_unknown_route(self):
+        # Exercise
+        route = get_scope_route(_make_scope(_make_app(), "/users/abc"))
+
+        # Verify
+        assert route is None
+
+    def test_should_not_find_route_without_starlette_app(self):
+        # Exercise
+        route = get_scope_route(_make_scope(object(), "/users/123"))
+
+        # Verify
+        assert route is None
+
+    def test_should_reuse_route_details(self):
+        # Setup
+        app = _make_app()
+
+        # Exercise
+        first = get_scope_route(_make_scope(app, "/users/123"))
+        second = get_scope_route(_make_scope(app, "/users/456"))
+
+        # Verify
+        assert first is second
+
+
+class TestGetHandledScopeRoute:
+    def test_should_find_route_from_endpoint(self):
+        # Setup
+        app = Starlette(routes=[Route("/users/{user_id:int}", _user_endpoint)])
+        routing_scope = _make_scope(app, "/users/123")
+        scope = dict(routing_scope, endpoint=_user_endpoint)
+
+        # Exercise
+        with patch("xraysink.asgi.routes._match_routes") as mock_match_routes:
+            route = get_handled_scope_route(scope, routing_scope)
+
+        # Verify
+        assert route.template == "/users/{user_id}"
+        mock_match_routes.assert_not_called()
+
+    def test_should_find_route_from_route(self):
+        # Setup
+        app = _make_app()
+        mounted_route = app.routes[2].routes[0]
+        routing_scope = _make_scope(app, "/api/v1/items/abc")
+        scope = dict(routing_scope, route=mounted_route, endpoint=_endpoint)
+
+        # Exercise
+        route = get_handled_scope_route(scope, routing_scope)
+
+        # Verify
+        assert route.template == "/api/v1/items/{item_id}"
+
+    def test_should_match_routes_for_shared_endpoint(self):
+        # Setup
+        app = _make_app()
+        routing_scope = _make_scope(app, "/api/v1/items/abc")
+        scope = dict(routing_scope, endpoint=_endpoint)
+
+        # Exercise
+        route = get_handled_scope_route(scope, routing_scope)
+
+        # Verify
+        assert route.template == "/api/v1/items/{item_id}"
+
+    def test_should_not_find_route_when_router_did_not_match(self):
+        # Setup
+        routing_scope = _make_scope(_make_app(), "/users/abc")
+
+        # Exercise
+        route = get_handled_scope_route(dict(routing_scope), routing_scope)
+
+        # Verify
+        assert route is None
+
+    def test_should_find_route_added_after_first_request(self):
+        # Setup
+        app = Starlette(routes=[Route("/users/{user_id:int}", _user_endpoint)])
+        routing_scope = _make_scope(app, "/orders")
+        get_handled_scope_route(dict(routing_scope), routing_scope)
+        app.add_route("/orders", _endpoint)
+
+        # Exercise
+        route = get_handled_scope_route(
+            dict(routing_scope, endpoint=_endpoint), routing_scope
+        )
+
+        # Verify
+        assert route.template == "/orders"
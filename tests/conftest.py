@@ -1,4 +1,5 @@
 import logging
+import time
 from unittest.mock import patch
 
 import pytest
@@ -28,10 +29,32 @@ def recorder(event_loop) -> AsyncAWSXRayRecorder:
 
     with patch("xraysink.asgi.middleware.xray_recorder", xray_recorder), patch(
         "xraysink.config.xray_recorder", xray_recorder
-    ), patch("xraysink.tasks.xray_recorder", xray_recorder), patch(
-        "xraysink.util.xray_recorder", xray_recorder
-    ):
+    ), patch("xraysink.executors.xray_recorder", xray_recorder), patch(
+        "xraysink.tasks.xray_recorder", xray_recorder
+    ), patch("xraysink.util.xray_recorder", xray_recorder):
         xray_recorder.clear_trace_entities()
         yield xray_recorder
         global_sdk_config.set_sdk_enabled(True)
         xray_recorder.clear_trace_entities()
+
+
+class FakeClock:
+    """Clock that only moves when a test moves it."""
+
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture()
+def clock(request, monkeypatch) -> FakeClock:
+    """Fake clock, in place of `time.monotonic()`.
+
+    Parametrise it indirectly with the name of the `time` function to
+    replace instead, eg. `"time"`. It starts at the start of a second.
+    """
+    clock = FakeClock(1_700_000_000.0)
+    monkeypatch.setattr(time, getattr(request, "param", "monotonic"), clock)
+    return clock
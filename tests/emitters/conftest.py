@@ -0,0 +1,181 @@
+"""Fixtures for the emitter tests."""
+
+import asyncio
+import json
+import os
+import threading
+import uuid
+from collections import deque
+from contextlib import suppress
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import pytest
+from aws_xray_sdk.core.emitters.udp_emitter import PROTOCOL_HEADER
+
+
+class FakeDaemonProtocol(asyncio.DatagramProtocol):
+    """Stand-in for the X-Ray daemon that just collects the datagrams."""
+
+    def __init__(self):
+        self.datagrams = []
+        self.received = asyncio.Event()
+
+    def datagram_received(self, data, addr):
+        self.datagrams.append(data)
+        self.received.set()
+
+    @property
+    def documents(self):
+        """The segment documents received by the daemon."""
+        result = []
+        for data in self.datagrams:
+            header, body = data.decode("utf-8").split("\n", 1)
+            assert header == PROTOCOL_HEADER
+            result.append(json.loads(body))
+        return result
+
+    async def wait_for_datagrams(self, count: int, timeout: float = 2):
+        """Wait until at least some number of datagrams have been received."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while len(self.datagrams) < count and loop.time() < deadline:
+            await asyncio.sleep(0.01)
+
+
+async def _start_daemon(loop):
+    transport, protocol = await loop.create_datagram_endpoint(
+        FakeDaemonProtocol, local_addr=("127.0.0.1", 0)
+    )
+    host, port = transport.get_extra_info("sockname")
+    protocol.address = f"{host}:{port}"
+    return transport, protocol
+
+
+@pytest.fixture()
+async def daemon(event_loop):
+    """A fake X-Ray daemon listening on a local UDP socket."""
+    transport, protocol = await _start_daemon(event_loop)
+    yield protocol
+    transport.close()
+
+
+@pytest.fixture()
+async def other_daemon(event_loop):
+    """Another fake X-Ray daemon, on a different port to `daemon`."""
+    transport, protocol = await _start_daemon(event_loop)
+    yield protocol
+    transport.close()
+
+
+class FakeXRayAPI:
+    """Stand-in for the `PutTraceSegments` API of X-Ray, served over HTTP.
+
+    Each request gets the next response from `responses` (or a success
+    response once that is empty).
+    """
+
+    def __init__(self):
+        #: Status code and error type for each upcoming request.
+        self.responses = deque()
+
+        #: The segment documents in each request, including failed requests.
+        self.requests = []
+
+        #: IDs of the segments to report as unprocessed.
+        self.unprocessed_ids = set()
+
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, args=(0.05,), daemon=True
+        )
+
+        host, port = self._server.server_address
+        self.url = f"http://{host}:{port}"
+
+    @property
+    def batches(self):
+        """The segment documents in each request, parsed from JSON."""
+        with self._lock:
+            return [[json.loads(doc) for doc in docs] for docs in self.requests]
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _respond(self, path: str, body: dict):
+        assert path == "/TraceSegments"
+        documents = body["TraceSegmentDocuments"]
+        with self._lock:
+            self.requests.append(documents)
+            status, error_type = (
+                self.responses.popleft() if self.responses else (200, None)
+            )
+
+        if status != 200:
+            return status, {"__type": error_type, "message": "Fake error"}
+
+        unprocessed = []
+        for document in documents:
+            segment_id = json.loads(document)["id"]
+            if segment_id in self.unprocessed_ids:
+                unprocessed.append(
+                    {"Id": segment_id, "ErrorCode": "Invalid", "Message": "Fake error"}
+                )
+        return 200, {"UnprocessedTraceSegments": unprocessed}
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers["Content-Length"])
+                request_body = json.loads(self.rfile.read(length))
+                status, response = api._respond(self.path, request_body)
+
+                data = json.dumps(response).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/x-amz-json-1.1")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+@pytest.fixture()
+def xray_api(monkeypatch):
+    """A fake X-Ray API, and some fake AWS credentials to call it with."""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "AKIDEXAMPLE")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "fake-secret")
+    monkeypatch.delenv("AWS_SESSION_TOKEN", raising=False)
+
+    api = FakeXRayAPI()
+    api.start()
+    yield api
+    api.stop()
+
+
+@pytest.fixture()
+def name() -> str:
+    """Unique name for a shared memory file, which is removed afterwards.
+
+    Shared memory is only available on POSIX platforms, so tests that use
+    this are skipped elsewhere.
+    """
+    pytest.importorskip("fcntl")
+    from xraysink.shared_memory import SHARED_MEMORY_DIR
+
+    name = f"xraysink-test-{uuid.uuid4().hex[:12]}"
+    yield name
+    with suppress(FileNotFoundError):
+        os.unlink(os.path.join(SHARED_MEMORY_DIR, name))
@@ -0,0 +1,285 @@
+"""Tests for the emitter that sends batches of entities to the X-Ray API."""
+
+import json
+import time
+
+import pytest
+from aws_xray_sdk.core.models.segment import Segment
+
+from xraysink.emitters.api import XRayAPIEmitter
+
+
+@pytest.fixture()
+def make_emitter(xray_api):
+    """Make an emitter that sends to the fake X-Ray API."""
+    emitters = []
+
+    def _make_emitter(**kwargs):
+        kwargs.setdefault("flush_interval", 60)
+        emitter = XRayAPIEmitter(
+            region_name="us-east-1",
+            endpoint_url=xray_api.url,
+            backoff_base=0.001,
+            **kwargs,
+        )
+        emitters.append(emitter)
+        return emitter
+
+    yield _make_emitter
+    for emitter in emitters:
+        emitter.shutdown()
+
+
+def _make_segment(name: str = "test") -> Segment:
+    segment = Segment(name)
+    segment.close()
+    return segment
+
+
+class TestXRayAPIEmitter:
+    def test_should_send_entity_to_api(self, xray_api, make_emitter):
+        # Setup
+        emitter = make_emitter()
+        segment = _make_segment()
+
+        # Exercise
+        emitter.send_entity(segment)
+        emitter.flush(timeout=5)
+
+        # Verify
+        ((document,),) = xray_api.batches
+        assert document["id"] == segment.id
+        assert document["trace_id"] == segment.trace_id
+
+        assert emitter.enqueued == 1
+        assert emitter.sent == 1
+        assert emitter.dropped == 0
+        assert emitter.queue_depth == 0
+        assert emitter.buffer_bytes == 0
+
+    def test_should_send_batches_of_50_documents(self, xray_api, make_emitter):
+        # Setup
+        emitter = make_emitter()
+        segments = [_make_segment(f"segment-{i}") for i in range(120)]
+
+        # Exercise
+        for segment in segments:
+            emitter.send_entity(segment)
+        emitter.flush(timeout=5)
+
+        # Verify
+        assert [len(batch) for batch in xray_api.batches] == [50, 50, 20]
+        assert [doc["name"] for batch in xray_api.batches for doc in batch] == [
+            s.name for s in segments
+        ], "Entities should be sent in order"
+        assert emitter.sent == 120
+
+    def test_should_send_full_batch_without_waiting(self, xray_api, make_emitter):
+        # Setup
+        emitter = make_emitter()
+
+        # Exercise
+        for _ in range(50):
+            emitter.send_entity(_make_segment())
+        _wait_for(lambda: emitter.sent == 50)
+
+        # Verify
+        assert [len(batch) for batch in xray_api.batches] == [50]
+
+    def test_should_limit_size_of_batch(self, xray_api, make_emitter):
+        # Setup
+        document_size = len(_make_segment().serialize())
+        emitter = make_emitter(max_batch_bytes=document_size * 3 + 10)
+
+        # Exercise
+        for _ in range(10):
+            emitter.send_entity(_make_segment())
+        emitter.flush(timeout=5)
+
+        # Verify
+        assert [len(batch) for batch in xray_api.batches] == [3, 3, 3, 1]
+        assert emitter.sent == 10
+
+    def test_should_limit_size_of_batch_in_utf8_bytes(self, xray_api, make_emitter):
+        # Setup
+        def serializer(entity):
+            return json.dumps(
+                {"id": entity.id, "name": entity.name}, ensure_ascii=False
+            )
+
+        name = "☃" * 100
+        document_bytes = len(serializer(_make_segment(name)).encode("utf-8"))
+        emitter = make_emitter(
+            max_batch_bytes=document_bytes * 2 + 10, serializer=serializer
+        )
+
+        # Exercise
+        for _ in range(4):
+            emitter.send_entity(_make_segment(name))
+        emitter.flush(timeout=5)
+
+        # Verify
+        assert [len(batch) for batch in xray_api.batches] == [2, 2]
+        assert emitter.buffer_bytes == 0
+
+    def test_should_send_partial_batch_after_interval(self, xray_api, make_emitter):
+        # Setup
+        emitter = make_emitter(flush_interval=0.1)
+
+        # Exercise
+        for _ in range(3):
+            emitter.send_entity(_make_segment())
+        _wait_for(lambda: emitter.sent == 3)
+
+        # Verify
+        assert [len(batch) for batch in xray_api.batches] == [3]
+
+    @pytest.mark.parametrize(
+        "error", [(500, "InternalFailure"), (429, "ThrottledException")]
+    )
+    def test_should_retry_failed_batch(self, xray_api, make_emitter, error):
+        # Setup
+        emitter = make_emitter()
+        xray_api.responses.extend([error, error])
+        segment = _make_segment()
+
+        # Exercise
+        emitter.send_entity(segment)
+        emitter.flush(timeout=5)
+
+        # Verify
+        assert len(xray_api.requests) == 3
+        assert xray_api.batches[-1][0]["id"] == segment.id
+        assert emitter.sent == 1
+        assert emitter.dropped == 0
+
+    def test_should_give_up_after_max_attempts(self, xray_api, make_emitter):
+        # Setup
+        emitter = make_emitter(max_attempts=3)
+        xray_api.responses.extend([(503, "ServiceUnavailable")] * 5)
+
+        # Exercise
+        emitter.send_entity(_make_segment())
+        emitter.send_entity(_make_segment())
+        emitter.flush(timeout=5)
+
+        # Verify
+        assert len(xray_api.requests) == 3
+        assert emitter.sent == 0
+        assert emitter.dropped == 2
+        assert emitter.buffer_bytes == 0
+
+    def test_should_not_retry_invalid_request(self, xray_api, make_emitter):
+        # Setup
+        emitter = make_emitter()
+        xray_api.responses.append((400, "InvalidRequestException"))
+
+        # Exercise
+        emitter.send_entity(_make_segment())
+        emitter.flush(timeout=5)
+
+        # Verify
+        assert len(xray_api.requests) == 1
+        assert emitter.dropped == 1
+
+    def test_should_count_unprocessed_entities_as_dropped(self, xray_api, make_emitter):
+        # Setup
+        emitter = make_emitter()
+        segments = [_make_segment() for _ in range(3)]
+        xray_api.unprocessed_ids.add(segments[1].id)
+
+        # Exercise
+        for segment in segments:
+            emitter.send_entity(segment)
+        emitter.flush(timeout=5)
+
+        # Verify
+        assert emitter.sent == 2
+        assert emitter.dropped == 1
+
+    def test_should_limit_memory_of_buffered_documents(self, xray_api, make_emitter):
+        # Setup
+        document_size = len(_make_segment().serialize())
+        emitter = make_emitter(max_buffer_bytes=document_size * 5 + 10)
+
+        # Exercise
+        with emitter._condition:
+            # Stop the background thread from sending before the buffer is full
+            for _ in range(20):
+                emitter.send_entity(_make_segment())
+        emitter.flush(timeout=5)
+
+        # Verify
+        assert [len(batch) for batch in xray_api.batches] == [5]
+        assert emitter.sent == 5
+        assert emitter.dropped == 15
+
+    def test_should_limit_number_of_queued_entities(self, xray_api, make_emitter):
+        # Setup
+        emitter = make_emitter(max_queue_size=2)
+
+        # Exercise
+        with emitter._condition:
+            # Stop the background thread from taking entities off the queue
+            for _ in range(5):
+                emitter.send_entity(_make_segment())
+        emitter.flush(timeout=5)
+
+        # Verify
+        assert emitter.enqueued == 2
+        assert emitter.dropped == 3
+
+    def test_should_drop_oversized_entity(self, xray_api, make_emitter):
+        # Setup
+        emitter = make_emitter(max_batch_bytes=100)
+
+        # Exercise
+        emitter.send_entity(_make_segment())
+        emitter.flush(timeout=5)
+
+        # Verify
+        assert xray_api.requests == []
+        assert emitter.dropped == 1
+
+    def test_should_drop_entity_that_fails_to_serialize(self, xray_api, make_emitter):
+        # Setup
+        def _serializer(entity):
+            raise ValueError("Can't serialise")
+
+        emitter = make_emitter(serializer=_serializer)
+
+        # Exercise
+        emitter.send_entity(_make_segment())
+        emitter.flush(timeout=5)
+
+        # Verify
+        assert xray_api.requests == []
+        assert emitter.dropped == 1
+
+    @pytest.mark.asyncio()
+    async def test_should_send_buffered_entities_when_closed(
+        self, xray_api, make_emitter, recorder
+    ):
+        # Setup
+        emitter = make_emitter()
+        recorder.configure(emitter=emitter)
+
+        # Exercise
+        async with recorder.in_segment_async(
+            "recorded-segment"
+        ), recorder.in_subsegment_async("recorded-subsegment"):
+            pass
+        await emitter.close()
+
+        # Verify
+        ((document,),) = xray_api.batches
+        assert document["name"] == "recorded-segment"
+        assert document["subsegments"][0]["name"] == "recorded-subsegment"
+
+
+def _wait_for(predicate, timeout: float = 5):
+    """Wait until a condition is true, or fail the test."""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "Timed out waiting for condition"
+        time.sleep(0.01)
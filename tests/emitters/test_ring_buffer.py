@@ -0,0 +1,219 @@
+"""Tests for the emitter that writes entities to a shared ring buffer."""
+
+import asyncio
+import json
+import multiprocessing
+import time
+
+import pytest
+from aws_xray_sdk.core.models.segment import Segment
+
+# Shared memory is only available on POSIX platforms
+pytest.importorskip("fcntl")
+
+from xraysink.emitters.ring_buffer import DEFAULT_MAX_SEND_RATE  # noqa: E402
+from xraysink.emitters.ring_buffer import SharedRingBufferCollector  # noqa: E402
+from xraysink.emitters.ring_buffer import SharedRingBufferEmitter  # noqa: E402
+
+pytestmark = pytest.mark.asyncio
+
+
+class _DocumentList(list):
+    """Sender for a collector, which keeps the documents it is sent."""
+
+    def __call__(self, documents):
+        self.extend(json.loads(document) for document in documents)
+
+    @property
+    def names(self):
+        return [document["name"] for document in self]
+
+
+def _make_segment(name: str = "test") -> Segment:
+    segment = Segment(name)
+    segment.close()
+    return segment
+
+
+def _emit_segments(emitter: SharedRingBufferEmitter, writer: int, count: int):
+    """Emit some segments from a worker process."""
+    for i in range(count):
+        emitter.send_entity(_make_segment(f"writer-{writer}-{i}"))
+    emitter.shutdown()
+
+
+class TestSharedRingBufferEmitter:
+    async def test_should_send_entity_to_daemon(self, daemon, name):
+        # Setup
+        emitter = SharedRingBufferEmitter(name, ring_count=4, ring_size=4096)
+        collector = SharedRingBufferCollector(name, daemon.address)
+        collector.start()
+        segment = _make_segment()
+
+        # Exercise
+        emitter.send_entity(segment)
+        await daemon.wait_for_datagrams(1)
+        await collector.close()
+
+        # Verify
+        (document,) = daemon.documents
+        assert document["id"] == segment.id
+        assert document["trace_id"] == segment.trace_id
+
+        assert emitter.enqueued == 1
+        assert emitter.dropped == 0
+        assert collector.received == 1
+        assert collector.sent == 1
+        assert collector.dropped == 0
+
+    async def test_should_limit_send_rate(self, daemon, name):
+        # Setup
+        emitter = SharedRingBufferEmitter(name, ring_count=1, ring_size=64 * 1024)
+        collector = SharedRingBufferCollector(name, daemon.address, max_send_rate=1000)
+        for _ in range(100):
+            emitter.send_entity(_make_segment())
+
+        # Exercise
+        start = time.perf_counter()
+        await asyncio.get_running_loop().run_in_executor(None, collector.drain)
+        elapsed = time.perf_counter() - start
+
+        # Verify
+        await daemon.wait_for_datagrams(100)
+        assert len(daemon.datagrams) == 100
+        assert collector.sent == 100
+
+        # The first burst is sent straight away
+        assert elapsed >= 0.06
+
+    async def test_should_limit_send_rate_by_default(self, daemon, name):
+        # Setup
+        emitter = SharedRingBufferEmitter(name, ring_count=1, ring_size=64 * 1024)
+        collector = SharedRingBufferCollector(name, daemon.address)
+        for _ in range(100):
+            emitter.send_entity(_make_segment())
+
+        # Exercise
+        start = time.perf_counter()
+        await asyncio.get_running_loop().run_in_executor(None, collector.drain)
+        elapsed = time.perf_counter() - start
+
+        # Verify
+        await daemon.wait_for_datagrams(100)
+        assert collector.sent == 100
+        assert elapsed >= 90 / DEFAULT_MAX_SEND_RATE
+
+    async def test_should_drop_entity_when_ring_is_full(self, name):
+        # Setup
+        emitter = SharedRingBufferEmitter(name, ring_count=4, ring_size=4096)
+        documents = _DocumentList()
+        collector = SharedRingBufferCollector(name, sender=documents)
+
+        # Exercise
+        for i in range(100):
+            emitter.send_entity(_make_segment(f"segment-{i}"))
+        collector.drain()
+
+        # Verify
+        assert emitter.dropped > 0
+        assert emitter.enqueued + emitter.dropped == 100
+        assert collector.overflowed == emitter.dropped
+        assert collector.dropped == emitter.dropped
+        assert documents.names == [f"segment-{i}" for i in range(emitter.enqueued)]
+
+    async def test_should_keep_documents_intact_when_ring_wraps(self, name):
+        # Setup
+        emitter = SharedRingBufferEmitter(name, ring_count=1, ring_size=1000)
+        documents = _DocumentList()
+        collector = SharedRingBufferCollector(name, sender=documents)
+
+        # Exercise
+        for i in range(200):
+            emitter.send_entity(_make_segment(f"segment-{i}"))
+            if i % 2:
+                collector.drain()
+
+        # Verify
+        assert emitter.dropped == 0
+        assert documents.names == [f"segment-{i}" for i in range(200)]
+
+    async def test_should_use_geometry_of_existing_buffer(self, name):
+        # Setup
+        SharedRingBufferCollector(name, ring_count=2, ring_size=1000)
+
+        # Exercise
+        emitter = SharedRingBufferEmitter(name)
+
+        # Verify
+        assert emitter.buffer.ring_count == 2
+        assert emitter.buffer.ring_size == 1000
+
+    async def test_should_use_separate_ring_for_each_emitter(self, name):
+        # Setup
+        emitters = [
+            SharedRingBufferEmitter(name, ring_count=2, ring_size=4096)
+            for _ in range(3)
+        ]
+
+        # Exercise
+        for emitter in emitters:
+            emitter.send_entity(_make_segment())
+        emitters[0].shutdown()
+        late_emitter = SharedRingBufferEmitter(name)
+        late_emitter.send_entity(_make_segment())
+
+        # Verify
+        assert [emitter.enqueued for emitter in emitters] == [1, 1, 0]
+        assert [emitter.dropped for emitter in emitters] == [0, 0, 1]
+        assert late_emitter.enqueued == 1
+        assert late_emitter.buffer.written == 3
+
+    async def test_should_count_documents_that_fail_to_send(self, name):
+        # Setup
+        def _sender(documents):
+            raise OSError("Fake error")
+
+        emitter = SharedRingBufferEmitter(name, ring_count=1, ring_size=4096)
+        collector = SharedRingBufferCollector(name, sender=_sender)
+        emitter.send_entity(_make_segment())
+
+        # Exercise
+        collector.drain()
+
+        # Verify
+        assert collector.received == 1
+        assert collector.sent == 0
+        assert collector.dropped == 1
+
+    async def test_should_collect_from_many_processes(self, name):
+        # Setup
+        writer_count = 4
+        segment_count = 200
+        # Big enough for everything, even if the collector doesn't keep up
+        emitter = SharedRingBufferEmitter(name, ring_count=8, ring_size=512 * 1024)
+        documents = _DocumentList()
+        collector = SharedRingBufferCollector(name, sender=documents)
+        context = multiprocessing.get_context("fork")
+        writers = [
+            context.Process(target=_emit_segments, args=(emitter, i, segment_count))
+            for i in range(writer_count)
+        ]
+
+        # Exercise
+        for writer in writers:
+            writer.start()
+        collector.start()
+        for writer in writers:
+            writer.join()
+        collector.shutdown()
+
+        # Verify
+        assert [writer.exitcode for writer in writers] == [0] * writer_count
+        assert collector.buffer.written == writer_count * segment_count
+        assert collector.dropped == 0
+        assert collector.sent == writer_count * segment_count
+
+        for i in range(writer_count):
+            prefix = f"writer-{i}-"
+            names = [n for n in documents.names if n.startswith(prefix)]
+            assert names == [f"{prefix}{j}" for j in range(segment_count)]
@@ -0,0 +1,182 @@
+"""Tests for serialising X-Ray entities."""
+
+import traceback
+
+import pytest
+from aws_xray_sdk.core.models.segment import Segment
+from aws_xray_sdk.core.models.subsegment import Subsegment
+from aws_xray_sdk.core.models.trace_header import TraceHeader
+
+from xraysink.emitters import serialization
+from xraysink.emitters.serialization import serialize_entity
+
+
+class _Payload:
+    def __init__(self):
+        self.count = 3
+        self.tags = {"a", "b"}
+        self._private = "hidden"
+
+
+def _raise_error():
+    raise ValueError("Something bad happened: ☃")
+
+
+def _make_segment() -> Segment:
+    segment = Segment("my-service", traceid="1-5759e988-bd862e3fe1be46a994272793")
+    segment.save_origin_trace_header(TraceHeader(root=segment.trace_id, sampled=1))
+    segment.set_user("alice")
+    segment.set_service({"runtime": "CPython", "version": "3.11"})
+    segment.put_http_meta("url", "https://example.com/users/é")
+    segment.put_http_meta("method", "GET")
+    segment.put_http_meta("status", 200)
+    segment.put_annotation("count", 12)
+    segment.put_annotation("ratio", 0.25)
+    segment.put_annotation("enabled", False)
+    segment.put_metadata("payload", _Payload(), "custom")
+    segment.put_metadata("items", [1, 2.5, None, "x"])
+    return segment
+
+
+def _add_subsegment(parent, name: str) -> Subsegment:
+    segment = parent if isinstance(parent, Segment) else parent.parent_segment
+    subsegment = Subsegment(name, "remote", segment)
+    parent.add_subsegment(subsegment)
+    return subsegment
+
+
+def _add_exception(entity):
+    try:
+        _raise_error()
+    except ValueError as exc:
+        entity.add_exception(exc, traceback.extract_tb(exc.__traceback__))
+
+
+class TestSerializeEntity:
+    def test_should_serialize_empty_segment(self):
+        # Setup
+        segment = Segment("test")
+        segment.close()
+
+        # Exercise
+        result = serialize_entity(segment)
+
+        # Verify
+        assert result == segment.serialize()
+
+    def test_should_serialize_segment_details(self):
+        # Setup
+        segment = _make_segment()
+        segment.close()
+
+        # Exercise
+        result = serialize_entity(segment)
+
+        # Verify
+        assert result == segment.serialize()
+
+    def test_should_serialize_in_progress_segment(self):
+        # Setup
+        segment = _make_segment()
+
+        # Exercise
+        result = serialize_entity(segment)
+
+        # Verify
+        assert '"in_progress": true' in result
+        assert result == segment.serialize()
+
+    def test_should_serialize_nested_subsegments(self):
+        # Setup
+        segment = _make_segment()
+        for i in range(3):
+            subsegment = _add_subsegment(segment, f"child-{i}")
+            subsegment.namespace = "aws"
+            subsegment.put_annotation("index", i)
+            nested = _add_subsegment(subsegment, f"query-{i}")
+            nested.set_sql({"url": "postgresql://localhost/db", "sanitized_query": "?"})
+            nested.close()
+            subsegment.close()
+        segment.close()
+
+        # Exercise
+        result = serialize_entity(segment)
+
+        # Verify
+        assert result == segment.serialize()
+
+    def test_should_serialize_without_c_encoder(self, monkeypatch):
+        # Setup
+        monkeypatch.setattr(serialization, "_encode", serialization._make_encoder(None))
+        segment = _make_segment()
+        subsegment = _add_subsegment(segment, "child")
+        _add_exception(subsegment)
+        subsegment.close()
+        segment.close()
+
+        # Exercise
+        result = serialize_entity(segment)
+
+        # Verify
+        assert result == segment.serialize()
+
+    def test_should_serialize_subsegment(self):
+        # Setup
+        segment = _make_segment()
+        subsegment = _add_subsegment(segment, "child")
+        _add_subsegment(subsegment, "nested").close()
+        subsegment.close()
+
+        # Exercise
+        result = serialize_entity(subsegment)
+
+        # Verify
+        assert result == subsegment.serialize()
+
+    @pytest.mark.parametrize("remote", [False, True])
+    def test_should_serialize_exceptions(self, remote):
+        # Setup
+        segment = _make_segment()
+        subsegment = _add_subsegment(segment, "child")
+        subsegment.add_throttle_flag()
+        _add_exception(subsegment)
+        if remote:
+            # The parent just references the exception recorded by the child
+            _add_exception(segment)
+        subsegment.close()
+        segment.close()
+
+        # Exercise
+        result = serialize_entity(segment)
+
+        # Verify
+        assert result == segment.serialize()
+
+    def test_should_use_overridden_serialize_method(self):
+        # Setup
+        class CustomSegment(Segment):
+            def serialize(self):
+                return "custom"
+
+        segment = CustomSegment("test")
+
+        # Exercise
+        result = serialize_entity(segment)
+
+        # Verify
+        assert result == "custom"
+
+    def test_should_use_overridden_to_dict_method(self):
+        # Setup
+        class CustomSegment(Segment):
+            def to_dict(self):
+                return {**super().to_dict(), "custom": True}
+
+        segment = CustomSegment("test")
+        segment.add_subsegment(Subsegment("child", "local", segment))
+
+        # Exercise
+        result = serialize_entity(segment)
+
+        # Verify
+        assert result == segment.serialize()
@@ -0,0 +1,229 @@
+"""Tests for the emitter that sends entities from worker threads."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+from aws_xray_sdk.core.models.segment import Segment
+from aws_xray_sdk.core.models.subsegment import Subsegment
+
+from xraysink.emitters.threaded import ThreadPoolUDPEmitter
+from xraysink.emitters.udp import AsyncUDPEmitter
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture()
+async def emitter(daemon):
+    emitter = ThreadPoolUDPEmitter(daemon.address, workers=3)
+    yield emitter
+    await emitter.close()
+
+
+def _make_segment(name: str = "test", subsegment_count: int = 0) -> Segment:
+    segment = Segment(name)
+    for i in range(subsegment_count):
+        subsegment = Subsegment(f"child-{i}", "local", segment)
+        segment.add_subsegment(subsegment)
+        subsegment.close()
+    segment.close()
+    return segment
+
+
+def _make_subsegment(segment: Segment, name: str) -> Subsegment:
+    subsegment = Subsegment(name, "local", segment)
+    subsegment.close()
+    return subsegment
+
+
+async def _measure_loop_lag(emitter, segments) -> float:
+    """Emit a burst of segments, and return the longest time the loop was blocked."""
+    max_lag = 0.0
+    done = False
+
+    async def _tick():
+        nonlocal max_lag
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0)
+            now = time.perf_counter()
+            max_lag = max(max_lag, now - last)
+            last = now
+
+    ticker = asyncio.ensure_future(_tick())
+    await asyncio.sleep(0)
+
+    for segment in segments:
+        emitter.send_entity(segment)
+    await emitter.drain()
+
+    done = True
+    await ticker
+    return max_lag
+
+
+class TestThreadPoolUDPEmitter:
+    async def test_should_send_entity_to_daemon(self, daemon, emitter):
+        # Setup
+        segment = _make_segment()
+
+        # Exercise
+        emitter.send_entity(segment)
+        await emitter.drain()
+        await asyncio.wait_for(daemon.received.wait(), timeout=1)
+
+        # Verify
+        (document,) = daemon.documents
+        assert document["id"] == segment.id
+        assert document["trace_id"] == segment.trace_id
+
+        assert emitter.enqueued == 1
+        assert emitter.sent == 1
+        assert emitter.dropped == 0
+
+    async def test_should_serialize_in_worker_thread(self, daemon):
+        # Setup
+        threads = []
+
+        def _serializer(entity):
+            threads.append(threading.current_thread())
+            return entity.serialize()
+
+        emitter = ThreadPoolUDPEmitter(daemon.address, serializer=_serializer)
+
+        # Exercise
+        emitter.send_entity(_make_segment())
+        await emitter.close()
+
+        # Verify
+        assert emitter.sent == 1
+        assert threads
+        assert threading.current_thread() not in threads
+
+    async def test_should_keep_entities_for_trace_in_order(self, daemon, emitter):
+        # Setup
+        segments = [_make_segment(f"segment-{i}") for i in range(10)]
+        entities = []
+        for segment in segments:
+            entities.extend(
+                _make_subsegment(segment, f"{segment.name}-{i}") for i in range(5)
+            )
+            entities.append(segment)
+
+        # Exercise
+        for entity in entities:
+            emitter.send_entity(entity)
+        await emitter.drain()
+        await daemon.wait_for_datagrams(len(entities))
+
+        # Verify
+        assert emitter.sent == len(entities)
+        for segment in segments:
+            names = [
+                doc["name"]
+                for doc in daemon.documents
+                if doc["trace_id"] == segment.trace_id
+            ]
+            assert names == [f"{segment.name}-{i}" for i in range(5)] + [
+                segment.name
+            ], "Entities for a trace should be sent in order"
+
+    async def test_should_drop_entities_when_queue_is_full(self, daemon):
+        # Setup
+        emitter = ThreadPoolUDPEmitter(daemon.address, workers=1, max_queue_size=3)
+        release = threading.Event()
+
+        def _serializer(entity):
+            release.wait(timeout=1)
+            return entity.serialize()
+
+        emitter._serializer = _serializer
+
+        # Exercise
+        emitter.send_entity(_make_segment())
+        await asyncio.sleep(0.05)  # First entity is being sent
+        for _ in range(5):
+            emitter.send_entity(_make_segment())
+        release.set()
+        await emitter.close()
+
+        # Verify
+        assert emitter.enqueued == 4
+        assert emitter.dropped == 2
+        assert emitter.sent == 4
+
+    async def test_should_count_failed_entities_as_dropped(self, daemon, emitter):
+        # Setup
+        def _serializer(entity):
+            raise ValueError("Can't serialise")
+
+        emitter._serializer = _serializer
+
+        # Exercise
+        emitter.send_entity(_make_segment())
+        await emitter.drain()
+
+        # Verify
+        assert emitter.dropped == 1
+        assert emitter.sent == 0
+
+    async def test_should_restart_workers_after_close(self, daemon, emitter):
+        # Setup
+        emitter.send_entity(_make_segment())
+        await emitter.close()
+
+        # Exercise
+        emitter.send_entity(_make_segment())
+        await emitter.drain()
+
+        # Verify
+        assert emitter.sent == 2
+
+    async def test_should_reject_no_workers(self):
+        # Exercise / Verify
+        with pytest.raises(ValueError, match="at least one worker"):
+            ThreadPoolUDPEmitter(workers=0)
+
+    async def test_should_send_segment_from_recorder(self, daemon, emitter, recorder):
+        # Setup
+        recorder.configure(emitter=emitter)
+
+        # Exercise
+        async with recorder.in_segment_async(
+            "recorded-segment"
+        ), recorder.in_subsegment_async("recorded-subsegment"):
+            pass
+        await emitter.drain()
+        await daemon.wait_for_datagrams(1)
+
+        # Verify
+        (document,) = daemon.documents
+        assert document["name"] == "recorded-segment"
+        assert document["subsegments"][0]["name"] == "recorded-subsegment"
+
+    async def test_should_reduce_event_loop_lag(self, daemon):
+        # Setup
+        segment_count = 50
+        inline_emitter = AsyncUDPEmitter(daemon.address)
+        threaded_emitter = ThreadPoolUDPEmitter(daemon.address)
+
+        # Exercise
+        inline_lag = await _measure_loop_lag(
+            inline_emitter,
+            [_make_segment(subsegment_count=150) for _ in range(segment_count)],
+        )
+        threaded_lag = await _measure_loop_lag(
+            threaded_emitter,
+            [_make_segment(subsegment_count=150) for _ in range(segment_count)],
+        )
+        await inline_emitter.close()
+        await threaded_emitter.close()
+
+        # Verify
+        assert inline_emitter.sent == segment_count
+        assert threaded_emitter.sent == segment_count
+        assert threaded_lag < inline_lag / 2, (
+            f"Event loop was blocked for {threaded_lag * 1000:.1f}ms with worker"
+            f" threads, and {inline_lag * 1000:.1f}ms inline"
+        )
@@ -0,0 +1,184 @@
+"""Tests for the non-blocking UDP emitter."""
+
+import asyncio
+import json
+import socket
+
+import pytest
+from aws_xray_sdk.core.models.segment import Segment
+
+from xraysink.emitters.udp import AsyncUDPEmitter
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture()
+async def emitter(daemon):
+    emitter = AsyncUDPEmitter(daemon.address)
+    yield emitter
+    await emitter.close()
+
+
+def _make_segment(name: str = "test") -> Segment:
+    segment = Segment(name)
+    segment.close()
+    return segment
+
+
+class TestAsyncUDPEmitter:
+    async def test_should_send_entity_to_daemon(self, daemon, emitter):
+        # Setup
+        segment = _make_segment()
+
+        # Exercise
+        emitter.send_entity(segment)
+        await asyncio.wait_for(daemon.received.wait(), timeout=1)
+
+        # Verify
+        (document,) = daemon.documents
+        assert document["id"] == segment.id
+        assert document["trace_id"] == segment.trace_id
+
+        assert emitter.enqueued == 1
+        assert emitter.sent == 1
+        assert emitter.dropped == 0
+
+    async def test_should_not_send_inline(self, daemon, emitter):
+        # Exercise
+        emitter.send_entity(_make_segment())
+
+        # Verify
+        assert emitter.enqueued == 1
+        assert emitter.sent == 0, "Entity should only be sent by background task"
+        assert emitter.queue_depth == 1
+
+        await emitter.drain()
+        assert emitter.sent == 1
+        assert emitter.queue_depth == 0
+
+    async def test_should_drop_entities_when_queue_is_full(self, daemon):
+        # Setup
+        emitter = AsyncUDPEmitter(daemon.address, max_queue_size=3)
+
+        # Exercise
+        for _ in range(5):
+            emitter.send_entity(_make_segment())
+        await emitter.close()
+
+        # Verify
+        assert emitter.enqueued == 3
+        assert emitter.dropped == 2
+        assert emitter.sent == 3
+
+    async def test_should_send_all_queued_entities_when_drained(self, daemon, emitter):
+        # Setup
+        segments = [_make_segment(f"segment-{i}") for i in range(120)]
+
+        # Exercise
+        for segment in segments:
+            emitter.send_entity(segment)
+        await emitter.drain()
+
+        # Verify
+        assert emitter.sent == len(segments)
+        for _ in range(10):
+            if len(daemon.datagrams) == len(segments):
+                break
+            await asyncio.sleep(0.05)
+
+        assert [doc["name"] for doc in daemon.documents] == [
+            s.name for s in segments
+        ], "Entities should be sent in order"
+
+    async def test_should_send_entities_emitted_outside_event_loop(self, daemon):
+        # Setup
+        emitter = AsyncUDPEmitter(daemon.address)
+
+        # Exercise
+        await asyncio.get_running_loop().run_in_executor(
+            None, emitter.send_entity, _make_segment()
+        )
+        await emitter.close()
+
+        # Verify
+        assert emitter.sent == 1
+
+    async def test_should_send_to_new_daemon_address(
+        self, daemon, other_daemon, emitter
+    ):
+        # Setup
+        emitter.send_entity(_make_segment("before"))
+        await emitter.drain()
+        await asyncio.wait_for(daemon.received.wait(), timeout=1)
+
+        # Exercise
+        emitter.set_daemon_address(other_daemon.address)
+        emitter.send_entity(_make_segment("after"))
+        await emitter.drain()
+        await asyncio.wait_for(other_daemon.received.wait(), timeout=1)
+
+        # Verify
+        assert emitter.port == int(other_daemon.address.split(":")[1])
+        assert [doc["name"] for doc in daemon.documents] == ["before"]
+        assert [doc["name"] for doc in other_daemon.documents] == ["after"]
+
+    async def test_should_send_segment_from_recorder(self, daemon, emitter, recorder):
+        # Setup
+        recorder.configure(emitter=emitter)
+
+        # Exercise
+        async with recorder.in_segment_async(
+            "recorded-segment"
+        ), recorder.in_subsegment_async("recorded-subsegment"):
+            pass
+        await emitter.drain()
+        await asyncio.wait_for(daemon.received.wait(), timeout=1)
+
+        # Verify
+        (document,) = daemon.documents
+        assert document["name"] == "recorded-segment"
+        assert document["subsegments"][0]["name"] == "recorded-subsegment"
+
+    async def test_should_use_custom_serializer(self, daemon):
+        # Setup
+        emitter = AsyncUDPEmitter(
+            daemon.address, serializer=lambda entity: f'{{"name": "{entity.name}!"}}'
+        )
+
+        # Exercise
+        emitter.send_entity(_make_segment())
+        await emitter.close()
+        await asyncio.wait_for(daemon.received.wait(), timeout=1)
+
+        # Verify
+        assert daemon.documents == [{"name": "test!"}]
+
+    def test_should_send_entities_from_successive_event_loops(self):
+        # Setup
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(("127.0.0.1", 0))
+        receiver.settimeout(1)
+        emitter = AsyncUDPEmitter("127.0.0.1:%d" % receiver.getsockname()[1])
+
+        async def send(name: str):
+            emitter.send_entity(_make_segment(name))
+            await emitter.drain()
+
+        try:
+            # Exercise
+            asyncio.run(send("first"))
+            emitter.send_entity(_make_segment("between"))
+            asyncio.run(send("second"))
+            asyncio.run(emitter.close())
+
+            # Verify
+            names = [
+                json.loads(receiver.recv(65536).split(b"\n", 1)[1])["name"]
+                for _ in range(3)
+            ]
+        finally:
+            receiver.close()
+
+        assert names == ["first", "between", "second"]
+        assert emitter.sent == 3
+        assert emitter.dropped == 0
@@ -0,0 +1,23 @@
+"""Fixtures for the sampler tests."""
+
+import os
+import uuid
+from contextlib import suppress
+
+import pytest
+
+
+@pytest.fixture()
+def name() -> str:
+    """Unique name for a shared memory file, which is removed afterwards.
+
+    Shared memory is only available on POSIX platforms, so tests that use
+    this are skipped elsewhere.
+    """
+    pytest.importorskip("fcntl")
+    from xraysink.shared_memory import SHARED_MEMORY_DIR
+
+    name = f"xraysink-test-{uuid.uuid4().hex[:12]}"
+    yield name
+    with suppress(FileNotFoundError):
+        os.unlink(os.path.join(SHARED_MEMORY_DIR, name))
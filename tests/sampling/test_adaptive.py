@@ -0,0 +1,201 @@
+"""Tests for the sampler that backs off while the process is under pressure."""
+
+import asyncio
+import gc
+import time
+import weakref
+
+import pytest
+
+from xraysink.sampling.adaptive import AdaptiveSampler
+
+
+class _Sampler:
+    """Sampler that always makes the same decision."""
+
+    def __init__(self, decision=True):
+        self.decision = decision
+        self.rules = None
+
+    def should_trace(self, sampling_req=None):
+        return self.decision
+
+    def load_local_rules(self, rules):
+        self.rules = rules
+
+
+class _Emitter:
+    queue_depth = 0
+    dropped = 0
+
+
+@pytest.fixture()
+def emitter():
+    return _Emitter()
+
+
+def _run_interval(sampler: AdaptiveSampler, clock, count: int = 100) -> int:
+    """Make some sampling decisions, then move on to the next interval."""
+    decisions = [sampler.should_trace() for _ in range(count)]
+    clock.now += 1
+    sampler.should_trace()
+    return sum(1 for decision in decisions if decision)
+
+
+class TestAdaptiveSampler:
+    def test_should_keep_every_trace_without_pressure(self, clock, emitter):
+        # Setup
+        sampler = AdaptiveSampler(_Sampler(), emitter=emitter)
+
+        # Exercise
+        sampled = [_run_interval(sampler, clock) for _ in range(3)]
+
+        # Verify
+        assert sampled == [100, 100, 100]
+        assert sampler.fraction == 1.0
+
+    def test_should_return_decision_of_wrapped_sampler(self, clock):
+        # Setup
+        sampler = AdaptiveSampler(_Sampler("my-rule"))
+        unsampled = AdaptiveSampler(_Sampler(False))
+
+        # Exercise
+        decision = sampler.should_trace({"path": "/"})
+        unsampled_decision = unsampled.should_trace({"path": "/"})
+
+        # Verify
+        assert decision == "my-rule"
+        assert unsampled_decision is False
+
+    def test_should_back_off_when_emitter_drops_entities(self, clock, emitter):
+        # Setup
+        sampler = AdaptiveSampler(_Sampler(), emitter=emitter)
+
+        # Exercise
+        emitter.dropped = 10
+        _run_interval(sampler, clock)
+        first = sampler.fraction
+        emitter.dropped = 20
+        _run_interval(sampler, clock)
+        second = sampler.fraction
+
+        # Verify
+        assert first == 0.5
+        assert second == 0.25
+
+    def test_should_back_off_when_emitter_queue_is_deep(self, clock, emitter):
+        # Setup
+        sampler = AdaptiveSampler(_Sampler(), emitter=emitter, max_queue_depth=10)
+
+        # Exercise
+        emitter.queue_depth = 11
+        _run_interval(sampler, clock)
+
+        # Verify
+        assert sampler.fraction == 0.5
+        sampled = _run_interval(sampler, clock, count=1000)
+        assert 350 < sampled < 650
+
+    def test_should_not_back_off_below_min_fraction(self, clock, emitter):
+        # Setup
+        sampler = AdaptiveSampler(_Sampler(), emitter=emitter, min_fraction=0.1)
+
+        # Exercise
+        for i in range(10):
+            emitter.dropped = i + 1
+            _run_interval(sampler, clock)
+
+        # Verify
+        assert sampler.fraction == 0.1
+
+    def test_should_recover_gradually_once_pressure_ends(self, clock, emitter):
+        # Setup
+        sampler = AdaptiveSampler(_Sampler(), emitter=emitter, recovery_step=0.25)
+        emitter.queue_depth = 1000
+        _run_interval(sampler, clock)
+        _run_interval(sampler, clock)
+        emitter.queue_depth = 0
+
+        # Exercise
+        fractions = []
+        for _ in range(4):
+            _run_interval(sampler, clock)
+            fractions.append(sampler.fraction)
+
+        # Verify
+        assert fractions == [0.5, 0.75, 1.0, 1.0]
+
+    def test_should_keep_traces_per_second_under_budget(self, clock):
+        # Setup
+        sampler = AdaptiveSampler(_Sampler(), max_traces_per_sec=100)
+
+        # Exercise
+        _run_interval(sampler, clock, count=1000)
+        sampled = _run_interval(sampler, clock, count=1000)
+
+        # Verify
+        assert sampler.fraction == pytest.approx(0.1, rel=0.01)
+        assert 50 < sampled < 150
+
+    @pytest.mark.asyncio()
+    async def test_should_back_off_when_event_loop_lags(self):
+        # Setup
+        sampler = AdaptiveSampler(_Sampler(), max_loop_lag=0.05, adjust_interval=0.2)
+        while sampler._monitor is None:
+            sampler.should_trace()
+            await asyncio.sleep(0.05)
+        assert sampler.fraction == 1.0
+
+        # Exercise
+        time.sleep(0.3)
+        await asyncio.sleep(0)
+        sampler.should_trace()
+
+        # Verify
+        assert sampler.loop_lag > 0.05
+        assert sampler.fraction == 0.5
+
+    @pytest.mark.asyncio()
+    async def test_should_stop_monitoring_loop_lag_when_closed(self):
+        # Setup
+        sampler = AdaptiveSampler(_Sampler(), adjust_interval=0)
+        sampler.should_trace()
+        monitor = sampler._monitor
+        await asyncio.sleep(0.15)
+        due = monitor._due
+
+        # Exercise
+        sampler.close()
+        await asyncio.sleep(0.15)
+
+        # Verify
+        assert monitor.stopped
+        assert monitor._due == due, "Should not probe the loop again"
+
+    @pytest.mark.asyncio()
+    async def test_should_stop_monitoring_loop_lag_once_discarded(self):
+        # Setup
+        sampler = AdaptiveSampler(_Sampler(), adjust_interval=0)
+        sampler.should_trace()
+        monitor_ref = weakref.ref(sampler._monitor)
+        await asyncio.sleep(0.15)
+
+        # Exercise
+        del sampler
+        gc.collect()
+        await asyncio.sleep(0.15)
+
+        # Verify
+        assert monitor_ref() is None, "The loop should not keep the monitor"
+
+    def test_should_pass_rules_to_wrapped_sampler(self):
+        # Setup
+        wrapped = _Sampler()
+        sampler = AdaptiveSampler(wrapped)
+        rules = {"version": 2, "rules": [], "default": {}}
+
+        # Exercise
+        sampler.load_local_rules(rules)
+
+        # Verify
+        assert wrapped.rules is rules
@@ -0,0 +1,198 @@
+"""Tests for the indexed sampling rule cache."""
+
+import random
+import time
+
+import pytest
+from aws_xray_sdk.core.sampling.rule_cache import RuleCache
+from aws_xray_sdk.core.sampling.sampling_rule import SamplingRule
+
+from xraysink.sampling.rule_index import IndexedRuleCache
+from xraysink.sampling.rule_index import IndexedSampler
+
+
+def _make_rule(name, priority, path="*", host="*", method="*", rate=0.0):
+    return SamplingRule(
+        name=name,
+        priority=priority,
+        rate=rate,
+        reservoir_size=0,
+        host=host,
+        method=method,
+        path=path,
+        service="*",
+        service_type="*",
+    )
+
+
+def _make_default_rule(rate=0.0):
+    return _make_rule("Default", 10000, rate=rate)
+
+
+def _load(cache, rules):
+    cache.load_rules(rules)
+    cache.last_updated = int(time.time())
+
+
+def _sampling_req(path, host="example.com", method="GET"):
+    return {
+        "host": host,
+        "method": method,
+        "path": path,
+        "service": "test",
+        "service_type": None,
+    }
+
+
+class TestIndexedRuleCache:
+    def test_should_match_first_rule_by_priority(self):
+        # Setup
+        cache = IndexedRuleCache()
+        _load(
+            cache,
+            [
+                _make_default_rule(),
+                _make_rule("users", 20, path="/users/*"),
+                _make_rule("user-detail", 10, path="/users/*/detail"),
+                _make_rule("everything", 30, path="*"),
+            ],
+        )
+
+        # Exercise
+        matched_rule = cache.get_matched_rule(
+            _sampling_req("/users/123/detail"), int(time.time())
+        )
+
+        # Verify
+        assert matched_rule.name == "user-detail"
+
+    def test_should_match_case_insensitive_path(self):
+        # Setup
+        cache = IndexedRuleCache()
+        _load(cache, [_make_default_rule(), _make_rule("users", 10, path="/Users/*")])
+
+        # Exercise
+        matched_rule = cache.get_matched_rule(
+            _sampling_req("/uSERS/123"), int(time.time())
+        )
+
+        # Verify
+        assert matched_rule.name == "users"
+
+    def test_should_fallback_to_default_rule(self):
+        # Setup
+        cache = IndexedRuleCache()
+        _load(cache, [_make_default_rule(), _make_rule("users", 10, path="/users")])
+
+        # Exercise
+        matched_rule = cache.get_matched_rule(
+            _sampling_req("/orders"), int(time.time())
+        )
+
+        # Verify
+        assert matched_rule.is_default()
+
+    def test_should_not_match_when_rules_have_expired(self):
+        # Setup
+        cache = IndexedRuleCache()
+        _load(cache, [_make_default_rule()])
+
+        # Exercise
+        matched_rule = cache.get_matched_rule(
+            _sampling_req("/"), int(time.time()) + 2 * 60 * 60
+        )
+
+        # Verify
+        assert matched_rule is None
+
+    def test_should_use_new_rules_after_refresh(self):
+        # Setup
+        cache = IndexedRuleCache()
+        _load(cache, [_make_default_rule(), _make_rule("old", 10, path="/users")])
+        now = int(time.time())
+        assert cache.get_matched_rule(_sampling_req("/users"), now).name == "old"
+
+        # Exercise
+        _load(cache, [_make_default_rule(), _make_rule("new", 10, path="/users")])
+
+        # Verify
+        assert cache.get_matched_rule(_sampling_req("/users"), now).name == "new"
+
+    @pytest.mark.parametrize("seed", range(5))
+    def test_should_match_same_rule_as_sdk(self, seed):
+        # Setup
+        rng = random.Random(seed)
+        segments = ["api", "users", "orders", "v1", "v2", "health", "Items"]
+
+        def random_path(wildcards: bool) -> str:
+            parts = []
+            for _ in range(rng.randint(0, 4)):
+                if wildcards and rng.random() < 0.2:
+                    parts.append(rng.choice(["*", "?", "u*s", "*s"]))
+                else:
+                    parts.append(rng.choice(segments))
+            return "/" + "/".join(parts)
+
+        rules = [_make_default_rule()]
+        for i in range(200):
+            rules.append(
+                _make_rule(
+                    f"rule-{i}",
+                    rng.randint(1, 50),
+                    path=random_path(wildcards=True),
+                    host=rng.choice(["*", "example.com", "*.example.org"]),
+                    method=rng.choice(["*", "GET", "POST"]),
+                )
+            )
+
+        sdk_cache = RuleCache()
+        indexed_cache = IndexedRuleCache()
+        _load(sdk_cache, rules)
+        _load(indexed_cache, rules)
+        now = int(time.time())
+
+        for _ in range(500):
+            sampling_req = _sampling_req(
+                random_path(wildcards=False),
+                host=rng.choice(["example.com", "www.example.org", "other"]),
+                method=rng.choice(["GET", "POST", "PUT"]),
+            )
+
+            # Exercise
+            actual = indexed_cache.get_matched_rule(sampling_req, now)
+
+            # Verify
+            expected = sdk_cache.get_matched_rule(sampling_req, now)
+            assert actual.name == expected.name, f"Mismatch for {sampling_req}"
+
+
+class TestIndexedSampler:
+    def test_should_sample_with_matched_rule(self):
+        # Setup
+        sampler = IndexedSampler()
+        sampler._started = True  # Don't poll the X-Ray daemon
+        _load(
+            sampler._cache,
+            [_make_default_rule(), _make_rule("always", 10, path="/api/*", rate=1.0)],
+        )
+
+        # Exercise
+        decision = sampler.should_trace(_sampling_req("/api/users"))
+
+        # Verify
+        assert decision == "always"
+
+    def test_should_not_sample_with_matched_rule(self):
+        # Setup
+        sampler = IndexedSampler()
+        sampler._started = True  # Don't poll the X-Ray daemon
+        _load(
+            sampler._cache,
+            [_make_default_rule(rate=1.0), _make_rule("never", 10, path="/health")],
+        )
+
+        # Exercise
+        decision = sampler.should_trace(_sampling_req("/health"))
+
+        # Verify
+        assert decision is False
@@ -0,0 +1,130 @@
+"""Tests for the local sampler with reservoirs shared between processes."""
+
+import multiprocessing
+import time
+from collections import Counter
+
+import pytest
+
+# Shared memory is only available on POSIX platforms
+pytest.importorskip("fcntl")
+
+from xraysink.sampling.shared_reservoir import SharedReservoirSampler  # noqa: E402
+
+#: Number of traces per second for the default rule.
+_FIXED_TARGET = 5
+
+#: Replaces `time.time()` with the fake clock, for the reservoirs.
+wall_clock = pytest.mark.parametrize("clock", ["time"], indirect=True)
+
+
+def _make_rules(fixed_target: int = _FIXED_TARGET) -> dict:
+    return {
+        "version": 2,
+        "rules": [
+            {
+                "host": "*",
+                "http_method": "*",
+                "url_path": "/health",
+                "fixed_target": 0,
+                "rate": 0.0,
+            }
+        ],
+        "default": {"fixed_target": fixed_target, "rate": 0.0},
+    }
+
+
+def _sample_for(name: str, barrier, seconds: float, results):
+    """Make sampling decisions in a worker process, for a while.
+
+    The number of traces sampled in each second is put on the results queue.
+    """
+    sampler = SharedReservoirSampler(name, _make_rules())
+    sampled = Counter()
+    barrier.wait()
+    end_time = time.time() + seconds
+    while time.time() < end_time:
+        before = int(time.time())
+        decision = sampler.should_trace({"host": "example.com", "path": "/api"})
+        after = int(time.time())
+        # Only count decisions that were definitely made in a known second
+        if decision and before == after:
+            sampled[before] += 1
+    results.put(sampled)
+
+
+class TestSharedReservoirSampler:
+    @wall_clock
+    def test_should_take_fixed_target_each_second(self, name, clock):
+        # Setup
+        sampler = SharedReservoirSampler(name, _make_rules())
+
+        # Exercise
+        first = [sampler.should_trace() for _ in range(10)]
+        clock.now += 1
+        second = [sampler.should_trace() for _ in range(10)]
+
+        # Verify
+        assert first == [True] * _FIXED_TARGET + [False] * 5
+        assert second == first
+
+    @wall_clock
+    def test_should_share_reservoir_between_samplers(self, name, clock):
+        # Setup
+        samplers = [SharedReservoirSampler(name, _make_rules()) for _ in range(3)]
+
+        # Exercise
+        decisions = [sampler.should_trace() for _ in range(4) for sampler in samplers]
+
+        # Verify
+        assert decisions.count(True) == _FIXED_TARGET
+        assert samplers[0]._default_rule.reservoir.used_this_sec == _FIXED_TARGET
+
+    @wall_clock
+    def test_should_use_separate_reservoir_for_each_rule(self, name, clock):
+        # Setup
+        sampler = SharedReservoirSampler(name, _make_rules())
+
+        # Exercise
+        health = [sampler.should_trace({"path": "/health"}) for _ in range(3)]
+        other = [sampler.should_trace({"path": "/api"}) for _ in range(3)]
+
+        # Verify
+        assert health == [False] * 3
+        assert other == [True] * 3
+
+    @wall_clock
+    def test_should_use_rules_loaded_later(self, name, clock):
+        # Setup
+        sampler = SharedReservoirSampler(name)
+
+        # Exercise
+        sampler.load_local_rules(_make_rules(fixed_target=2))
+
+        # Verify
+        assert [sampler.should_trace() for _ in range(3)] == [True, True, False]
+
+    def test_should_hold_global_cap_across_processes(self, name):
+        # Setup
+        process_count = 4
+        context = multiprocessing.get_context("spawn")
+        barrier = context.Barrier(process_count)
+
+        results = context.Queue()
+        processes = [
+            context.Process(target=_sample_for, args=(name, barrier, 2.5, results))
+            for _ in range(process_count)
+        ]
+
+        # Exercise
+        for process in processes:
+            process.start()
+        sampled = [results.get(timeout=60) for _ in processes]
+        for process in processes:
+            process.join()
+
+        # Verify
+        total = sum(sampled, Counter())
+        assert len(total) >= 2
+        assert sum(total.values()) > _FIXED_TARGET
+        assert max(total.values()) <= _FIXED_TARGET
@@ -0,0 +1,278 @@
+"""Tests for the tail sampler, which decides whether to keep a trace when it ends."""
+
+import json
+import time
+
+import pytest
+from aws_xray_sdk.core.models import http
+from aws_xray_sdk.core.models.segment import Segment
+from aws_xray_sdk.core.models.subsegment import Subsegment
+from aws_xray_sdk.core.models.trace_header import TraceHeader
+
+from xraysink.entities import UNDECIDED
+from xraysink.sampling import tail
+from xraysink.sampling.tail import TAIL_SAMPLING_NAMESPACE
+from xraysink.sampling.tail import TailSampler
+
+from ..xray_util import StubbedEmitter
+
+
+@pytest.fixture()
+def emitter():
+    return StubbedEmitter()
+
+
+def _make_subsegment(segment: Segment, name: str = "call") -> Subsegment:
+    subsegment = Subsegment(name, "remote", segment)
+    subsegment.close()
+    return subsegment
+
+
+class TestTailSampler:
+    def test_should_discard_ordinary_request(self, emitter):
+        # Setup
+        tail_sampler = TailSampler(emitter)
+        segment = Segment("test")
+        tail_sampler.begin_trace(segment, baseline=False)
+
+        # Exercise
+        keep = tail_sampler.end_trace(segment)
+
+        # Verify
+        assert keep is False
+        assert segment.sampled is False
+        assert tail_sampler.discarded == 1
+        assert tail_sampler.pending == 0
+
+    def test_should_keep_baseline_request(self, emitter):
+        # Setup
+        tail_sampler = TailSampler(emitter)
+        segment = Segment("test")
+        tail_sampler.begin_trace(segment, baseline=True)
+
+        # Exercise
+        keep = tail_sampler.end_trace(segment)
+
+        # Verify
+        assert keep is True
+        assert segment.sampled is True
+        assert tail_sampler.kept == 1
+
+    @pytest.mark.parametrize(
+        ("status", "keep_client_errors", "expected"),
+        [
+            (200, False, False),
+            (404, False, False),
+            (404, True, True),
+            (429, False, True),
+            (500, False, True),
+            (503, False, True),
+        ],
+    )
+    def test_should_keep_request_by_status(
+        self, emitter, status, keep_client_errors, expected
+    ):
+        # Setup
+        tail_sampler = TailSampler(emitter, keep_client_errors=keep_client_errors)
+        segment = Segment("test")
+        tail_sampler.begin_trace(segment, baseline=False)
+        segment.put_http_meta(http.STATUS, status)
+
+        # Exercise
+        keep = tail_sampler.end_trace(segment)
+
+        # Verify
+        assert keep is expected
+
+    def test_should_keep_request_with_exception(self, emitter):
+        # Setup
+        tail_sampler = TailSampler(emitter)
+        segment = Segment("test")
+        tail_sampler.begin_trace(segment, baseline=False)
+        segment.add_exception(KeyError("key"), [])
+
+        # Exercise
+        keep = tail_sampler.end_trace(segment)
+
+        # Verify
+        assert keep is True
+
+    def test_should_keep_slow_request(self, emitter):
+        # Setup
+        tail_sampler = TailSampler(emitter, latency_threshold=0.5)
+        slow = Segment("slow")
+        fast = Segment("fast")
+        tail_sampler.begin_trace(slow, baseline=False)
+        tail_sampler.begin_trace(fast, baseline=False)
+
+        # Exercise
+        keep_slow = tail_sampler.end_trace(slow, slow.start_time + 0.6)
+        keep_fast = tail_sampler.end_trace(fast, fast.start_time + 0.4)
+
+        # Verify
+        assert keep_slow is True
+        assert keep_fast is False
+
+    def test_should_hold_streamed_subsegments_until_trace_is_kept(self, emitter):
+        # Setup
+        tail_sampler = TailSampler(emitter)
+        segment = Segment("test")
+        tail_sampler.begin_trace(segment, baseline=False)
+        subsegments = [_make_subsegment(segment, f"call-{i}") for i in range(3)]
+
+        # Exercise
+        for subsegment in subsegments:
+            tail_sampler.send_entity(subsegment)
+        held = emitter.segments
+        buffer_bytes = tail_sampler.buffer_bytes
+
+        segment.put_http_meta(http.STATUS, 500)
+        tail_sampler.end_trace(segment)
+
+        # Verify
+        assert held == []
+        assert buffer_bytes > 0
+        assert tail_sampler.buffer_bytes == 0
+
+        documents = [json.loads(entity.serialize()) for entity in emitter.segments]
+        assert [document["name"] for document in documents] == [
+            "call-0",
+            "call-1",
+            "call-2",
+        ]
+        assert [entity.trace_id for entity in emitter.segments] == [
+            segment.trace_id
+        ] * 3
+
+    def test_should_discard_streamed_subsegments_of_discarded_trace(self, emitter):
+        # Setup
+        tail_sampler = TailSampler(emitter)
+        segment = Segment("test")
+        tail_sampler.begin_trace(segment, baseline=False)
+        tail_sampler.send_entity(_make_subsegment(segment))
+
+        # Exercise
+        tail_sampler.end_trace(segment)
+
+        # Verify
+        assert emitter.segments == []
+        assert tail_sampler.buffer_bytes == 0
+
+    @pytest.mark.parametrize("status", [200, 500])
+    def test_should_decide_entity_emitted_after_trace_ends(self, emitter, status):
+        # Setup
+        tail_sampler = TailSampler(emitter)
+        segment = Segment("test")
+        tail_sampler.begin_trace(segment, baseline=False)
+        segment.put_http_meta(http.STATUS, status)
+        keep = tail_sampler.end_trace(segment)
+
+        # Exercise
+        tail_sampler.send_entity(_make_subsegment(segment, "late"))
+
+        # Verify
+        assert [entity.name for entity in emitter.segments] == (
+            ["late"] if keep else []
+        )
+        assert keep is (status == 500)
+
+    def test_should_forget_oldest_decided_traces(self, emitter, monkeypatch):
+        # Setup
+        monkeypatch.setattr(tail, "MAX_DECIDED_TRACES", 2)
+        tail_sampler = TailSampler(emitter)
+        segments = [Segment(f"test-{i}") for i in range(3)]
+        for segment in segments:
+            tail_sampler.begin_trace(segment, baseline=False)
+            tail_sampler.end_trace(segment)
+
+        # Exercise
+        for segment in segments:
+            tail_sampler.send_entity(_make_subsegment(segment, segment.name))
+
+        # Verify
+        assert [entity.name for entity in emitter.segments] == ["test-0"]
+
+    def test_should_discard_trace_that_overflows_buffer(self, emitter):
+        # Setup
+        segment = Segment("test")
+        subsegment = _make_subsegment(segment)
+        size = len(subsegment.serialize())
+        tail_sampler = TailSampler(emitter, max_buffer_bytes=int(size * 2.5))
+        tail_sampler.begin_trace(segment, baseline=False)
+
+        # Exercise
+        for _ in range(3):
+            tail_sampler.send_entity(subsegment)
+        buffer_bytes = tail_sampler.buffer_bytes
+        keep = tail_sampler.end_trace(segment)
+
+        # Verify
+        assert buffer_bytes == 0
+        assert keep is False
+        assert emitter.segments == []
+        assert tail_sampler.overflowed == 1
+        assert tail_sampler.discarded == 1
+
+    @pytest.mark.parametrize("baseline", [False, True])
+    def test_should_keep_truncated_trace_that_overflows_buffer(self, emitter, baseline):
+        # Setup
+        segment = Segment("test")
+        subsegment = _make_subsegment(segment)
+        size = len(subsegment.serialize())
+        tail_sampler = TailSampler(emitter, max_buffer_bytes=int(size * 2.5))
+        tail_sampler.begin_trace(segment, baseline=baseline)
+        for _ in range(4):
+            tail_sampler.send_entity(subsegment)
+
+        # Exercise
+        segment.put_http_meta(http.STATUS, 500)
+        keep = tail_sampler.end_trace(segment)
+
+        # Verify
+        assert keep is True
+        assert segment.sampled is True
+        assert segment.metadata[TAIL_SAMPLING_NAMESPACE] == {"truncated_subsegments": 4}
+        assert emitter.segments == []
+        assert tail_sampler.buffer_bytes == 0
+        assert tail_sampler.overflowed == 1
+        assert tail_sampler.kept == 1
+
+    @pytest.mark.parametrize(
+        ("baseline", "expected"), [(False, UNDECIDED), (True, True)]
+    )
+    def test_should_mark_segment_with_baseline_decision(
+        self, emitter, baseline, expected
+    ):
+        # Setup
+        tail_sampler = TailSampler(emitter)
+        segment = Segment("test")
+
+        # Exercise
+        tail_sampler.begin_trace(segment, baseline=baseline)
+
+        # Verify
+        assert segment.sampled == expected
+        header = TraceHeader(root=segment.trace_id, sampled=segment.sampled)
+        assert header.sampled == ("?" if expected == UNDECIDED else 1)
+
+    def test_should_send_entities_of_other_traces(self, emitter):
+        # Setup
+        tail_sampler = TailSampler(emitter)
+        pending = Segment("pending")
+        tail_sampler.begin_trace(pending, baseline=False)
+        other = Segment("other")
+        other.close(time.time())
+
+        # Exercise
+        tail_sampler.send_entity(other)
+
+        # Verify
+        assert emitter.segments == [other]
+
+    def test_should_use_attributes_of_wrapped_emitter(self, emitter):
+        # Exercise
+        tail_sampler = TailSampler(emitter)
+
+        # Verify
+        assert tail_sampler.pop() is None
+        assert tail_sampler.emitter is emitter
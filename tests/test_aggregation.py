@@ -0,0 +1,154 @@
+"""Tests for aggregating repetitive subsegments."""
+
+import json
+
+import pytest
+from aws_xray_sdk.core import AsyncAWSXRayRecorder
+
+from xraysink.aggregation import SubsegmentAggregation
+from xraysink.context import AsyncContext
+from xraysink.context import ContextVarAsyncContext
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture(
+    params=[
+        pytest.param(AsyncContext, id="xraysink"),
+        pytest.param(ContextVarAsyncContext, id="xraysink-contextvars"),
+    ]
+)
+def recorder(request, recorder) -> AsyncAWSXRayRecorder:
+    aggregation = SubsegmentAggregation(keep_first=2)
+    recorder.configure(context=request.param(aggregation=aggregation))
+    return recorder
+
+
+async def _call(recorder, name: str, namespace: str = "remote", fail: bool = False):
+    async with recorder.in_subsegment_async(name, namespace=namespace) as subsegment:
+        if fail:
+            subsegment.add_fault_flag()
+
+
+def _get_statistics(subsegment) -> dict:
+    document = json.loads(subsegment.serialize())
+    return document["metadata"]["xraysink"]["aggregate"]
+
+
+class TestSubsegmentAggregation:
+    async def test_should_fold_repeated_subsegments(self, recorder):
+        # Exercise
+        async with recorder.in_segment_async("request"):
+            for _ in range(100):
+                await _call(recorder, "redis GET")
+
+        # Verify
+        segment = recorder.emitter.pop()
+        assert [s.name for s in segment.subsegments] == ["redis GET"] * 3
+
+        first, second, summary = segment.subsegments
+        assert "metadata" not in json.loads(first.serialize())
+
+        statistics = _get_statistics(summary)
+        assert statistics["count"] == 100
+        assert statistics["omitted"] == 98
+        assert statistics["min"] <= statistics["p50"] <= statistics["p90"]
+        assert statistics["p90"] <= statistics["p99"] <= statistics["max"]
+        assert statistics["total"] >= statistics["max"]
+
+        assert summary.start_time == first.start_time
+        assert summary.end_time >= second.end_time
+        assert not summary.in_progress
+        assert segment.ready_to_send()
+
+    async def test_should_aggregate_each_operation_separately(self, recorder):
+        # Exercise
+        async with recorder.in_segment_async("request"):
+            for _ in range(10):
+                await _call(recorder, "redis GET")
+                await _call(recorder, "redis GET", namespace="aws")
+                await _call(recorder, "redis SET")
+
+        # Verify
+        segment = recorder.emitter.pop()
+        assert len(segment.subsegments) == 9
+
+        summaries = [s for s in segment.subsegments if s.metadata]
+        assert sorted((s.name, s.namespace) for s in summaries) == [
+            ("redis GET", "aws"),
+            ("redis GET", "remote"),
+            ("redis SET", "remote"),
+        ]
+        assert [_get_statistics(s)["count"] for s in summaries] == [10, 10, 10]
+
+    async def test_should_keep_failed_subsegments(self, recorder):
+        # Exercise
+        async with recorder.in_segment_async("request"):
+            for i in range(20):
+                await _call(recorder, "redis GET", fail=i in (10, 15))
+
+        # Verify
+        segment = recorder.emitter.pop()
+        failed = [s for s in segment.subsegments if getattr(s, "fault", False)]
+        assert len(failed) == 2
+        assert len(segment.subsegments) == 5
+
+        (summary,) = [s for s in segment.subsegments if s.metadata]
+        assert _get_statistics(summary)["omitted"] == 16
+
+    async def test_should_aggregate_under_subsegment(self, recorder):
+        # Exercise
+        async with recorder.in_segment_async("task"), recorder.in_subsegment_async(
+            "batch"
+        ):
+            for _ in range(10):
+                await _call(recorder, "db query")
+
+        # Verify
+        segment = recorder.emitter.pop()
+        (batch,) = segment.subsegments
+        assert len(batch.subsegments) == 3
+        assert _get_statistics(batch.subsegments[-1])["count"] == 10
+
+    async def test_should_not_fold_subsegments_with_children(self, recorder):
+        # Exercise
+        async with recorder.in_segment_async("task"):
+            for _ in range(5):
+                async with recorder.in_subsegment_async("batch"):
+                    await _call(recorder, "db query")
+
+        # Verify
+        segment = recorder.emitter.pop()
+        assert len(segment.subsegments) == 5
+        assert all(len(s.subsegments) == 1 for s in segment.subsegments)
+
+    async def test_should_emit_valid_document(self, recorder):
+        # Exercise
+        async with recorder.in_segment_async("request"):
+            for _ in range(10):
+                await _call(recorder, "redis GET")
+
+        # Verify
+        segment = recorder.emitter.pop()
+        document = json.loads(segment.serialize())
+        summary = document["subsegments"][-1]
+        assert summary["name"] == "redis GET"
+        assert summary["namespace"] == "remote"
+        assert summary["end_time"] >= summary["start_time"]
+        assert summary["in_progress"] is False
+        assert summary["metadata"]["xraysink"]["aggregate"]["count"] == 10
+
+
+class TestWithoutAggregation:
+    async def test_should_keep_all_subsegments_by_default(self, recorder):
+        # Setup
+        recorder.configure(context=AsyncContext())
+
+        # Exercise
+        async with recorder.in_segment_async("request"):
+            for _ in range(10):
+                await _call(recorder, "redis GET")
+
+        # Verify
+        segment = recorder.emitter.pop()
+        assert len(segment.subsegments) == 10
@@ -1,3 +1,4 @@
+import asyncio
 from asyncio import ensure_future
 from asyncio import gather
 from asyncio import sleep
@@ -7,6 +8,7 @@ from aws_xray_sdk.core.async_context import AsyncContext as CoreAsyncContext
 from aws_xray_sdk.version import VERSION as AWS_XRAY_SDK_VERSION_STRING
 
 from xraysink.context import AsyncContext
+from xraysink.context import ContextVarAsyncContext
 
 pytestmark = pytest.mark.asyncio
 
@@ -22,6 +24,7 @@ BROKEN_SDK_VERSION = pytest.mark.xfail(
     "context_class",
     [
         pytest.param(AsyncContext, id="xraysink"),
+        pytest.param(ContextVarAsyncContext, id="xraysink-contextvars"),
         pytest.param(CoreAsyncContext, marks=[BROKEN_SDK_VERSION], id="aws_xray_sdk"),
     ],
 )
@@ -115,6 +118,7 @@ async def test_asyncio_task_subsegments_should_use_parent_task_segment_as_parent
     "context_class",
     [
         pytest.param(AsyncContext, id="xraysink"),
+        pytest.param(ContextVarAsyncContext, id="xraysink-contextvars"),
         pytest.param(CoreAsyncContext, marks=[BROKEN_SDK_VERSION], id="aws_xray_sdk"),
     ],
 )
@@ -145,6 +149,7 @@ async def test_asyncio_task_should_start_segment_when_none_present(
     "context_class",
     [
         pytest.param(AsyncContext, id="xraysink"),
+        pytest.param(ContextVarAsyncContext, id="xraysink-contextvars"),
         pytest.param(CoreAsyncContext, marks=[BROKEN_SDK_VERSION], id="aws_xray_sdk"),
     ],
 )
@@ -173,3 +178,37 @@ async def test_asyncio_task_should_start_segment_when_previous_segment_closed(
     assert not segment.in_progress
     assert getattr(segment, "error", False) is False
     assert getattr(segment, "fault", False) is False
+
+
+async def test_contextvars_context_should_not_replace_existing_task_factory(recorder):
+    # Setup
+    loop = asyncio.get_running_loop()
+    created_tasks = []
+
+    def custom_task_factory(loop, coro):
+        task = asyncio.Task(coro, loop=loop)
+        created_tasks.append(task)
+        return task
+
+    loop.set_task_factory(custom_task_factory)
+    try:
+        recorder.configure(context=ContextVarAsyncContext())
+
+        async def do_task(name: str):
+            async with recorder.in_subsegment_async(name=name):
+                await sleep(0.01)
+
+        # Exercise
+        async with recorder.in_segment_async(name="top-segment"):
+            _ = await gather(do_task("first-task"), do_task("second-task"))
+    finally:
+        loop.set_task_factory(None)
+
+    # Verify
+    assert len(created_tasks) == 2, "Existing task factory should still be used"
+
+    segment = recorder.emitter.pop()
+    assert sorted(s.name for s in segment.subsegments) == [
+        "first-task",
+        "second-task",
+    ], "Each asyncio task should create a subsegment from the main segment"
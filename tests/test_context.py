@@ -0,0 +1,408 @@
+"""Tests for the recorder contexts."""
+
+import asyncio
+import gc
+import threading
+import tracemalloc
+import weakref
+from asyncio import current_task
+from asyncio import ensure_future
+from asyncio import gather
+from asyncio import sleep
+
+import pytest
+
+from xraysink.context import _EntityStack
+from xraysink.context import AsyncContext
+from xraysink.context import ContextVarAsyncContext
+
+pytestmark = pytest.mark.asyncio
+
+
+class TestEntityStack:
+    """Tests for the persistent entity stack."""
+
+    async def test_push_should_not_modify_existing_stack(self):
+        # Setup
+        bottom = _EntityStack("segment")
+
+        # Exercise
+        left = bottom.push("left")
+        right = bottom.push("right")
+
+        # Verify
+        assert list(bottom) == ["segment"]
+        assert list(left) == ["segment", "left"]
+        assert list(right) == ["segment", "right"]
+        assert left.parent is right.parent is bottom, "Stacks should share tail"
+
+    async def test_pop_should_return_previous_stack(self):
+        # Setup
+        bottom = _EntityStack("segment")
+        top = bottom.push("subsegment")
+
+        # Exercise
+        popped = top.pop()
+
+        # Verify
+        assert popped is bottom
+        assert list(top) == ["segment", "subsegment"], "Stack should be unchanged"
+        assert bottom.pop() is None
+
+    async def test_should_behave_like_list_of_entities(self):
+        # Exercise
+        stack = _EntityStack("a").push("b").push("c")
+
+        # Verify
+        assert len(stack) == 3
+        assert stack[-1] == "c"
+        assert stack[0] == "a"
+        assert bool(stack)
+
+
+@pytest.mark.parametrize(
+    "context_class",
+    [
+        pytest.param(AsyncContext, id="xraysink"),
+        pytest.param(ContextVarAsyncContext, id="xraysink-contextvars"),
+    ],
+)
+class TestEntityStackPropagation:
+    """Tests for propagating the entity stack to new tasks."""
+
+    async def test_new_task_should_share_parent_stack(self, recorder, context_class):
+        # Setup
+        recorder.configure(context=context_class(use_task_factory=True))
+
+        async def get_stack():
+            return recorder.context._local.entities
+
+        # Exercise
+        async with recorder.in_segment_async("segment"):
+            for i in range(50):
+                recorder.begin_subsegment(f"nested-{i}")
+            parent_stack = recorder.context._local.entities
+
+            child_stack = await ensure_future(get_stack())
+
+            for _ in range(50):
+                recorder.end_subsegment()
+
+        # Verify
+        assert child_stack is parent_stack, "Entity stack should not be copied"
+
+    async def test_concurrent_tasks_should_not_modify_each_others_stack(
+        self, recorder, context_class
+    ):
+        # Setup
+        recorder.configure(
+            context=context_class(use_task_factory=True), streaming_threshold=1000
+        )
+
+        async def do_task(name: str):
+            async with recorder.in_subsegment_async(name=name) as subsegment:
+                await sleep(0.01)
+                assert recorder.get_trace_entity() is subsegment
+                async with recorder.in_subsegment_async(name=f"{name}-inner"):
+                    await sleep(0.01)
+                assert recorder.get_trace_entity() is subsegment
+
+        # Exercise
+        async with recorder.in_segment_async("segment") as segment:
+            _ = await gather(*[do_task(f"task-{i}") for i in range(100)])
+            assert recorder.get_trace_entity() is segment
+
+        # Verify
+        segment = recorder.emitter.pop()
+        assert len(segment.subsegments) == 100
+        for subsegment in segment.subsegments:
+            assert [s.name for s in subsegment.subsegments] == [
+                f"{subsegment.name}-inner"
+            ]
+
+    async def test_thread_should_not_see_task_stack(self, recorder, context_class):
+        # Setup
+        recorder.configure(context=context_class(use_task_factory=True))
+        thread_stacks = []
+
+        def get_stack():
+            thread_stacks.append(recorder.context._local.entities)
+
+        # Exercise
+        async with recorder.in_segment_async("segment"):
+            # Block the event loop whilst this task is the current task
+            thread = threading.Thread(target=get_stack)
+            thread.start()
+            thread.join()
+
+        # Verify
+        assert thread_stacks == [None]
+
+
+@pytest.mark.parametrize(
+    "context_class",
+    [
+        pytest.param(AsyncContext, id="xraysink"),
+        pytest.param(ContextVarAsyncContext, id="xraysink-contextvars"),
+    ],
+)
+class TestEntityRelease:
+    """Tests for releasing ended entities from stacks shared with other tasks."""
+
+    async def test_long_lived_task_should_not_keep_segment(
+        self, recorder, context_class
+    ):
+        # Setup
+        recorder.configure(context=context_class(use_task_factory=True))
+        stop = asyncio.Event()
+        entities = []
+
+        async def poll():
+            await stop.wait()
+            entities.append(recorder.context._local.entities)
+
+        # Exercise
+        async with recorder.in_segment_async(
+            "request"
+        ) as segment, recorder.in_subsegment_async("handler"):
+            task = ensure_future(poll())
+            await sleep(0)
+
+        segment_ref = weakref.ref(segment)
+        del segment
+        recorder.emitter.pop()
+        gc.collect()
+
+        # Verify
+        assert segment_ref() is None, "Segment should not be kept by the task"
+
+        stop.set()
+        await task
+        assert not entities[0], "Task should not see the ended segment"
+
+    async def test_task_should_use_segment_after_subsegment_ends(
+        self, recorder, context_class
+    ):
+        # Setup
+        recorder.configure(context=context_class(use_task_factory=True))
+        subsegment_ended = asyncio.Event()
+
+        async def do_task():
+            await subsegment_ended.wait()
+            async with recorder.in_subsegment_async("task"):
+                pass
+
+        # Exercise
+        async with recorder.in_segment_async("request") as segment:
+            async with recorder.in_subsegment_async("handler"):
+                task = ensure_future(do_task())
+                await sleep(0)
+            subsegment_ended.set()
+            await task
+
+        # Verify
+        assert [s.name for s in segment.subsegments] == ["handler", "task"]
+
+    async def test_should_keep_segment_until_sent(self, recorder, context_class):
+        # Setup
+        recorder.configure(context=context_class(use_task_factory=True))
+        task_started = asyncio.Event()
+        finish_task = asyncio.Event()
+
+        async def do_task():
+            async with recorder.in_subsegment_async("task"):
+                task_started.set()
+                await finish_task.wait()
+
+        # Exercise
+        async with recorder.in_segment_async("request") as segment:
+            task = ensure_future(do_task())
+            await task_started.wait()
+
+        assert recorder.emitter.segments == [], "Should wait for the task"
+        finish_task.set()
+        await task
+
+        # Verify
+        assert recorder.emitter.pop() is segment
+        assert [s.name for s in segment.subsegments] == ["task"]
+
+
+class TestEntityReleaseMemory:
+    """Memory regression test for long-lived tasks started by traced requests."""
+
+    #: Number of requests made with and without tracing.
+    REQUEST_COUNT = 3_000
+
+    #: Number of requests made before measuring the initial memory use.
+    WARMUP_COUNT = 500
+
+    #: Maximum ratio of the memory kept per traced request, to the memory kept
+    #: per untraced request (ie. by the task alone).
+    MAX_GROWTH_RATIO = 3.0
+
+    async def test_memory_should_be_stable_with_long_lived_tasks(self, recorder):
+        # Setup
+        recorder.configure(context=AsyncContext(use_task_factory=True))
+        recorder.emitter.send_entity = lambda entity: None
+        stop = asyncio.Event()
+        tasks = []
+
+        async def poll():
+            await stop.wait()
+
+        async def handle_request(traced: bool):
+            if traced:
+                async with recorder.in_segment_async(
+                    "request"
+                ), recorder.in_subsegment_async("handler") as handler:
+                    handler.put_metadata("payload", "x" * 100)
+                    tasks.append(ensure_future(poll()))
+            else:
+                tasks.append(ensure_future(poll()))
+
+        async def get_memory_per_request(traced: bool, count: int) -> float:
+            """Memory kept for each request, once the requests have finished."""
+            tracemalloc.start()
+            try:
+                for _ in range(self.WARMUP_COUNT):
+                    await handle_request(traced)
+                gc.collect()
+                initial, _ = tracemalloc.get_traced_memory()
+
+                for _ in range(count - self.WARMUP_COUNT):
+                    await handle_request(traced)
+                gc.collect()
+                final, _ = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+                stop.set()
+                await gather(*tasks)
+                stop.clear()
+                tasks.clear()
+
+            return (final - initial) / (count - self.WARMUP_COUNT)
+
+        # Exercise
+        untraced_memory = await get_memory_per_request(
+            traced=False, count=self.REQUEST_COUNT
+        )
+        traced_memory = await get_memory_per_request(
+            traced=True, count=self.REQUEST_COUNT
+        )
+
+        # Verify
+        # A task that kept its request's segment tree would keep several times
+        # as much memory. Otherwise, the task only keeps an empty entity stack.
+        assert traced_memory < untraced_memory * self.MAX_GROWTH_RATIO
+
+
+class CustomTask(asyncio.Task):
+    """Custom task class, as might be used by a third-party task factory."""
+
+
+def custom_task_factory(loop, coro, **kwargs):
+    return CustomTask(coro, loop=loop, **kwargs)
+
+
+requires_eager_tasks = pytest.mark.skipif(
+    not hasattr(asyncio, "eager_task_factory"),
+    reason="Eager tasks are only available in Python 3.12+",
+)
+
+
+class TestTaskFactoryChaining:
+    """Tests for layering the AsyncContext task factory on an existing one."""
+
+    @pytest.fixture()
+    def loop(self, event_loop):
+        yield event_loop
+        event_loop.set_task_factory(None)
+
+    async def test_should_delegate_to_existing_task_factory(self, recorder, loop):
+        # Setup
+        loop.set_task_factory(custom_task_factory)
+        recorder.configure(context=AsyncContext(loop=loop))
+
+        async def do_task(name: str):
+            async with recorder.in_subsegment_async(name=name):
+                await sleep(0.01)
+            return current_task()
+
+        # Exercise
+        async with recorder.in_segment_async("segment"):
+            tasks = await gather(do_task("first-task"), do_task("second-task"))
+
+        # Verify
+        assert all(isinstance(task, CustomTask) for task in tasks)
+
+        segment = recorder.emitter.pop()
+        assert sorted(s.name for s in segment.subsegments) == [
+            "first-task",
+            "second-task",
+        ], "Each asyncio task should create a subsegment from the main segment"
+
+    async def test_should_not_wrap_task_factory_twice(self, recorder, loop):
+        # Setup
+        loop.set_task_factory(custom_task_factory)
+
+        # Exercise
+        recorder.configure(context=AsyncContext(loop=loop))
+        recorder.configure(context=AsyncContext(loop=loop))
+
+        # Verify
+        factory = loop.get_task_factory()
+        assert factory.inner_factory is custom_task_factory
+
+    @requires_eager_tasks
+    async def test_should_keep_eager_execution(self, recorder, loop):
+        # Setup
+        loop.set_task_factory(asyncio.eager_task_factory)
+        recorder.configure(context=AsyncContext(loop=loop))
+
+        async def do_synchronous_task(name: str):
+            async with recorder.in_subsegment_async(name=name) as subsegment:
+                return subsegment
+
+        # Exercise
+        async with recorder.in_segment_async("segment") as segment:
+            task = asyncio.create_task(do_synchronous_task("eager-task"))
+            is_done_immediately = task.done()
+            subsegment = await task
+
+        # Verify
+        assert is_done_immediately, "Task should have been executed eagerly"
+        assert subsegment.name == "eager-task"
+        assert subsegment.parent_id == segment.id
+        assert recorder.emitter.pop().subsegments == [subsegment]
+
+    @requires_eager_tasks
+    async def test_should_isolate_concurrent_eager_tasks(self, recorder, loop):
+        # Setup
+        loop.set_task_factory(asyncio.eager_task_factory)
+        recorder.configure(context=AsyncContext(loop=loop), streaming_threshold=1000)
+
+        async def do_task(name: str):
+            async with recorder.in_subsegment_async(name=name) as subsegment:
+                async with recorder.in_subsegment_async(name=f"{name}-eager"):
+                    pass
+                await sleep(0.01)
+                assert recorder.get_trace_entity() is subsegment
+                _ = await gather(nested_task(f"{name}-nested"))
+
+        async def nested_task(name: str):
+            async with recorder.in_subsegment_async(name=name):
+                await sleep(0.01)
+
+        # Exercise
+        async with recorder.in_segment_async("segment"):
+            _ = await gather(*[do_task(f"task-{i}") for i in range(20)])
+
+        # Verify
+        segment = recorder.emitter.pop()
+        assert len(segment.subsegments) == 20
+        for subsegment in segment.subsegments:
+            assert [s.name for s in subsegment.subsegments] == [
+                f"{subsegment.name}-eager",
+                f"{subsegment.name}-nested",
+            ]
@@ -0,0 +1,52 @@
+"""Tests for the lightweight trace entities."""
+
+import pytest
+from aws_xray_sdk.core.models.dummy_entities import DummySubsegment
+
+from xraysink.entities import UnsampledSegment
+from xraysink.util import has_current_trace
+
+pytestmark = pytest.mark.asyncio
+
+
+class TestUnsampledSegment:
+    async def test_should_use_supplied_trace_id(self):
+        # Exercise
+        segment = UnsampledSegment(
+            "test", traceid="1-5759e988-bd862e3fe1be46a994272793"
+        )
+
+        # Verify
+        assert segment.trace_id == "1-5759e988-bd862e3fe1be46a994272793"
+        assert not segment.sampled
+
+    async def test_should_generate_real_trace_id(self):
+        # Exercise
+        segment = UnsampledSegment("test")
+
+        # Verify
+        assert segment.trace_id.startswith("1-")
+        assert segment.trace_id != UnsampledSegment("test").trace_id
+
+    async def test_should_support_unsampled_subsegments(self, recorder):
+        # Setup
+        segment = UnsampledSegment("test")
+        recorder.context.put_segment(segment)
+
+        # Exercise
+        with recorder.in_subsegment("outer") as outer, recorder.in_subsegment(
+            "inner"
+        ) as inner:
+            assert has_current_trace()
+        recorder.end_segment()
+
+        # Verify
+        assert isinstance(outer, DummySubsegment)
+        assert isinstance(inner, DummySubsegment)
+        assert outer.trace_id == inner.trace_id == segment.trace_id
+        assert segment.subsegments == (), "Subsegments should not be retained"
+
+        assert not segment.in_progress
+        assert segment.ready_to_send()
+        assert not has_current_trace(), "Segment should be finished"
+        assert recorder.emitter.pop() is None, "Should not emit a segment"
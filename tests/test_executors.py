@@ -0,0 +1,359 @@
+"""Tests for propagating the trace context into thread pool executors."""
+
+import asyncio
+import json
+import multiprocessing
+import sys
+import threading
+import time
+from contextvars import ContextVar
+
+import pytest
+from aws_xray_sdk.core import AsyncAWSXRayRecorder
+
+from xraysink import executors
+from xraysink.context import AsyncContext
+from xraysink.context import ContextVarAsyncContext
+from xraysink.emitters.serialization import serialize_entity
+from xraysink.executors import XRayProcessPoolExecutor
+from xraysink.executors import XRayThreadPoolExecutor
+from xraysink.executors import to_thread
+from xraysink.util import get_trace_entities
+
+pytestmark = pytest.mark.asyncio
+
+_request_id: ContextVar = ContextVar("request_id", default=None)
+
+
+@pytest.fixture(
+    params=[
+        pytest.param(AsyncContext, id="xraysink"),
+        pytest.param(ContextVarAsyncContext, id="xraysink-contextvars"),
+    ]
+)
+def recorder(request, recorder) -> AsyncAWSXRayRecorder:
+    recorder.configure(context=request.param())
+    return recorder
+
+
+@pytest.fixture()
+def executor():
+    executor = XRayThreadPoolExecutor(max_workers=2)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+def _call_boto(recorder):
+    with recorder.in_subsegment("boto3 call", namespace="aws"):
+        return recorder.current_segment().name
+
+
+class TestXRayThreadPoolExecutor:
+    async def test_should_execute_in_subsegment(self, recorder, executor):
+        # Setup
+        loop = asyncio.get_running_loop()
+
+        # Exercise
+        async with recorder.in_segment_async("request") as segment:
+            result = await loop.run_in_executor(executor, _call_boto, recorder)
+            entity_after = recorder.get_trace_entity()
+
+        # Verify
+        assert result == "request"
+        assert entity_after is segment
+        assert recorder.emitter.pop() is segment
+
+        (subsegment,) = segment.subsegments
+        assert subsegment.name == "_call_boto"
+        assert subsegment.namespace == "local"
+        assert not subsegment.in_progress
+        assert [s.name for s in subsegment.subsegments] == ["boto3 call"]
+
+    async def test_should_restore_thread_entities(self, recorder, executor):
+        # Setup
+        loop = asyncio.get_running_loop()
+        async with recorder.in_segment_async("request"):
+            await loop.run_in_executor(executor, _call_boto, recorder)
+
+        # Exercise
+        entities = [
+            await loop.run_in_executor(executor, get_trace_entities) for _ in range(4)
+        ]
+
+        # Verify
+        assert entities == [None] * 4
+
+    async def test_should_capture_exception(self, recorder, executor):
+        # Setup
+        loop = asyncio.get_running_loop()
+
+        def fail():
+            raise ValueError("Bad input")
+
+        # Exercise
+        async with recorder.in_segment_async("request") as segment:
+            with pytest.raises(ValueError, match="Bad input"):
+                await loop.run_in_executor(executor, fail)
+
+        # Verify
+        (subsegment,) = segment.subsegments
+        assert subsegment.cause["exceptions"][0].type == "ValueError"
+        assert not subsegment.in_progress
+
+    async def test_should_trace_concurrent_calls(self, recorder, executor):
+        # Setup
+        loop = asyncio.get_running_loop()
+
+        # Exercise
+        async with recorder.in_segment_async("request") as segment:
+            await asyncio.gather(
+                *[
+                    loop.run_in_executor(executor, _call_boto, recorder)
+                    for _ in range(10)
+                ]
+            )
+
+        # Verify
+        assert len(segment.subsegments) == 10
+        assert all(len(s.subsegments) == 1 for s in segment.subsegments)
+        assert segment.ready_to_send()
+
+    async def test_should_run_without_trace(self, recorder, executor):
+        # Setup
+        loop = asyncio.get_running_loop()
+
+        # Exercise
+        entities = await loop.run_in_executor(executor, get_trace_entities)
+
+        # Verify
+        assert entities is None
+        assert recorder.emitter.segments == []
+
+
+class TestToThread:
+    async def test_should_execute_in_subsegment(self, recorder):
+        # Exercise
+        async with recorder.in_segment_async("request") as segment:
+            result = await to_thread(_call_boto, recorder)
+
+        # Verify
+        assert result == "request"
+        (subsegment,) = segment.subsegments
+        assert subsegment.name == "_call_boto"
+        assert [s.name for s in subsegment.subsegments] == ["boto3 call"]
+
+    async def test_should_copy_context_variables(self, recorder):
+        # Setup
+        _request_id.set("abc123")
+
+        # Exercise
+        result = await to_thread(_request_id.get)
+
+        # Verify
+        assert result == "abc123"
+
+    async def test_should_not_nest_subsegments_with_default_executor(
+        self, recorder, executor
+    ):
+        # Setup
+        asyncio.get_running_loop().set_default_executor(executor)
+
+        # Exercise
+        async with recorder.in_segment_async("request") as segment:
+            await to_thread(_call_boto, recorder)
+
+        # Verify
+        (subsegment,) = segment.subsegments
+        assert subsegment.name == "_call_boto"
+        assert [s.name for s in subsegment.subsegments] == ["boto3 call"]
+
+    @pytest.mark.skipif(
+        sys.version_info < (3, 9), reason="asyncio.to_thread() requires Python 3.9"
+    )
+    async def test_should_propagate_to_asyncio_to_thread(self, recorder, executor):
+        # Setup
+        asyncio.get_running_loop().set_default_executor(executor)
+
+        # Exercise
+        async with recorder.in_segment_async("request") as segment:
+            await asyncio.to_thread(_call_boto, recorder)
+
+        # Verify
+        (subsegment,) = segment.subsegments
+        assert subsegment.name == "_call_boto"
+        assert [s.name for s in subsegment.subsegments] == ["boto3 call"]
+
+
+def _crunch(count: int) -> int:
+    # The worker process uses the recorder that the test patched in
+    recorder = executors.xray_recorder
+    total = 0
+    for i in range(count):
+        with recorder.in_subsegment(f"step-{i}") as subsegment:
+            subsegment.put_annotation("step", i)
+            total += i
+    return total
+
+
+def _crunch_batches(batch_count: int, count: int):
+    recorder = executors.xray_recorder
+    for i in range(batch_count):
+        with recorder.in_subsegment(f"batch-{i}"):
+            _crunch(count)
+
+
+def _sleep_then_crunch(delay: float, count: int) -> int:
+    time.sleep(delay)
+    return _crunch(count)
+
+
+def _fail():
+    with executors.xray_recorder.in_subsegment("before failure"):
+        pass
+    raise ValueError("Bad input")
+
+
+@pytest.fixture()
+def process_pool():
+    pool = XRayProcessPoolExecutor(
+        max_workers=2, mp_context=multiprocessing.get_context("fork")
+    )
+    yield pool
+    pool.shutdown(wait=True)
+
+
+class TestXRayProcessPoolExecutor:
+    async def test_should_graft_worker_subsegments(self, recorder, process_pool):
+        # Setup
+        loop = asyncio.get_running_loop()
+
+        # Exercise
+        async with recorder.in_segment_async("request") as segment:
+            result = await loop.run_in_executor(process_pool, _crunch, 3)
+            entity_after = recorder.get_trace_entity()
+
+        # Verify
+        assert result == 3
+        assert entity_after is segment
+        assert recorder.emitter.pop() is segment
+
+        (subsegment,) = segment.subsegments
+        assert subsegment.name == "_crunch"
+        assert not subsegment.in_progress
+        assert [s.name for s in subsegment.subsegments] == [
+            "step-0",
+            "step-1",
+            "step-2",
+        ]
+
+        document = json.loads(segment.serialize())
+        (process_document,) = document["subsegments"]
+        for i, step in enumerate(process_document["subsegments"]):
+            assert step["trace_id"] == segment.trace_id
+            assert step["parent_id"] == subsegment.id
+            assert step["annotations"] == {"step": i}
+            assert step["end_time"] >= step["start_time"]
+        assert json.loads(serialize_entity(segment)) == document
+
+    async def test_should_record_exception(self, recorder, process_pool):
+        # Setup
+        loop = asyncio.get_running_loop()
+
+        # Exercise
+        async with recorder.in_segment_async("request") as segment:
+            with pytest.raises(ValueError, match="Bad input") as excinfo:
+                await loop.run_in_executor(process_pool, _fail)
+
+        # Verify
+        assert not hasattr(excinfo.value, "_xraysink_documents")
+
+        (subsegment,) = segment.subsegments
+        assert subsegment.fault
+        assert subsegment.cause["exceptions"][0].type == "ValueError"
+        assert [s.name for s in subsegment.subsegments] == ["before failure"]
+
+    async def test_should_send_streamed_subsegments(self, recorder, process_pool):
+        # Setup
+        recorder.configure(streaming_threshold=4)
+        loop = asyncio.get_running_loop()
+
+        # Exercise
+        async with recorder.in_segment_async("request") as segment:
+            await loop.run_in_executor(process_pool, _crunch_batches, 2, 5)
+
+        # Verify
+        documents = [json.loads(e.serialize()) for e in recorder.emitter.segments]
+        steps = [
+            step
+            for document in documents
+            for step in _iter_documents(document)
+            if step["name"].startswith("step-")
+        ]
+        assert len(steps) == 10, "Should send every step exactly once"
+
+        (subsegment,) = segment.subsegments
+        assert [s.name for s in subsegment.subsegments] == ["batch-0", "batch-1"]
+        batch_ids = {s.id for s in subsegment.subsegments}
+        assert {step["parent_id"] for step in steps} == batch_ids
+
+    async def test_should_send_segment_once_when_it_ends_before_worker(
+        self, recorder, process_pool, monkeypatch
+    ):
+        # Setup
+        loop = asyncio.get_running_loop()
+        sending_threads = []
+        send_entity = recorder.emitter.send_entity
+
+        def record_thread(entity):
+            sending_threads.append(threading.get_ident())
+            send_entity(entity)
+
+        monkeypatch.setattr(recorder.emitter, "send_entity", record_thread)
+
+        # Exercise
+        async with recorder.in_segment_async("request") as segment:
+            future = loop.run_in_executor(process_pool, _sleep_then_crunch, 0.2, 3)
+        sent_before_worker = list(recorder.emitter.segments)
+        result = await future
+
+        # Verify
+        assert result == 3
+        assert sent_before_worker == []
+        assert recorder.emitter.segments == [segment]
+        assert sending_threads == [threading.get_ident()]
+
+        (subsegment,) = segment.subsegments
+        assert not subsegment.in_progress
+        assert len(subsegment.subsegments) == 3
+
+    async def test_should_trace_concurrent_calls(self, recorder, process_pool):
+        # Setup
+        loop = asyncio.get_running_loop()
+
+        # Exercise
+        async with recorder.in_segment_async("request") as segment:
+            results = await asyncio.gather(
+                *[loop.run_in_executor(process_pool, _crunch, i) for i in range(6)]
+            )
+
+        # Verify
+        assert results == [0, 0, 1, 3, 6, 10]
+        assert recorder.emitter.pop() is segment
+        assert sorted(len(s.subsegments) for s in segment.subsegments) == list(range(6))
+
+    async def test_should_run_without_trace(self, recorder, process_pool):
+        # Setup
+        loop = asyncio.get_running_loop()
+
+        # Exercise
+        result = await loop.run_in_executor(process_pool, pow, 2, 3)
+
+        # Verify
+        assert result == 8
+        assert recorder.emitter.segments == []
+
+
+def _iter_documents(document: dict):
+    yield document
+    for child in document.get("subsegments", []):
+        yield from _iter_documents(child)
@@ -0,0 +1,182 @@
+"""Tests for deduplicating the stack traces of repeated exceptions."""
+
+from aws_xray_sdk.core.models.segment import Segment
+
+from xraysink.stacks import STACK_NAMESPACE
+from xraysink.stacks import StackDeduplicator
+
+
+def _fail(exception_type=KeyError):
+    raise exception_type("key")
+
+
+def _fail_elsewhere():
+    raise KeyError("key")
+
+
+def _record(deduplicator: StackDeduplicator, fail=_fail) -> Segment:
+    """Record an exception in a new segment, like the middleware does."""
+    segment = Segment("test")
+    try:
+        fail()
+    except Exception as ex:
+        deduplicator.add_exception(segment, ex)
+    return segment
+
+
+def _get_exception(segment: Segment):
+    (exception,) = segment.cause["exceptions"]
+    return exception
+
+
+def _get_stack_metadata(segment: Segment) -> dict:
+    return segment.metadata[STACK_NAMESPACE][_get_exception(segment).id]
+
+
+class TestStackDeduplicator:
+    def test_should_capture_stack_for_first_occurrence(self, clock):
+        # Setup
+        deduplicator = StackDeduplicator()
+
+        # Exercise
+        segment = _record(deduplicator)
+
+        # Verify
+        exception = _get_exception(segment)
+        assert exception.type == "KeyError"
+        assert exception.stack[-1]["label"] == "_fail"
+        assert segment.fault
+
+        assert segment.metadata[STACK_NAMESPACE] == {
+            exception.id: {
+                "stack_id": exception.id,
+                "trace_id": segment.trace_id,
+                "occurrence": 1,
+            }
+        }
+        assert deduplicator.captured == 1
+
+    def test_should_refer_to_first_stack_for_later_occurrences(self, clock):
+        # Setup
+        deduplicator = StackDeduplicator()
+        first = _record(deduplicator)
+
+        # Exercise
+        later = [_record(deduplicator) for _ in range(3)]
+
+        # Verify
+        first_id = _get_exception(first).id
+        for i, segment in enumerate(later):
+            exception = _get_exception(segment)
+            assert exception.type == "KeyError"
+            assert exception.message == "'key'"
+            assert not exception.stack
+            assert segment.fault
+            assert segment.metadata[STACK_NAMESPACE] == {
+                exception.id: {
+                    "stack_id": first_id,
+                    "trace_id": first.trace_id,
+                    "occurrence": i + 2,
+                }
+            }
+
+        assert deduplicator.captured == 1
+        assert deduplicator.deduplicated == 3
+
+    def test_should_capture_stack_again_in_next_window(self, clock):
+        # Setup
+        deduplicator = StackDeduplicator(window=10)
+        first = _record(deduplicator)
+
+        # Exercise
+        clock.now += 10
+        segment = _record(deduplicator)
+
+        # Verify
+        exception = _get_exception(segment)
+        assert exception.stack
+        assert exception.id != _get_exception(first).id
+        assert _get_stack_metadata(segment)["occurrence"] == 1
+
+    def test_should_capture_stack_for_each_type_and_raise_site(self, clock):
+        # Setup
+        deduplicator = StackDeduplicator()
+
+        # Exercise
+        segments = [
+            _record(deduplicator),
+            _record(deduplicator, lambda: _fail(ValueError)),
+            _record(deduplicator, _fail_elsewhere),
+        ]
+
+        # Verify
+        assert all(_get_exception(segment).stack for segment in segments)
+        assert deduplicator.captured == 3
+        assert deduplicator.deduplicated == 0
+
+    def test_should_record_each_exception_in_same_entity(self, clock):
+        # Setup
+        deduplicator = StackDeduplicator()
+        segment = Segment("test")
+
+        # Exercise
+        for fail in [_fail, _fail_elsewhere, _fail]:
+            try:
+                fail()
+            except KeyError as ex:
+                deduplicator.add_exception(segment, ex)
+
+        # Verify
+        exceptions = segment.cause["exceptions"]
+        metadata = segment.metadata[STACK_NAMESPACE]
+        assert [metadata[exception.id] for exception in exceptions] == [
+            {
+                "stack_id": exceptions[0].id,
+                "trace_id": segment.trace_id,
+                "occurrence": 1,
+            },
+            {
+                "stack_id": exceptions[1].id,
+                "trace_id": segment.trace_id,
+                "occurrence": 1,
+            },
+            {
+                "stack_id": exceptions[0].id,
+                "trace_id": segment.trace_id,
+                "occurrence": 2,
+            },
+        ]
+
+    def test_should_forget_least_recently_seen_exception(self, clock):
+        # Setup
+        deduplicator = StackDeduplicator(max_fingerprints=2)
+        _record(deduplicator)
+        _record(deduplicator, lambda: _fail(ValueError))
+        _record(deduplicator)
+
+        # Exercise
+        _record(deduplicator, _fail_elsewhere)
+        key_error = _record(deduplicator)
+        value_error = _record(deduplicator, lambda: _fail(ValueError))
+
+        # Verify
+        assert not _get_exception(key_error).stack
+        assert _get_exception(value_error).stack
+
+    def test_should_refer_to_exception_recorded_in_subsegment(self, clock):
+        # Setup
+        deduplicator = StackDeduplicator()
+        subsegment_exception = _get_exception(_record(deduplicator))
+        segment = Segment("test")
+
+        # Exercise
+        try:
+            _fail()
+        except KeyError as ex:
+            ex._recorded = True
+            ex._cause_id = subsegment_exception.id
+            deduplicator.add_exception(segment, ex)
+
+        # Verify
+        assert segment.cause == subsegment_exception.id
+        assert deduplicator.captured == 1
@@ -0,0 +1,112 @@
+"""Tests for the subsegment streaming strategies."""
+
+import gc
+import logging
+
+from aws_xray_sdk.core.models.segment import Segment
+from aws_xray_sdk.core.models.subsegment import Subsegment
+from aws_xray_sdk.core.streaming.default_streaming import DefaultStreaming
+
+from xraysink import streaming as streaming_module
+from xraysink.streaming import SegmentStreaming
+from xraysink.streaming import set_segment_streaming_threshold
+
+
+def _make_segment(subsegment_count: int) -> Segment:
+    segment = Segment("test")
+    for i in range(subsegment_count):
+        subsegment = Subsegment(f"child-{i}", "local", segment)
+        segment.add_subsegment(subsegment)
+        subsegment.close()
+        segment.decrement_ref_counter()
+    return segment
+
+
+class TestSegmentStreaming:
+    def test_should_use_segment_threshold(self):
+        # Setup
+        streaming = SegmentStreaming(DefaultStreaming(streaming_threshold=100))
+        segment = _make_segment(5)
+        streaming.set_segment_threshold(segment, 3)
+        streamed = []
+
+        # Exercise
+        eligible = streaming.is_eligible(segment)
+        streaming.stream(segment, streamed.append)
+
+        # Verify
+        assert eligible
+        assert [s.name for s in streamed] == [f"child-{i}" for i in range(5)]
+        assert segment.subsegments == []
+
+    def test_should_use_fallback_for_other_segments(self):
+        # Setup
+        streaming = SegmentStreaming(DefaultStreaming(streaming_threshold=100))
+        streaming.set_segment_threshold(_make_segment(0), 3)
+
+        # Exercise
+        eligible = streaming.is_eligible(_make_segment(5))
+
+        # Verify
+        assert not eligible
+        assert streaming.streaming_threshold == 100
+
+    def test_should_not_serialize_segment_threshold(self):
+        # Setup
+        streaming = SegmentStreaming()
+        segment = _make_segment(1)
+
+        # Exercise
+        streaming.set_segment_threshold(segment, 3)
+
+        # Verify
+        assert set(vars(segment)) == set(vars(_make_segment(1)))
+
+    def test_should_forget_segment_when_released(self):
+        # Setup
+        streaming = SegmentStreaming()
+        streaming.set_segment_threshold(_make_segment(1), 3)
+
+        # Exercise
+        gc.collect()
+
+        # Verify
+        assert len(streaming._segment_thresholds) == 0
+
+
+class TestSetSegmentStreamingThreshold:
+    def test_should_set_threshold_on_configured_strategy(self, recorder):
+        # Setup
+        streaming = SegmentStreaming()
+        recorder.configure(streaming=streaming)
+        segment = _make_segment(0)
+
+        # Exercise
+        set_segment_streaming_threshold(recorder, segment, 3)
+        result = set_segment_streaming_threshold(recorder, segment, 4)
+
+        # Verify
+        assert result is True
+        assert recorder.streaming is streaming
+        assert streaming.get_segment_threshold(segment) == 4
+
+    def test_should_not_change_recorder_configuration(
+        self, recorder, caplog, monkeypatch
+    ):
+        # Setup
+        monkeypatch.setattr(streaming_module, "_logged_missing_strategy", False)
+        original = recorder.streaming
+        segment = _make_segment(0)
+
+        # Exercise
+        first = set_segment_streaming_threshold(recorder, segment, 3)
+        second = set_segment_streaming_threshold(recorder, segment, 3)
+
+        # Verify
+        assert first is False
+        assert second is False
+        assert recorder.streaming is original
+
+        warnings = [r for r in caplog.records if r.levelno == logging.WARNING]
+        assert len(warnings) == 1, "Should only warn once"
+        assert "SegmentStreaming" in warnings[0].getMessage()
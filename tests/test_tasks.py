@@ -1,5 +1,6 @@
 """Test the background task helpers."""
 
+from asyncio import current_task
 from asyncio import gather
 from typing import Optional
 from urllib.parse import urlparse
@@ -7,8 +8,11 @@ from urllib.parse import urlparse
 import pytest
 from aws_xray_sdk.core import AsyncAWSXRayRecorder
 from aws_xray_sdk.core.models.segment import Segment
+from aws_xray_sdk.core.models.subsegment import Subsegment
 
 from xraysink.context import AsyncContext
+from xraysink.context import ContextVarAsyncContext
+from xraysink.streaming import SegmentStreaming
 from xraysink.tasks import xray_task_async
 
 pytestmark = pytest.mark.asyncio
@@ -164,14 +168,113 @@ class TestXrayTaskAsync(BaseXrayTaskTests):
         exception = segment.cause["exceptions"][0]
         assert exception.type == "ValueError"
 
+    async def test_should_start_new_trace_when_inline(self, recorder):
+        # Setup SUT function
+        @xray_task_async(inline=True)
+        async def do_something():
+            return recorder.current_segment()
 
-class TestXrayTaskAsyncNested(BaseXrayTaskTests):
-    """Test the xray_task_async() decorator when nested inside an existing segment."""
+        # Exercise
+        segment = await do_something()
+
+        # Verify
+        assert recorder.emitter.pop() is segment
+        assert getattr(segment, "parent_id", None) is None
+        await self._verify_http_segment(segment, expected_path="/do_something")
+
+
+class TestXrayTaskAsyncStreaming(BaseXrayTaskTests):
+    """Test the streaming threshold option of the xray_task_async() decorator."""
 
     @pytest.fixture()
     def recorder(self, recorder) -> AsyncAWSXRayRecorder:
+        recorder.configure(streaming=SegmentStreaming())
+        return recorder
+
+    async def test_should_stream_subsegments_above_threshold(self, recorder):
+        # Setup SUT function
+        retained_counts = []
+
+        @xray_task_async(streaming_threshold=5)
+        async def do_something():
+            for i in range(50):
+                async with recorder.in_subsegment_async(f"query-{i}"):
+                    pass
+                retained_counts.append(len(recorder.current_segment().subsegments))
+
+        # Exercise
+        await do_something()
+
+        # Verify
+        segment = recorder.emitter.pop()
+        await self._verify_core_segment(segment)
+
+        streamed = recorder.emitter.segments
+        assert streamed, "Should stream some subsegments before the segment ends"
+        assert all(isinstance(s, Subsegment) for s in streamed)
+        assert all(s.parent_id == segment.id for s in streamed)
+        assert [s.name for s in streamed + segment.subsegments] == [
+            f"query-{i}" for i in range(50)
+        ], "Every subsegment should be sent exactly once"
+
+        assert max(retained_counts) <= 6, "Should release streamed subsegments"
+
+    async def test_should_keep_open_subsegments_until_complete(self, recorder):
+        # Setup SUT function
+        @xray_task_async(streaming_threshold=2)
+        async def do_something():
+            async with recorder.in_subsegment_async("batch"):
+                for i in range(10):
+                    async with recorder.in_subsegment_async(f"query-{i}"):
+                        pass
+
+        # Exercise
+        await do_something()
+
+        # Verify
+        segment = recorder.emitter.pop()
+        streamed = recorder.emitter.segments
+        assert streamed, "Should stream children of the open subsegment"
+        assert {s.name for s in streamed} <= {f"query-{i}" for i in range(10)}
+
+        (batch,) = segment.subsegments
+        assert batch.name == "batch"
+
+    async def test_should_not_change_threshold_for_other_segments(self, recorder):
+        # Setup SUT function
+        recorder.configure(streaming_threshold=1000)
+
+        @xray_task_async(streaming_threshold=1)
+        async def do_something():
+            pass
+
+        await do_something()
+        recorder.emitter.pop()
+
+        # Exercise
+        async with recorder.in_segment_async("request"):
+            for i in range(50):
+                async with recorder.in_subsegment_async(f"query-{i}"):
+                    pass
+
+        # Verify
+        assert recorder.streaming_threshold == 1000
+        (segment,) = recorder.emitter.segments
+        assert len(segment.subsegments) == 50, "Should not stream request segment"
+
+
+class TestXrayTaskAsyncNested(BaseXrayTaskTests):
+    """Test the xray_task_async() decorator when nested inside an existing segment."""
+
+    @pytest.fixture(
+        params=[
+            pytest.param(AsyncContext, id="xraysink"),
+            pytest.param(ContextVarAsyncContext, id="xraysink-contextvars"),
+        ]
+    )
+    def recorder(self, request, recorder) -> AsyncAWSXRayRecorder:
         # Nested tasks will only work if we are using a well-behaved context
-        recorder.configure(context=AsyncContext())
+        recorder.configure(context=request.param())
         return recorder
 
     async def _verify_nested_segment(self, segments, initial_name: str, task_name):
@@ -244,3 +347,54 @@ class TestXrayTaskAsyncNested(BaseXrayTaskTests):
             initial_name="initial_segment",
             task_name="do_something",
         )
+
+    async def test_should_set_parent_in_current_task_when_inline(self, recorder):
+        # Setup SUT function
+        task_segments = []
+
+        @xray_task_async(inline=True)
+        async def do_something(a, b):
+            task_segments.append(recorder.current_segment())
+            return a + b, current_task()
+
+        # Exercise
+        async with recorder.in_segment_async("initial_segment") as segment:
+            func_result, task = await do_something(1, 2)
+            entity_after = recorder.get_trace_entity()
+
+        # Verify
+        assert func_result == 3, "Function result should be returned"
+        assert task is current_task(), "Should not create an asyncio task"
+        assert entity_after is segment, "Should restore the initial segment"
+        assert task_segments[0] is not segment
+
+        await self._verify_nested_segment(
+            recorder.emitter.segments,
+            initial_name="initial_segment",
+            task_name="do_something",
+        )
+
+    async def test_should_restore_entities_after_inline_exception(self, recorder):
+        # Setup SUT function
+        @xray_task_async(inline=True)
+        async def do_something():
+            raise ValueError("Task failed")
+
+        # Exercise
+        async with recorder.in_segment_async("initial_segment") as segment:
+            with pytest.raises(ValueError, match="Task failed"):
+                await do_something()
+
+            async with recorder.in_subsegment_async("after_task"):
+                pass
+
+        # Verify
+        initial_segment = [s for s in recorder.emitter.segments if s is segment][0]
+        assert [s.name for s in initial_segment.subsegments] == [
+            "Create Task: do_something",
+            "after_task",
+        ]
+
+        task_segment = [s for s in recorder.emitter.segments if s is not segment][0]
+        await self._verify_core_segment(task_segment, isfault=True)
+        assert len(task_segment.subsegments) == 0